@@ -11,9 +11,12 @@ class Advancer {
   // For each request to advance a simulation, communication involves
   // 1. A redis key of the form ${siteRef}:control which can have the value idle | advance | running
   //    A request to advance can only be fulfilled if the simulatoin is currently in idle state
-  // 2. A redis notification from the webserver on the channel "siteRef" with message "advance"
-  // 3. A redis notification from the alfalfa_worker on the channel "siteRef" with message "complete",
-  //    signaling that the simulation is done advancing to the simulation
+  // 2. A redis notification from the webserver on the channel "siteRef" with message "advance",
+  //    or "advance:N" to request N steps be taken before the simulation replies
+  // 3. A redis notification from the alfalfa_worker on the channel "siteRef" with message
+  //    'complete:{"time": ..., "step": ...}', signaling that the simulation is done advancing.
+  //    The alfalfa_worker sets the control state back to idle in the same atomic operation that publishes
+  //    the notification, and the payload carries the new simulation time and step count.
   constructor(redis, pub, sub) {
     this.redis = redis;
     this.pub = pub;
@@ -21,15 +24,15 @@ class Advancer {
     this.handlers = {};
 
     this.sub.on('message', (channel, message) => {
-      if (message == 'complete') {
+      if (message.startsWith('complete:')) {
         if (this.handlers.hasOwnProperty(channel)) {
-          this.handlers[channel](message);
+          this.handlers[channel](JSON.parse(message.slice('complete:'.length)));
         }
       }
     });
   }
 
-  advance(siteRefs) {
+  advance(siteRefs, steps=1) {
     let promise = new Promise((resolve, reject) => {
       let response = {};
       let pending = siteRefs.length;
@@ -38,11 +41,12 @@ class Advancer {
         const channel = siteref;
 
         // Cleanup the resrouces for advance and finalize the promise
-        let interval;
-        const finalize = (success, message='') => {
-          clearInterval(interval);
+        let timeout;
+        const finalize = (success, message='', completion={}) => {
+          clearTimeout(timeout);
+          delete this.handlers[channel];
           this.sub.unsubscribe(channel);
-          response[siteref] = { "status": success, "message": message };
+          response[siteref] = { "status": success, "message": message, "time": completion.time, "step": completion.step };
           pending = pending - 1;
           if (pending == 0) {
             resolve(response);
@@ -50,30 +54,19 @@ class Advancer {
         };
 
         const notify = () => {
-          this.handlers[channel] = () => {
-            finalize(true, 'success');
+          this.handlers[channel] = (completion) => {
+            finalize(true, 'success', completion);
           };
 
-          this.sub.subscribe(channel);
-          this.pub.publish(channel, "advance");
+          // Only request the advance once subscribed, so that the completion cannot be missed
+          this.sub.subscribe(channel, () => {
+            this.pub.publish(channel, steps > 1 ? `advance:${steps}` : "advance");
+          });
 
-          // This is a failsafe if for some reason we miss a notification
-          // that the step is complete
-          // Check if the simulation has gone back to idle
-          let intervalCounts = 0;
-          interval = setInterval(() => {
-            const control = this.redis.hget(siteref, 'control');
-            if (control == 'idle') {
-              // If the control state is idle, then assume the step has been made
-              // and reslve the advance promise, this might happen if we miss the notification for some reason
-              finalize(true, 'success');
-            } else {
-              intervalCounts += 1;
-            }
-            if (intervalCounts > 4) {
-              finalize(false, 'no simulation reply');
-            }
-          }, 500);
+          // Allow the same amount of time for each requested step
+          timeout = setTimeout(() => {
+            finalize(false, 'no simulation reply');
+          }, 2000 * steps);
         };
 
         // Put siteref:control key into "advance" state
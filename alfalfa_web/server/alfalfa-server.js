@@ -30,6 +30,7 @@ import hs from 'nodehaystack';
 import HDict from 'nodehaystack/HDict';
 import { v1 as uuidv1 } from 'uuid';
 import dbops from './dbops';
+import { overlayCurrentValues } from './current-values';
 
 var HBool = hs.HBool,
     HDateTime = hs.HDateTime,
@@ -97,19 +98,17 @@ class AlfalfaWatch extends HWatch {
     return this._lease;
   }
 
-  watchReadByIds(recs,ids,callback) {
-    if (recs.length>=ids.length) {
-      let b = new HGridBuilder();
+  watchReadByIds(ids,callback) {
+    this._db.readCurrentByIds(ids, (err, recs) => {
+      if (err) {
+        callback(err);
+        return;
+      }
       let meta = new HDictBuilder();
       meta.add('watchId',this._id);
       meta.add('lease',this._lease.val, this._lease.unit);
       callback(null, HGridBuilder.dictsToGrid(recs,meta.toDict()));
-    } else {
-      this._db.readById(ids[recs.length], false, (err, rec) => {
-        recs[recs.length] = rec;
-        this.watchReadByIds(recs, ids, callback);
-      })
-    }
+    });
   }
 
   sub(ids,callback) {
@@ -121,7 +120,7 @@ class AlfalfaWatch extends HWatch {
           { "_id": this._id },
           { $addToSet: {"subs": {$each: ids} } }
         ).then(() => {
-            this.watchReadByIds([],ids,callback);
+            this.watchReadByIds(ids,callback);
           });
       } else {
         const _watch = {
@@ -131,7 +130,7 @@ class AlfalfaWatch extends HWatch {
           "subs": ids
         };
         this.watches.insertOne(_watch).then(() => {
-          this.watchReadByIds([],ids,callback);
+          this.watchReadByIds(ids,callback);
         });
       }
     })
@@ -161,7 +160,7 @@ class AlfalfaWatch extends HWatch {
       if (watch) {
         this._dis = watch.dis;
         this._lease = watch.lease;
-        this.watchReadByIds([],watch.subs,callback);
+        this.watchReadByIds(watch.subs,callback);
       } else {
         callback(null,HGrid.EMPTY);
       }
@@ -175,7 +174,7 @@ class AlfalfaWatch extends HWatch {
       if (watch) {
         this._dis = watch.dis;
         this._lease = watch.lease;
-        this.watchReadByIds([],watch.subs,callback);
+        this.watchReadByIds(watch.subs,callback);
       } else {
         callback(null,HGrid.EMPTY);
       }
@@ -268,8 +267,9 @@ class AlfalfaServer extends HServer {
   onReadById(id, callback) {
     this.mrecs.findOne({_id: id.val}).then((doc) => {
       if( doc ) {
-        let dict = this.recToDict(doc.rec);
-        callback(null,dict);
+        overlayCurrentValues(this.redis, [doc], (err, recs) => {
+          callback(null, this.recToDict(recs[0]));
+        });
       } else {
         callback(null);
       }
@@ -278,9 +278,28 @@ class AlfalfaServer extends HServer {
     });
   };
 
+  // Read the recs of ids with a single Mongo query, and their current values with one HGETALL per site.
+  // Ids which do not exist are returned as null, as by readById when not checked.
+  readCurrentByIds(ids, callback) {
+    const vals = ids.map((id) => id.val);
+    this.mrecs.find({_id: {$in: vals}}).toArray().then((docs) => {
+      const byId = {};
+      for (const doc of docs) {
+        byId[doc._id] = doc;
+      }
+      overlayCurrentValues(this.redis, vals.map((val) => byId[val] || null), (err, recs) => {
+        callback(null, recs.map((rec) => rec ? this.recToDict(rec) : null));
+      });
+    }).catch((err) => {
+      callback(err);
+    });
+  };
+
   iterator(callback) {
     let self = this;
-    this.mrecs.find().toArray().then((array) => {
+    this.mrecs.find().toArray().then((docs) => {
+      return new Promise((resolve) => overlayCurrentValues(this.redis, docs, (err, recs) => resolve(recs)));
+    }).then((array) => {
       let index = 0;
       let length = array.length;
 
@@ -290,7 +309,7 @@ class AlfalfaServer extends HServer {
           if (!this.hasNext()) {
             return null;
           }
-          dict = self.recToDict(array[index].rec);
+          dict = self.recToDict(array[index]);
           index++;
           return dict;
         },
@@ -517,7 +536,7 @@ class AlfalfaServer extends HServer {
     const value = val ? val.val : null;
     const id = rec.id().val;
     const siteRef = rec.get('siteRef',{}).val;
-    dbops.writePoint(id, siteRef, level, value, who, dur, this.db).then((array) => {
+    dbops.writePoint(id, siteRef, level, value, who, dur, this.db, this.pub).then((array) => {
       const b = this.writeArrayToGrid(array);
       callback(null, b.toGrid());
     }).catch((err) => {
@@ -596,6 +615,10 @@ class AlfalfaServer extends HServer {
         this.pub.publish(siteRef, "stop");
       });
       callback(null,HGrid.EMPTY);
+    } else if ( action == "pauseSite" || action == "resumeSite" ) {
+      // The simulation sets its simStatus to Paused or back to Running
+      this.pub.publish(rec.id().val, action == "pauseSite" ? "pause" : "resume");
+      callback(null,HGrid.EMPTY);
     } else if ( action == "removeSite" ) {
       this.mrecs.deleteMany({site_ref: rec.id().val});
       this.writearrays.deleteMany({siteRef: rec.id().val});
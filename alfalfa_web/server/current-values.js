@@ -0,0 +1,52 @@
+// Sites run with ALFALFA_CURRENT_VALUES=redis keep the current values of their points
+// in the hash {site_ref}:cur, Mongo only has the values of the last write-behind.
+
+// Read the current values hash of each site, with one HGETALL per site sent in a single round trip.
+// Sites without a hash, or whose hash can not be read, get an empty object so that the Mongo values are used.
+function readCurrentValues(redis, siteRefs, callback) {
+  const values = {};
+  if (siteRefs.length == 0) {
+    callback(null, values);
+    return;
+  }
+  const batch = redis.batch();
+  for (const siteRef of siteRefs) {
+    batch.hgetall(`${siteRef}:cur`);
+  }
+  batch.exec((err, hashes) => {
+    siteRefs.forEach((siteRef, i) => {
+      const hash = err ? null : hashes[i];
+      values[siteRef] = hash && !(hash instanceof Error) ? hash : {};
+    });
+    callback(null, values);
+  });
+}
+
+// Return the rec of each of docs, with the current value of the points taken from Redis where there is one.
+// Missing docs (null) are returned as null.
+function overlayCurrentValues(redis, docs, callback) {
+  const siteRefs = new Set();
+  for (const doc of docs) {
+    if (doc && doc.rec.cur && doc.site_ref) {
+      siteRefs.add(doc.site_ref);
+    }
+  }
+  readCurrentValues(redis, Array.from(siteRefs), (err, values) => {
+    callback(null, docs.map((doc) => {
+      if (!doc) {
+        return null;
+      }
+      const hash = doc.rec.cur && values[doc.site_ref];
+      const value = hash ? hash[doc._id] : undefined;
+      if (value === undefined || value === null) {
+        return doc.rec;
+      }
+      return Object.assign({}, doc.rec, {curVal: `n:${value}`, curStatus: 's:ok'});
+    }));
+  });
+}
+
+module.exports = {
+  readCurrentValues,
+  overlayCurrentValues
+};
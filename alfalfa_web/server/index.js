@@ -80,6 +80,7 @@ MongoClient.connect(process.env.MONGO_URL).then((mongoClient) => {
         context: {
           ...request,
           db,
+          pub,
           advancer
         }
       })(request,response)
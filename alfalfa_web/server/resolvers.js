@@ -131,10 +131,7 @@ function runSiteResolver(args) {
   });
 }
 
-function stopSiteResolver(args) {
-      //args: {
-      //  siteRef : { type: new GraphQLNonNull(GraphQLString) },
-      //},
+function invokeSiteAction(siteRef, action) {
   return new Promise( (resolve,reject) => {
     request
     .post('/api/invokeAction')
@@ -143,8 +140,8 @@ function stopSiteResolver(args) {
     .send({
       "meta": {
         "ver": "2.0",
-        "id": `r:${args.siteRef}`,
-        "action": "s:stopSite"
+        "id": `r:${siteRef}`,
+        "action": `s:${action}`
       },
       "cols": [
         {
@@ -167,6 +164,22 @@ function stopSiteResolver(args) {
   });
 }
 
+function stopSiteResolver(args) {
+      //args: {
+      //  siteRef : { type: new GraphQLNonNull(GraphQLString) },
+      //},
+  return invokeSiteAction(args.siteRef, "stopSite");
+}
+
+// A paused site holds its simulation time until it is resumed
+function pauseSiteResolver(args) {
+  return invokeSiteAction(args.siteRef, "pauseSite");
+}
+
+function resumeSiteResolver(args) {
+  return invokeSiteAction(args.siteRef, "resumeSite");
+}
+
 function removeSiteResolver(args) {
       //args: {
       //  siteRef : { type: new GraphQLNonNull(GraphQLString) },
@@ -305,13 +318,13 @@ function sitePointResolver(siteRef, args, context) {
   });
 }
 
-function advanceResolver(advancer, siteRef) {
-  return advancer.advance(siteRef);
+function advanceResolver(advancer, siteRef, steps) {
+  return advancer.advance(siteRef, steps || 1);
 }
 
 function writePointResolver(context,siteRef, pointName, value, level) {
   return dbops.getPoint(siteRef, pointName, context.db).then( point => {
-    return dbops.writePoint(point._id, siteRef, level, value, null, null, context.db);
+    return dbops.writePoint(point._id, siteRef, level, value, null, null, context.db, context.pub);
   }).then( array => {
     return JSON.stringify(array);
   });
@@ -323,6 +336,8 @@ module.exports = {
   sitesResolver,
   runSiteResolver,
   stopSiteResolver,
+  pauseSiteResolver,
+  resumeSiteResolver,
   removeSiteResolver,
   sitePointResolver,
   simsResolver,
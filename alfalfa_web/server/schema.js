@@ -252,6 +252,26 @@ const mutationType = new GraphQLObjectType({
         resolvers.stopSiteResolver(args);
       },
     },
+    pauseSite: {
+      name: 'PauseSite',
+      type: GraphQLString,
+      args: {
+        siteRef : { type: new GraphQLNonNull(GraphQLString) },
+      },
+      resolve: (_,args,request) => {
+        return resolvers.pauseSiteResolver(args);
+      },
+    },
+    resumeSite: {
+      name: 'ResumeSite',
+      type: GraphQLString,
+      args: {
+        siteRef : { type: new GraphQLNonNull(GraphQLString) },
+      },
+      resolve: (_,args,request) => {
+        return resolvers.resumeSiteResolver(args);
+      },
+    },
     removeSite: {
       name: 'removeSite',
       type: GraphQLString,
@@ -266,10 +286,11 @@ const mutationType = new GraphQLObjectType({
       name: 'advance',
       type: GraphQLString,
       args: {
-        siteRefs : { type: new GraphQLList(new GraphQLNonNull(GraphQLString)) }
+        siteRefs : { type: new GraphQLList(new GraphQLNonNull(GraphQLString)) },
+        steps : { type: GraphQLInt }
       },
-      resolve: (_,{siteRefs, time},{advancer}) => {
-        return resolvers.advanceResolver(advancer, siteRefs);
+      resolve: (_,{siteRefs, steps},{advancer}) => {
+        return resolvers.advanceResolver(advancer, siteRefs, steps);
       },
     },
     writePoint: {
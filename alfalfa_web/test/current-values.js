@@ -0,0 +1,100 @@
+/***********************************************************************************************************************
+*  Copyright (c) 2008-2020, Alliance for Sustainable Energy, LLC, and other contributors. All rights reserved.
+*
+*  Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+*  following conditions are met:
+*
+*  (1) Redistributions of source code must retain the above copyright notice, this list of conditions and the following
+*  disclaimer.
+*
+*  (2) Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the following
+*  disclaimer in the documentation and/or other materials provided with the distribution.
+*
+*  (3) Neither the name of the copyright holder nor the names of any contributors may be used to endorse or promote products
+*  derived from this software without specific prior written permission from the respective party.
+*
+*  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND ANY CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+*  INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+*  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S), ANY CONTRIBUTORS, THE UNITED STATES GOVERNMENT, OR THE UNITED
+*  STATES DEPARTMENT OF ENERGY, NOR ANY OF THEIR EMPLOYEES, BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+*  EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+*  USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+*  STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+*  ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+***********************************************************************************************************************/
+
+const should = require('should');
+const { overlayCurrentValues } = require('../server/current-values');
+
+// Redis client with the current values hashes in memory, counting the HGETALLs and round trips
+function fakeRedis(hashes) {
+  const redis = { hgetalls: 0, execs: 0 };
+  redis.batch = () => {
+    const keys = [];
+    const batch = {
+      hgetall: (key) => {
+        redis.hgetalls++;
+        keys.push(key);
+        return batch;
+      },
+      exec: (callback) => {
+        redis.execs++;
+        callback(null, keys.map((key) => hashes[key] || null));
+      }
+    };
+    return batch;
+  };
+  return redis;
+}
+
+function point(id, siteRef, curVal) {
+  return { _id: id, site_ref: siteRef, rec: { id: `r:${id}`, cur: 'm:', curVal: curVal } };
+}
+
+describe('Current values', function() {
+  const hashes = {
+    'site-a:cur': { 'a-1': '21.5', 'a-2': '0', _time: '2020-01-01 00:15:00', _step: '3' },
+    'site-b:cur': { 'b-1': '4' }
+  };
+
+  it('should read each site hash once', function(done) {
+    const redis = fakeRedis(hashes);
+    const docs = [point('a-1', 'site-a', 'n:1'), point('a-2', 'site-a', 'n:1'), point('b-1', 'site-b', 'n:1')];
+    overlayCurrentValues(redis, docs, (err, recs) => {
+      redis.hgetalls.should.equal(2);
+      redis.execs.should.equal(1);
+      recs.map((rec) => rec.curVal).should.eql(['n:21.5', 'n:0', 'n:4']);
+      recs[0].curStatus.should.equal('s:ok');
+      done();
+    });
+  });
+
+  it('should keep the Mongo value of points without a current value', function(done) {
+    const redis = fakeRedis(hashes);
+    const docs = [point('a-3', 'site-a', 'n:7'), point('c-1', 'site-c', 'n:8')];
+    overlayCurrentValues(redis, docs, (err, recs) => {
+      recs.should.eql([docs[0].rec, docs[1].rec]);
+      done();
+    });
+  });
+
+  it('should not read Redis for recs without cur', function(done) {
+    const redis = fakeRedis(hashes);
+    const site = { _id: 'site-a', site_ref: 'site-a', rec: { id: 'r:site-a', site: 'm:' } };
+    overlayCurrentValues(redis, [site, null], (err, recs) => {
+      redis.execs.should.equal(0);
+      recs.should.eql([site.rec, null]);
+      done();
+    });
+  });
+
+  it('should fall back to the Mongo values when Redis fails', function(done) {
+    const redis = fakeRedis(hashes);
+    redis.batch = () => ({ hgetall() { return this; }, exec: (callback) => callback(new Error('down')) });
+    const doc = point('a-1', 'site-a', 'n:1');
+    overlayCurrentValues(redis, [doc], (err, recs) => {
+      recs.should.eql([doc.rec]);
+      done();
+    });
+  });
+});
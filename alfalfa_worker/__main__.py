@@ -1,7 +1,7 @@
 print("Starting Alfalfa Worker")
 
 import sys
-from alfalfa_worker.worker import Worker
+from alfalfa_worker.worker import Worker, WorkerShutdown
 import traceback
 
 
@@ -15,6 +15,8 @@ if __name__ == '__main__':
 
     try:
         worker.run()  # run the alfalfa_worker
+    except WorkerShutdown:
+        worker.worker_logger.logger.info("Worker stopped")
     except BaseException as e:  # Catch all exceptions
         tb = traceback.format_exc()
         worker.worker_logger.logger.error("Uncaught worker error {} with {}".format(e, tb))
@@ -5,7 +5,6 @@ import os
 import shutil
 import sys
 import tarfile
-import zipfile
 from subprocess import call
 import json
 
@@ -13,6 +12,7 @@ import json
 from alfalfa_worker.add_site.add_site_logger import AddSiteLogger
 from alfalfa_worker.lib import precheck_argus, make_ids_unique, replace_site_id
 from alfalfa_worker.lib.alfalfa_connections import AlfalfaConnections
+from alfalfa_worker.lib.s3_stream import extract_zip
 
 
 def rel_symlink(src, dst):
@@ -55,7 +55,7 @@ class AddSite:
         self.fmu_json = os.path.join(self.bucket_parsed_site_id_dir, 'tags.json')
 
         # Create connections
-        self.ac = AlfalfaConnections()
+        self.ac = AlfalfaConnections('add_site')
 
         # Needs to be set after files are uploaded / parsed.
         self.site_ref = None
@@ -78,6 +78,7 @@ class AddSite:
         else:
             self.add_site_logger.logger.error("Unsupported file extension: {}".format(self.file_ext))
             os.exit(1)
+        self.add_site_logger.logger.info(self.ac.startup_report())
 
     def extract_workflow_tar(self):
         """
@@ -147,7 +148,7 @@ class AddSite:
         :return:
         """
         self.add_site_logger.logger.info("add_osm for {}".format(self.key))
-        self.ac.s3_bucket.download_file(self.key, self.seed_osm_path)
+        self.ac.s3_bucket.download_file(self.key, self.seed_osm_path, Config=self.ac.s3_transfer_config)
 
         # Extract workflow tarball into this directory
         self.extract_workflow_tar()
@@ -186,10 +187,8 @@ class AddSite:
         payload_dir = os.path.join(self.bucket_parsed_site_id_dir, 'payload/')
         os.mkdir(payload_dir)
         payload_file_path = os.path.join(payload_dir, 'in.zip')
-        self.ac.s3_bucket.download_file(self.key, payload_file_path)
-        zzip = zipfile.ZipFile(payload_file_path)
         workflow_dir = os.path.join(self.bucket_parsed_site_id_dir, 'workflow/')
-        zzip.extractall(workflow_dir)
+        extract_zip(self.ac.s3_bucket, self.key, workflow_dir, payload_file_path, self.ac.s3_transfer_config)
 
         osws = glob.glob(("%s/**/*.osw" % workflow_dir), recursive=True)
         if osws:
@@ -274,7 +273,7 @@ class AddSite:
         """
         self.add_site_logger.logger.info("add_fmu for {}".format(self.key))
 
-        self.ac.s3_bucket.download_file(self.key, self.fmu_path)
+        self.ac.s3_bucket.download_file(self.key, self.fmu_path, Config=self.ac.s3_transfer_config)
 
         # External call to python2 to create FMU tags
         call(['python', 'lib/fmu_create_tags.py', self.fmu_path, self.file_name, self.fmu_json])
@@ -4,48 +4,152 @@
 from __future__ import print_function
 
 import os
-import tarfile
+import threading
+import time
 
-import boto3
-from pymongo import MongoClient
-from redis import Redis
-from influxdb import InfluxDBClient
+from .archiver import archive_directory
 
+# Size of the Mongo and Redis connection pools of each process role.  A site host runs many sites
+# on the same clients, the other roles run a single job.
+POOL_SIZES = {
+    'worker': {'mongo': 10, 'redis': 10},
+    'add_site': {'mongo': 4, 'redis': 2},
+    'run_sim': {'mongo': 2, 'redis': 2},
+    'step_sim': {'mongo': 4, 'redis': 4},
+    'site_host': {'mongo': 50, 'redis': 100},
+}
 
-class AlfalfaConnections:
-    """Create connections to data resources for Alfalfa"""
 
-    def __init__(self):
+class connection(object):
+    """
+    Decorator of an AlfalfaConnections method which creates a client, so that the client is only created,
+    and its library only imported, the first time it is used.  The time taken is recorded in startup_times.
+    """
+
+    def __init__(self, create):
+        self.create = create
+        self.name = create.__name__
+        self.__doc__ = create.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with instance.lock:
+            if self.name not in instance.__dict__:
+                start = time.time()
+                value = self.create(instance)
+                instance.startup_times[self.name] = time.time() - start
+                # Later lookups find the client in the instance instead of calling the decorator
+                instance.__dict__[self.name] = value
+        return instance.__dict__[self.name]
+
+
+class AlfalfaConnections(object):
+    """
+    Connections to data resources for Alfalfa.  Each client is created the first time it is used, so a
+    process which only needs Mongo and Redis never sets up SQS, S3 or Influx.
+    """
+
+    def __init__(self, role='step_sim'):
         """
-        boto3 is the AWS SDK for Python for different types of services (S3, EC2, etc.)
+        :param role: role of the process, one of POOL_SIZES, which sizes the Mongo and Redis connection pools.
+                     The ALFALFA_MONGO_POOL_SIZE and ALFALFA_REDIS_POOL_SIZE environment variables override it.
         """
-        # boto3
-        self.sqs = boto3.resource('sqs', region_name=os.environ['REGION'], endpoint_url=os.environ['JOB_QUEUE_URL'])
-        self.sqs_queue = self.sqs.Queue(url=os.environ['JOB_QUEUE_URL'])
-        self.s3 = boto3.resource('s3', region_name=os.environ['REGION'], endpoint_url=os.environ['S3_URL'])
-        self.s3_bucket = self.s3.Bucket(os.environ['S3_BUCKET'])
-
-        # Redis
-        self.redis = Redis(host=os.environ['REDIS_HOST'])
-        self.redis_pubsub = self.redis.pubsub()
-
-        # Mongo
-        self.mongo_client = MongoClient(os.environ['MONGO_URL'])
-        self.mongo_db = self.mongo_client[os.environ['MONGO_DB_NAME']]
-        self.mongo_db_recs = self.mongo_db.recs
-        self.mongo_db_write_arrays = self.mongo_db.writearrays
-        self.mongo_db_sims = self.mongo_db.sims
+        self.role = role
+        sizes = POOL_SIZES.get(role, POOL_SIZES['step_sim'])
+        self.mongo_pool_size = int(os.environ.get('ALFALFA_MONGO_POOL_SIZE', sizes['mongo']))
+        self.redis_pool_size = int(os.environ.get('ALFALFA_REDIS_POOL_SIZE', sizes['redis']))
+        self.lock = threading.RLock()
+        # Seconds taken to create each client
+        self.startup_times = {}
 
         # InfluxDB
         self.historian_enabled = os.environ.get('HISTORIAN_ENABLE', False) == 'true'
-        if self.historian_enabled:
-            self.influx_db_name = os.environ['INFLUXDB_DB']
-            self.influx_client = InfluxDBClient(host=os.environ['INFLUXDB_HOST'],
-                                                username=os.environ['INFLUXDB_ADMIN_USER'],
-                                                password=os.environ['INFLUXDB_ADMIN_PASSWORD'])
-        else:
-            self.influx_db_name = None
-            self.influx_client = None
+        self.influx_db_name = os.environ['INFLUXDB_DB'] if self.historian_enabled else None
+
+    # boto3 is the AWS SDK for Python for different types of services (S3, EC2, etc.)
+    @connection
+    def sqs(self):
+        import boto3
+        return boto3.resource('sqs', region_name=os.environ['REGION'], endpoint_url=os.environ['JOB_QUEUE_URL'])
+
+    @connection
+    def sqs_queue(self):
+        return self.sqs.Queue(url=os.environ['JOB_QUEUE_URL'])
+
+    @connection
+    def s3_transfer_config(self):
+        """
+        TransferConfig of the S3 downloads and uploads.  Files larger than ALFALFA_S3_MULTIPART_MB are
+        transferred in parts of that size by ALFALFA_S3_CONCURRENCY threads.
+        """
+        from boto3.s3.transfer import TransferConfig
+        part_size = int(os.environ.get('ALFALFA_S3_MULTIPART_MB', 16)) * 1024 * 1024
+        return TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size,
+                              max_concurrency=int(os.environ.get('ALFALFA_S3_CONCURRENCY', 8)))
+
+    @connection
+    def s3(self):
+        import boto3
+        from botocore.config import Config
+        # Enough connections for the concurrent transfers of the transfer config and the ranged reads of s3_stream
+        config = Config(max_pool_connections=max(10, 2 * self.s3_transfer_config.max_concurrency))
+        return boto3.resource('s3', region_name=os.environ['REGION'], endpoint_url=os.environ['S3_URL'],
+                              config=config)
+
+    @connection
+    def s3_bucket(self):
+        return self.s3.Bucket(os.environ['S3_BUCKET'])
+
+    # Redis
+    @connection
+    def redis(self):
+        from redis import BlockingConnectionPool, Redis
+        # Wait for a connection to be released rather than fail once the pool is in use
+        pool = BlockingConnectionPool(host=os.environ['REDIS_HOST'], max_connections=self.redis_pool_size)
+        return Redis(connection_pool=pool)
+
+    @connection
+    def redis_pubsub(self):
+        return self.redis.pubsub()
+
+    # Mongo
+    @connection
+    def mongo_client(self):
+        from pymongo import MongoClient
+        return MongoClient(os.environ['MONGO_URL'], maxPoolSize=self.mongo_pool_size)
+
+    @connection
+    def mongo_db(self):
+        return self.mongo_client[os.environ['MONGO_DB_NAME']]
+
+    @connection
+    def mongo_db_recs(self):
+        return self.mongo_db.recs
+
+    @connection
+    def mongo_db_write_arrays(self):
+        return self.mongo_db.writearrays
+
+    @connection
+    def mongo_db_sims(self):
+        return self.mongo_db.sims
+
+    @connection
+    def influx_client(self):
+        if not self.historian_enabled:
+            return None
+        from influxdb import InfluxDBClient
+        return InfluxDBClient(host=os.environ['INFLUXDB_HOST'],
+                              username=os.environ['INFLUXDB_ADMIN_USER'],
+                              password=os.environ['INFLUXDB_ADMIN_PASSWORD'])
+
+    def startup_report(self):
+        """Return the time taken to create each client so far, slowest first, to log"""
+        times = sorted(self.startup_times.items(), key=lambda item: -item[1])
+        total = sum(t for _, t in times)
+        return "connections for {} created in {:.3f}s: {}".format(
+            self.role, total, ', '.join('{} {:.3f}s'.format(name, t) for name, t in times) or 'none')
 
     def add_site_to_mongo(self, haystack_json, site_ref):
         """
@@ -87,22 +191,15 @@ class AlfalfaConnections:
         """
         # get the id of site tag(remove the 'r:')
         if site_ref:
-            def reset(tarinfo):
-                tarinfo.uid = tarinfo.gid = 0
-                tarinfo.uname = tarinfo.gname = "root"
-
-                return tarinfo
-
             tarname = "%s.tar.gz" % site_ref
-            tar = tarfile.open(tarname, "w:gz")
-            tar.add(bucket_parsed_site_id_dir, filter=reset, arcname=site_ref)
-            tar.close()
-
             upload_location = "parsed/%s" % tarname
+            import boto3.exceptions
+            import botocore.exceptions
             try:
-                self.s3_bucket.upload_file(tarname, upload_location)
+                # The tarball is compressed and uploaded as it is written, never to a local file
+                archive_directory(bucket_parsed_site_id_dir, site_ref, self.s3_bucket, upload_location)
                 return True, upload_location
-            except boto3.exceptions.S3UploadFailedError as e:
+            except (boto3.exceptions.S3UploadFailedError, botocore.exceptions.ClientError, IOError) as e:
                 return False, e
             except FileNotFoundError as e:
                 return False, e
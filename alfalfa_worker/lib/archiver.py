@@ -0,0 +1,294 @@
+from __future__ import print_function
+
+import fnmatch
+import gzip
+import os
+import struct
+import sys
+import tarfile
+import threading
+import time
+import zlib
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+# S3 requires every part of a multipart upload, except the last, to be at least 5 MB
+PART_SIZE = 16 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+# Size of the deflate window, the end of the previous block primes the compression of the next
+WINDOW_SIZE = 32 * 1024
+ZDICT_SUPPORTED = sys.version_info >= (3, 3)
+
+
+def env_patterns(name):
+    """Return the comma separated glob patterns of an environment variable as a list"""
+    return [p.strip() for p in os.environ.get(name, '').split(',') if p.strip()]
+
+
+def reset_owner(tarinfo):
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    return tarinfo
+
+
+def matches(path, patterns):
+    """Return True if path, relative to the archived directory, or its file name match any of the patterns"""
+    name = os.path.basename(path)
+    for pattern in patterns:
+        if fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+class MultipartUploadWriter(object):
+    """
+    Write only, file like object which uploads what is written to it to an S3 object with a multipart
+    upload, so that the data never needs to be stored on disk.  Parts are uploaded by a background
+    thread while the next part is written.  Data smaller than one part is uploaded with a single PUT.
+    """
+
+    def __init__(self, s3_bucket, key, part_size=PART_SIZE):
+        self.s3_object = s3_bucket.Object(key)
+        self.key = key
+        self.part_size = part_size
+
+        self.buffer = []
+        self.buffered = 0
+        self.bytes_written = 0
+        self.upload = None
+        self.part_count = 0
+        self.parts = []
+        self.error = None
+        self.aborted = False
+        # At most one part waits while another is uploaded
+        self.queue = Queue(maxsize=1)
+        self.thread = None
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.bytes_written += len(data)
+        if self.buffered >= self.part_size:
+            self._send(b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def _upload_parts(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            number, data = item
+            if self.error is not None:
+                continue
+            try:
+                response = self.upload.Part(number).upload(Body=data)
+                self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+            except Exception as e:
+                self.error = e
+
+    def _send(self, data):
+        if self.error is not None:
+            self.abort()
+            raise IOError("Upload of {} failed: {}".format(self.key, self.error))
+        if self.upload is None:
+            self.upload = self.s3_object.initiate_multipart_upload()
+            self.thread = threading.Thread(target=self._upload_parts)
+            self.thread.daemon = True
+            self.thread.start()
+        self.part_count += 1
+        self.queue.put((self.part_count, data))
+
+    def close(self):
+        """Upload the remaining data and complete the upload"""
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if self.upload is None:
+            self.s3_object.put(Body=data)
+            return
+        if data:
+            self._send(data)
+        self._stop_thread()
+        if self.error is not None:
+            self.abort()
+            raise IOError("Upload of {} failed: {}".format(self.key, self.error))
+        parts = sorted(self.parts, key=lambda part: part['PartNumber'])
+        self.upload.complete(MultipartUpload={'Parts': parts})
+
+    def _stop_thread(self):
+        """Let the upload thread finish the queued parts and wait for it"""
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def abort(self):
+        """Stop the upload thread and abort the multipart upload, aborting more than once does nothing"""
+        self._stop_thread()
+        if self.upload is not None and not self.aborted:
+            self.aborted = True
+            self.upload.abort()
+
+
+def compress_block(block, dictionary, level, last):
+    """Compress a block to raw deflate data, primed with the end of the previous block"""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(block)
+    # A sync flush ends the block on a byte boundary without marking it as the final block,
+    # so the blocks can be concatenated into one deflate stream
+    return data + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter(object):
+    """
+    Write only, file like object which gzip compresses what is written to it into fileobj using several
+    threads.  The data is split in blocks which are deflated independently, and concatenated into a
+    single gzip member which any gzip reader can decompress.  zlib releases the GIL while it compresses,
+    so the threads run in parallel.
+
+    Priming each block with the end of the previous block needs the zdict of Python 3, on Python 2 the
+    data is compressed by a single thread with gzip.
+    """
+
+    def __init__(self, fileobj, threads=None, level=6, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        if threads is None:
+            threads = int(os.environ.get('ALFALFA_ARCHIVE_THREADS', 0))
+        if not threads:
+            threads = os.cpu_count() if hasattr(os, 'cpu_count') else 1
+        self.parallel = ZDICT_SUPPORTED and ThreadPoolExecutor is not None and threads > 1
+
+        if not self.parallel:
+            self.gzip = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level)
+            return
+
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = 2 * threads
+        self.pending = []
+        self.buffer = []
+        self.buffered = 0
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        # gzip header: magic, deflate, no flags, mtime, no extra flags, unknown OS
+        self.fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\xff')
+
+    def write(self, data):
+        if not self.parallel:
+            self.gzip.write(data)
+            return
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self._submit(b''.join(self.buffer), last=False)
+            self.buffer = []
+            self.buffered = 0
+
+    def flush(self):
+        pass
+
+    def _submit(self, block, last):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.executor.submit(compress_block, block, self.dictionary, self.level, last))
+        self.dictionary = block[-WINDOW_SIZE:]
+        # Write the compressed blocks in order, keeping a bounded number in flight
+        while self.pending and (len(self.pending) >= self.max_pending or self.pending[0].done()):
+            self.fileobj.write(self.pending.pop(0).result())
+
+    def close(self):
+        if not self.parallel:
+            self.gzip.close()
+            return
+        self._submit(b''.join(self.buffer), last=True)
+        self.buffer = []
+        for future in self.pending:
+            self.fileobj.write(future.result())
+        self.pending = []
+        self.executor.shutdown()
+        self.fileobj.write(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+
+
+def archive_directory(src_dir, arcname, s3_bucket, key, exclude=None, separate=None, threads=None):
+    """
+    Archive a directory as a tar.gz streamed to S3, without writing the archive to disk.
+
+    :param src_dir: directory to archive
+    :param arcname: name of the directory in the archive
+    :param s3_bucket: boto3 Bucket to upload to
+    :param key: S3 key of the archive
+    :param exclude: glob patterns of the files, relative to src_dir, to leave out of the archive
+    :param separate: glob patterns of the files to upload on their own, under {key}.files/, instead of
+                     in the archive.  Large files are then downloadable without the whole archive.
+    :param threads: number of compression threads, defaults to ALFALFA_ARCHIVE_THREADS or the CPU count
+    :return: dict describing the archive, to record in the sims document
+    """
+    exclude = exclude or []
+    separate = separate or []
+    separated = {}
+    excluded = []
+
+    def tar_filter(tarinfo):
+        path = os.path.relpath(tarinfo.name, arcname)
+        if tarinfo.isfile():
+            if matches(path, exclude):
+                excluded.append(path)
+                return None
+            if matches(path, separate):
+                separated[path] = '{}.files/{}'.format(key, path)
+                return None
+        return reset_owner(tarinfo)
+
+    writer = MultipartUploadWriter(s3_bucket, key)
+    try:
+        gz = ParallelGzipWriter(writer, threads=threads)
+        tar = tarfile.open(fileobj=gz, mode='w|')
+        tar.add(src_dir, arcname=arcname, filter=tar_filter)
+        tar.close()
+        gz.close()
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    for path, file_key in separated.items():
+        s3_bucket.upload_file(os.path.join(src_dir, path), file_key)
+
+    return {
+        'format': 'tar.gz',
+        'compression': 'gzip-parallel' if gz.parallel else 'gzip',
+        'bytes': writer.bytes_written,
+        'excluded': sorted(excluded),
+        'separate': separated,
+    }
+
+
+def archive_results(src_dir, arcname, s3_bucket, key):
+    """
+    Archive the results of a simulation with archive_directory, leaving out the files matching the
+    ALFALFA_ARCHIVE_EXCLUDE patterns and storing the files matching the ALFALFA_ARCHIVE_SEPARATE patterns
+    on their own.  Both are comma separated glob patterns.
+    """
+    return archive_directory(src_dir, arcname, s3_bucket, key,
+                             exclude=env_patterns('ALFALFA_ARCHIVE_EXCLUDE'),
+                             separate=env_patterns('ALFALFA_ARCHIVE_SEPARATE'))
@@ -0,0 +1,242 @@
+from __future__ import print_function
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+
+from .s3_stream import extract_tar
+
+
+@contextmanager
+def file_lock(path, mode=fcntl.LOCK_EX):
+    """
+    Hold an flock on path for the duration of the context.  With LOCK_NB in mode, IOError is raised
+    if the lock is held by another process.
+    """
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def tree_size(path):
+    """Return the total size in bytes of the files under path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if not os.path.islink(file_path):
+                total += os.path.getsize(file_path)
+    return total
+
+
+def link_tree(src, dst):
+    """Hardlink the files under src into dst, creating the directories and copying symlinks"""
+    for root, dirs, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target_root):
+            os.makedirs(target_root)
+        for name in dirs:
+            dir_path = os.path.join(root, name)
+            if os.path.islink(dir_path):
+                os.symlink(os.readlink(dir_path), os.path.join(target_root, name))
+        for name in files:
+            file_path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.lexists(target):
+                os.remove(target)
+            if os.path.islink(file_path):
+                os.symlink(os.readlink(file_path), target)
+            else:
+                os.link(file_path, target)
+
+
+class ArtifactCache(object):
+    """
+    Node local cache of the extracted site tarballs in S3, keyed by the ETag of the S3 object so that a
+    tarball which is re-uploaded is fetched again.  Entries are materialized into the simulation directory
+    either by copy (copy-on-write where the filesystem supports reflinks) or by hardlinks, for models
+    which do not modify their files in place.  The least recently used entries are evicted once the
+    cache grows beyond max_bytes.
+
+    Hits, misses and evictions are counted in stats.json of the cache directory, for all of the processes
+    sharing the cache.
+    """
+
+    def __init__(self, s3_bucket, cache_dir=None, max_bytes=None, logger=None):
+        """
+        :param s3_bucket: boto3 Bucket to download the tarballs from
+        :param cache_dir: directory of the cache, defaults to the ALFALFA_ARTIFACT_CACHE_DIR environment
+                          variable or /simulate/.cache/artifacts
+        :param max_bytes: size of the cache before entries are evicted, defaults to the
+                          ALFALFA_ARTIFACT_CACHE_BYTES environment variable or 5 GB
+        :param logger: logger to report hits and misses to
+        """
+        self.s3_bucket = s3_bucket
+        if cache_dir is None:
+            cache_dir = os.environ.get('ALFALFA_ARTIFACT_CACHE_DIR', '/simulate/.cache/artifacts')
+        self.cache_dir = cache_dir
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('ALFALFA_ARTIFACT_CACHE_BYTES', 5 * 1024 ** 3))
+        self.max_bytes = max_bytes
+        self.logger = logger if logger is not None else logging.getLogger('alfalfa_worker')
+
+        if not os.path.isdir(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        self.lock_path = os.path.join(self.cache_dir, '.lock')
+        self.stats_path = os.path.join(self.cache_dir, 'stats.json')
+
+    def entry_name(self, etag):
+        return etag.strip('"').replace('/', '_')
+
+    def fetch(self, key, destination, link=False):
+        """
+        Extract the tarball at key in S3 into destination, from the cache if possible.
+
+        :param key: S3 key of the tar.gz
+        :param destination: directory to extract the tarball into
+        :param link: True to hardlink the files from the cache, only for models which never modify
+                     their files in place.  Otherwise the files are copied.
+        :return: True if the tarball was in the cache
+        """
+        try:
+            etag = self.s3_bucket.Object(key).e_tag
+        except Exception as e:
+            # Without an ETag the cache can not be validated, extract the tarball directly
+            self.logger.warning("Unable to read the ETag of {}, bypassing the artifact cache: {}".format(key, e))
+            self.download_and_extract(key, destination)
+            return False
+
+        name = self.entry_name(etag)
+        entry = os.path.join(self.cache_dir, name)
+        entry_lock = entry + '.lock'
+
+        with file_lock(entry_lock):
+            hit = os.path.isdir(entry)
+            if not hit:
+                self.populate(key, entry)
+            # Mark the entry as recently used
+            os.utime(entry, None)
+            self.materialize(entry, destination, link)
+
+        self.record('hits' if hit else 'misses')
+        self.logger.info("Artifact cache {} for {} ({})".format('hit' if hit else 'miss', key, name))
+        if not hit:
+            self.evict(keep=name)
+        return hit
+
+    def download_and_extract(self, key, destination):
+        """Extract the tarball as it is streamed from S3"""
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+        extract_tar(self.s3_bucket.Object(key), destination)
+
+    def populate(self, key, entry):
+        """Download and extract key into a new cache entry"""
+        tmp_entry = '{}.tmp-{}'.format(entry, os.getpid())
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        try:
+            self.download_and_extract(key, tmp_entry)
+            with open(tmp_entry + '.size', 'w') as f:
+                f.write(str(tree_size(tmp_entry)))
+            os.rename(tmp_entry + '.size', entry + '.size')
+            os.rename(tmp_entry, entry)
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if os.path.exists(tmp_entry + '.size'):
+                os.remove(tmp_entry + '.size')
+
+    def materialize(self, entry, destination, link):
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+        if link:
+            try:
+                link_tree(entry, destination)
+                return
+            except OSError as e:
+                # e.g. the cache is on a different filesystem than the destination
+                self.logger.info("Unable to hardlink {}, copying instead: {}".format(entry, e))
+        subprocess.check_call(['cp', '-a', '--reflink=auto', entry + '/.', destination])
+
+    def entries(self):
+        """Return a list of (mtime, name, size) of the cache entries"""
+        result = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or '.' in name or not os.path.isdir(path):
+                continue
+            try:
+                with open(path + '.size') as f:
+                    size = int(f.read())
+            except (IOError, OSError, ValueError):
+                size = tree_size(path)
+            result.append((os.path.getmtime(path), name, size))
+        return result
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache is no larger than max_bytes.  Entries in
+        use by another process are skipped.
+
+        :param keep: name of an entry not to evict
+        :return: list of evicted entry names
+        """
+        evicted = []
+        with file_lock(self.lock_path):
+            entries = sorted(self.entries())
+            total = sum(size for _, _, size in entries)
+            for _, name, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                entry = os.path.join(self.cache_dir, name)
+                try:
+                    with file_lock(entry + '.lock', fcntl.LOCK_EX | fcntl.LOCK_NB):
+                        shutil.rmtree(entry)
+                        if os.path.exists(entry + '.size'):
+                            os.remove(entry + '.size')
+                except (IOError, OSError):
+                    continue
+                total -= size
+                evicted.append(name)
+        for _ in evicted:
+            self.record('evictions')
+        return evicted
+
+    def record(self, counter):
+        """Increment a counter of stats.json"""
+        with file_lock(self.lock_path):
+            stats = self.stats()
+            stats[counter] = stats.get(counter, 0) + 1
+            stats['updated'] = time.time()
+            tmp_path = '{}.tmp-{}'.format(self.stats_path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(stats, f)
+            os.rename(tmp_path, self.stats_path)
+
+    def stats(self):
+        """
+        Return the hit, miss and eviction counts of the cache
+
+        :return: dict of {'hits': int, 'misses': int, 'evictions': int}
+        """
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        try:
+            with open(self.stats_path) as f:
+                stats.update(json.load(f))
+        except (IOError, OSError, ValueError):
+            pass
+        return stats
@@ -0,0 +1,116 @@
+from __future__ import print_function
+
+import logging
+import os
+import threading
+
+# Redis hash of the current values of a site's outputs, {point_id: value}.  The fields TIME_FIELD
+# and STEP_FIELD hold the simulation time and step of the values.
+CURRENT_VALUES_KEY = '{}:cur'
+TIME_FIELD = '_time'
+STEP_FIELD = '_step'
+
+
+def current_values_enabled():
+    """Return True if the current values are stored in Redis, set by ALFALFA_CURRENT_VALUES=redis"""
+    return os.environ.get('ALFALFA_CURRENT_VALUES', 'mongo') == 'redis'
+
+
+class CurrentValueStore(object):
+    """
+    Store the current values of a site's outputs in a Redis hash, written with a single HSET per step,
+    so that stepping does not write to Mongo.  A write-behind thread copies the latest values to the Mongo
+    recs through an OutputPublisher every flush_interval seconds, the values of the steps in between are
+    only in Redis.  The web server reads the current values from the hash.
+    """
+
+    def __init__(self, redis, site_id, publisher, flush_interval=None, logger=None):
+        """
+        :param redis: Redis client
+        :param site_id: site of the outputs
+        :param publisher: OutputPublisher which writes the current values to Mongo
+        :param flush_interval: seconds between writes to Mongo, defaults to the ALFALFA_CURRENT_VALUES_FLUSH
+                               environment variable or 5
+        :param logger: logger to report failed flushes to, defaults to the 'simulation' logger
+        """
+        self.redis = redis
+        self.key = CURRENT_VALUES_KEY.format(site_id)
+        self.publisher = publisher
+        if flush_interval is None:
+            flush_interval = float(os.environ.get('ALFALFA_CURRENT_VALUES_FLUSH', 5))
+        self.flush_interval = flush_interval
+        self.logger = logger if logger is not None else logging.getLogger('simulation')
+
+        # Values written to Redis since the last flush to Mongo
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='current-values')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def publish(self, outputs, sim_time=None, step=None):
+        """
+        Write the current values of outputs to Redis, they are written to Mongo by the next flush
+
+        :param outputs: dict of {haystack_point_id: value}
+        :param sim_time: simulation time of the values
+        :param step: simulation step of the values
+        """
+        fields = []
+        for output_id, value in outputs.items():
+            fields.extend((output_id, value))
+        if sim_time is not None:
+            fields.extend((TIME_FIELD, str(sim_time)))
+        if step is not None:
+            fields.extend((STEP_FIELD, step))
+        if fields:
+            # A single HSET of all of the fields, which needs Redis 4
+            self.redis.execute_command('HSET', self.key, *fields)
+        with self.lock:
+            self.pending.update(outputs)
+
+    def flush(self):
+        """
+        Write the values published since the last flush to Mongo.  If the write fails the values are kept
+        for the next flush, unless newer values of the same points were published in the meantime.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            self.publisher.publish(pending)
+        except Exception:
+            with self.lock:
+                pending.update(self.pending)
+                self.pending = pending
+            raise
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.error("Unable to flush the current values to Mongo: {}".format(e))
+
+    def close(self):
+        """
+        Stop the flusher, write the last values to Mongo and remove the hash.  The hash is kept if the
+        last values could not be written, so that they are not lost.
+
+        :return: True if the last values were written to Mongo
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error("Unable to flush the current values to Mongo, keeping {}: {}".format(self.key, e))
+            return False
+        self.redis.delete(self.key)
+        return True
@@ -9,14 +9,18 @@ test case FMU.
 
 '''
 
-import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 import zipfile
-from scipy import interpolate
 import warnings
+import hashlib
 import os
 import json
+import shutil
+from collections import OrderedDict
+
+# Version of the cached data table format, change it to invalidate the cache
+DATA_CACHE_VERSION = 1
 
 
 class Data_Manager(object):
@@ -54,6 +58,12 @@ class Data_Manager(object):
         with open(os.path.join(data_dir, 'categories.json'), 'r') as f:
             self.categories = json.loads(f.read())
 
+        # Interpolation kernel of each data column, built on first use
+        self._kernels = None
+        # Most recently used windows of data returned by get_data
+        self._windows = OrderedDict()
+        self.window_cache_size = 32
+
     def append_csv_data(self):
         '''Append data from any .csv file within the Resources folder
         of the testcase. The .csv file must contain a 'time' column
@@ -150,7 +160,7 @@ class Data_Manager(object):
         self.z_fmu.close()
 
     def get_data(self, horizon=24 * 3600, interval=None, index=None,
-                 category=None, plot=False):
+                 category=None, plot=False, as_arrays=False):
         '''Retrieve test case data from the fmu. The data
         is stored within the csv files that are
         located in the resources folder of the wrapped.fmu.
@@ -175,6 +185,8 @@ class Data_Manager(object):
             The possible options are specified at categories.json.
         plot : Boolean
             True if desired to plot the retrieved data
+        as_arrays : Boolean
+            True to return read-only numpy arrays instead of lists
 
         Returns
         -------
@@ -186,7 +198,8 @@ class Data_Manager(object):
         -----
         The read and pre-process of the data happens only
         once (at load_data_and_kpisjson) to reduce the computational
-        load during the co-simulation
+        load during the co-simulation. The most recent windows
+        requested by horizon and interval are kept in a cache.
 
         '''
 
@@ -194,12 +207,6 @@ class Data_Manager(object):
         if not hasattr(self.case, 'data'):
             self.load_data_and_kpisjson()
 
-        # Filter the requested data columns
-        if category is not None:
-            data_slice = self.case.data.loc[:, self.categories[category]]
-        else:
-            data_slice = self.case.data
-
         # If no index use horizon and interval
         if index is None:
             # Use the test case start time
@@ -208,39 +215,93 @@ class Data_Manager(object):
             # Reindex to the desired interval. Use step if none
             if interval is None:
                 interval = self.case.step
-            index = np.arange(start, stop, interval).astype(int)
-
-        # Reindex to the desired index
-        data_slice_reindexed = data_slice.reindex(index)
-
-        for key in data_slice_reindexed.keys():
-            # Use linear interpolation for continuous variables
-            if key in self.categories['weather']:
-                f = interpolate.interp1d(self.case.data.index,
-                                         self.case.data[key], kind='linear')
-            # Use forward fill for discrete variables
-            else:
-                f = interpolate.interp1d(self.case.data.index,
-                                         self.case.data[key], kind='zero')
-            data_slice_reindexed.loc[:, key] = f(index)
+            key = (start, horizon, interval, category)
+            data = self._windows.pop(key, None)
+            if data is None:
+                index = np.arange(start, stop, interval).astype(int)
+                data = self._interpolate(index, category)
+            # Keep the window as the most recently used
+            self._windows[key] = data
+            while len(self._windows) > self.window_cache_size:
+                self._windows.popitem(last=False)
+        else:
+            data = self._interpolate(index, category)
 
         if plot:
+            # Imported here, pyplot is slow to import and only needed to plot
+            import matplotlib.pyplot as plt
             if category is None:
-                to_plot = data_slice_reindexed.keys()
+                to_plot = [k for k in data.keys() if k != 'time']
             else:
                 to_plot = self.categories[category]
             for var in to_plot:
-                data_slice_reindexed[var].plot()
+                plt.plot(data['time'], data[var], label=var)
                 plt.legend()
                 plt.show()
 
-        # Reset the index to keep the 'time' column in the data
-        # Transform data frame to dictionary
-        return data_slice_reindexed.reset_index().to_dict('list')
+        if as_arrays:
+            return dict(data)
+        return dict((k, v.tolist()) for k, v in data.items())
+
+    def _interpolate(self, index, category):
+        '''Interpolate the data columns of a category at the times of index.
+
+        Parameters
+        ----------
+        index : numpy array
+            time vector for which the data points are requested.
+        category : string
+            Type of data to retrieve, or None for all of the data.
+
+        Returns
+        -------
+        data: OrderedDict
+            Read-only arrays of the time and of each data column
+            {'time': <index>, <variable_name>:<variable_trajectory>}
+
+        '''
+
+        if self._kernels is None:
+            self._build_kernels()
+
+        index = np.array(index)
+        if category is not None:
+            keys = self.categories[category]
+        else:
+            keys = list(self.case.data.keys())
+
+        data = OrderedDict()
+        data['time'] = index
+        for key in keys:
+            x, y, linear = self._kernels[key]
+            # Use linear interpolation for continuous variables
+            if linear:
+                data[key] = np.interp(index, x, y)
+            # Use forward fill for discrete variables
+            else:
+                position = np.searchsorted(x, index, side='right') - 1
+                data[key] = y[np.clip(position, 0, len(y) - 1)]
+        for values in data.values():
+            values.flags.writeable = False
+        return data
+
+    def _build_kernels(self):
+        '''Extract the time and values of each data column once, for
+        the interpolation in get_data.
+
+        '''
+
+        x = np.asarray(self.case.data.index, dtype=float)
+        self._kernels = {}
+        for key in self.case.data.keys():
+            y = np.asarray(self.case.data[key], dtype=float)
+            self._kernels[key] = (x, y, key in self.categories['weather'])
 
     def load_data_and_kpisjson(self):
         '''Load the data and kpis.json from the resources folder of the fmu.
-        Resample it with the specified time interval.
+        Resample it with the specified time interval. The resampled data
+        table is cached on disk, keyed by the hash of the fmu, and memory-
+        mapped when the same fmu is loaded again.
 
         '''
 
@@ -259,58 +320,150 @@ class Data_Manager(object):
             if f.startswith('resources/') and f.endswith('.csv'):
                 files.append(f)
 
-        # Find the minimum sampling resolution
-        sampling = 3600.
-        for f in files:
-            df = pd.read_csv(z_fmu.open(f), comment='#')
-            if 'time' in df.keys():
-                new_sampling = df.iloc[1]['time'] - df.iloc[0]['time']
-                if new_sampling < sampling:
-                    sampling = new_sampling
+        # Use the table cached for this fmu if there is one, otherwise
+        # build it and add it to the cache
+        cache_path = self._data_cache_path()
+        table = self._load_cached_data(cache_path)
+        if table is None:
+            table = self._build_data_table(z_fmu, files)
+            self._save_cached_data(cache_path, *table)
+        index, columns, values = table
 
-        # Define the index for one year with the minimum sampling found
-        index = np.arange(0., 3.1536e+7, sampling, dtype='int')
+        # Close the fmu
+        z_fmu.close()
 
-        # Find all data keys
-        all_keys = []
-        for category in self.categories:
-            all_keys.extend(self.categories[category])
+        self.case.data = pd.DataFrame(values, index=pd.Index(index, name='time'),
+                                      columns=columns, copy=False)
+        self._kernels = None
+        self._windows.clear()
+
+    def _build_data_table(self, z_fmu, files):
+        '''Build the test case data table for one year from the csv files
+        of the fmu, sampled at the minimum sampling of the files.
 
-        # Initialize test case data frame
-        self.case.data = \
-            pd.DataFrame(index=index, columns=all_keys).rename_axis('time')
+        Parameters
+        ----------
+        z_fmu : zipfile.ZipFile
+            The fmu zip file
+        files : list of str
+            Names of the csv files within the fmu
 
-        # Load the test case data
+        Returns
+        -------
+        index : numpy array
+            Time of each row in seconds
+        columns : list of str
+            Data keys of all of the categories
+        values : numpy array
+            Float values of shape (len(index), len(columns)), NaN where
+            no data is available
+
+        '''
+
+        # Read each file once
+        frames = []
         for f in files:
             df = pd.read_csv(z_fmu.open(f), comment='#')
-            keys = df.keys()
-            if 'time' in keys:
-                for key in keys.drop('time'):
-                    for category in self.categories:
-                        # Use linear interpolation for continuous variables
-                        if key in self.categories[category] and \
-                                category == 'weather':
-                            g = interpolate.interp1d(df['time'], df[key],
-                                                     kind='linear')
-                            self.case.data.loc[:, key] = \
-                                g(self.case.data.index)
-                        # Use forward fill for discrete variables
-                        elif key in self.categories[category]:
-                            g = interpolate.interp1d(df['time'], df[key],
-                                                     kind='zero')
-                            self.case.data.loc[:, key] = \
-                                g(self.case.data.index)
+            if 'time' in df.keys():
+                frames.append(df)
             else:
                 warnings.warn('The following file does not have '
                               'time column and therefore no data is going to '
                               'be used from this file as test case data.', Warning)
                 print(f)
 
-        # Close the fmu
-        z_fmu.close()
+        # Find the minimum sampling resolution
+        sampling = 3600.
+        for df in frames:
+            new_sampling = df.iloc[1]['time'] - df.iloc[0]['time']
+            if new_sampling < sampling:
+                sampling = new_sampling
+
+        # Define the index for one year with the minimum sampling found
+        index = np.arange(0., 3.1536e+7, sampling, dtype='int')
+
+        # Find all data keys
+        columns = []
+        for category in self.categories:
+            columns.extend(self.categories[category])
+
+        values = np.full((len(index), len(columns)), np.nan)
+        for df in frames:
+            time = np.asarray(df['time'], dtype=float)
+            for key in df.keys().drop('time'):
+                kind = None
+                for category in self.categories:
+                    if key in self.categories[category]:
+                        kind = 'linear' if category == 'weather' else 'zero'
+                if kind is None:
+                    continue
+                data = np.asarray(df[key], dtype=float)
+                # Use linear interpolation for continuous variables
+                if kind == 'linear':
+                    column = np.interp(index, time, data)
+                # Use forward fill for discrete variables
+                else:
+                    position = np.searchsorted(time, index, side='right') - 1
+                    column = data[np.clip(position, 0, len(data) - 1)]
+                for i, name in enumerate(columns):
+                    if name == key:
+                        values[:, i] = column
+
+        return index, columns, values
+
+    def _data_cache_path(self):
+        '''Return the directory of the cached data table of the fmu, which
+        is keyed by the hash of the fmu. The cache is kept in the
+        ALFALFA_CACHE_DIR directory, /simulate/.cache by default.
+
+        '''
+
+        sha1 = hashlib.sha1()
+        with open(self.case.fmupath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        cache_dir = os.environ.get('ALFALFA_CACHE_DIR', '/simulate/.cache')
+        return os.path.join(cache_dir, 'data', '{0}-v{1}'.format(sha1.hexdigest(), DATA_CACHE_VERSION))
+
+    def _load_cached_data(self, cache_path):
+        '''Load a cached data table, the values are memory-mapped. Returns
+        None if the table is not cached.
+
+        '''
+
+        if not os.path.isdir(cache_path):
+            return None
+        try:
+            with open(os.path.join(cache_path, 'columns.json'), 'r') as f:
+                columns = json.load(f)
+            index = np.load(os.path.join(cache_path, 'index.npy'))
+            values = np.load(os.path.join(cache_path, 'values.npy'), mmap_mode='r')
+        except (IOError, OSError, ValueError) as e:
+            warnings.warn('Unable to load the cached test case data from {0}: {1}'.format(cache_path, e))
+            return None
+        return index, columns, values
+
+    def _save_cached_data(self, cache_path, index, columns, values):
+        '''Save a data table to the cache. The table is written to a
+        temporary directory which is then renamed, so that a partially
+        written table is never loaded.
+
+        '''
 
-        # Convert any string formatted numbers to floats.
-        self.case.data = self.case.data.applymap(float)
+        tmp_path = '{0}.tmp-{1}'.format(cache_path, os.getpid())
+        try:
+            if not os.path.isdir(tmp_path):
+                os.makedirs(tmp_path)
+            np.save(os.path.join(tmp_path, 'index.npy'), index)
+            np.save(os.path.join(tmp_path, 'values.npy'), values)
+            with open(os.path.join(tmp_path, 'columns.json'), 'w') as f:
+                json.dump(columns, f)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError) as e:
+            # Another process may have cached the same fmu first
+            if not os.path.isdir(cache_path):
+                warnings.warn('Unable to cache the test case data in {0}: {1}'.format(cache_path, e))
+            shutil.rmtree(tmp_path, ignore_errors=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+from __future__ import print_function
+
+import numpy as np
+
+try:
+    from assimulo.solvers import CVode
+    from pyfmi.common.io import ResultHandler
+    try:
+        from pyfmi.simulation.assimulo_interface_fmi2 import FMIODE2
+    except ImportError:
+        from pyfmi.simulation.assimulo_interface import FMIODE2
+except ImportError:
+    CVode = None
+    ResultHandler = object
+    FMIODE2 = None
+
+
+def create_stepper(fmu, options, names, stepping='simulate'):
+    """
+    Return the stepping engine used by TestCase to advance the FMU.
+
+    :param fmu: FMU loaded by pyfmi
+    :param options: the simulate options of the FMU, the solver tolerance is taken from them
+    :param names: names of the variables to return after each step, excluding 'time'
+    :param stepping: 'simulate' to call fmu.simulate for every step, 'persistent' to keep the FMU
+                     and its solver alive between steps.  'persistent' is opt in until the Model
+                     Exchange engine is checked against fmu.simulate on a real FMU.
+    :return: SimulateStepper, CoSimulationStepper or ModelExchangeStepper
+    """
+    if stepping == 'persistent':
+        if hasattr(fmu, 'do_step'):
+            return CoSimulationStepper(fmu, options, names)
+        if FMIODE2 is not None:
+            return ModelExchangeStepper(fmu, options, names)
+        print("Persistent stepping of Model Exchange FMUs requires assimulo, using fmu.simulate")
+    elif stepping != 'simulate':
+        raise ValueError("Unknown stepping: {}".format(stepping))
+    return SimulateStepper(fmu, options, names)
+
+
+class SimulateStepper(object):
+    """
+    Advance the FMU with a call to fmu.simulate per step.  The solver, result handler and input
+    trajectory are rebuilt by pyfmi on every call.
+    """
+
+    def __init__(self, fmu, options, names):
+        self.fmu = fmu
+        self.options = options
+        self.names = names
+
+    def step(self, start_time, final_time, inputs, initialize):
+        """
+        Advance the FMU from start_time to final_time.
+
+        :param start_time: time at the start of the step in seconds
+        :param final_time: time at the end of the step in seconds
+        :param inputs: list of (input_name, value) to set for the step
+        :param initialize: True for the first step, to initialize the FMU
+        :return: mapping of variable name to its trajectory over the step, including 'time'.
+                 The first point of each trajectory is at start_time.
+        """
+        if inputs:
+            u_list = [name for name, _ in inputs]
+            u_trajectory = np.array([[start_time] + [value for _, value in inputs]])
+            input_object = (u_list, u_trajectory)
+        else:
+            input_object = None
+        self.options['initialize'] = initialize
+        return self.fmu.simulate(start_time=start_time,
+                                 final_time=final_time,
+                                 options=self.options,
+                                 input=input_object)
+
+
+class PersistentStepper(object):
+    """
+    Base class of the engines which initialize the FMU once and then advance it step by step,
+    setting the inputs directly on the FMU instance.
+    """
+
+    def __init__(self, fmu, options, names):
+        self.fmu = fmu
+        self.options = options
+        self.names = list(names)
+        self.initialized = False
+        # Values of the variables at the end of the previous step
+        self.last_time = None
+        self.last_values = None
+
+    def set_inputs(self, inputs):
+        if inputs:
+            self.fmu.set([name for name, _ in inputs], [value for _, value in inputs])
+
+    def read(self, time):
+        """Read the variables from the FMU and return their trajectory since the end of the previous step"""
+        values = np.asarray(self.fmu.get(self.names), dtype=np.float64)
+        result = {'time': np.array([self.last_time, time], dtype=np.float64)}
+        for i, name in enumerate(self.names):
+            result[name] = np.array([self.last_values[i], values[i]])
+        self.last_time = time
+        self.last_values = values
+        return result
+
+    def initialize(self, start_time):
+        self.fmu.setup_experiment(start_time=start_time)
+        self.fmu.initialize()
+        self.initialized = True
+        self.last_time = start_time
+        self.last_values = np.asarray(self.fmu.get(self.names), dtype=np.float64)
+
+    def step(self, start_time, final_time, inputs, initialize):
+        """
+        Advance the FMU from start_time to final_time, see SimulateStepper.step.
+        The FMU is initialized by the first step, initialize is ignored after that.
+        """
+        self.set_inputs(inputs)
+        if not self.initialized:
+            self.initialize(start_time)
+        self.advance(start_time, final_time, bool(inputs))
+        return self.read(final_time)
+
+    def advance(self, start_time, final_time, inputs_changed):
+        raise NotImplementedError
+
+
+class CoSimulationStepper(PersistentStepper):
+    """Advance a Co-Simulation FMU with do_step"""
+
+    def advance(self, start_time, final_time, inputs_changed):
+        status = self.fmu.do_step(start_time, final_time - start_time, True)
+        if status != 0:
+            raise Exception("FMU do_step failed with status {} at time {}".format(status, start_time))
+
+
+class NoResultHandler(ResultHandler):
+    """Result handler which discards the integration points, the results are read from the FMU after each step"""
+
+    def __init__(self, model=None):
+        self.model = model
+
+
+class ModelExchangeStepper(PersistentStepper):
+    """
+    Advance a Model Exchange FMU with a CVode solver which is created once and continued from one
+    step to the next.  The solver is re-initialized when inputs are set, so that it does not
+    integrate across the discontinuity.
+    """
+
+    def initialize(self, start_time):
+        super(ModelExchangeStepper, self).initialize(start_time)
+        self.fmu.event_update()
+        self.fmu.enter_continuous_time_mode()
+
+        self.problem = FMIODE2(self.fmu, result_file_name='', start_time=start_time,
+                               result_handler=NoResultHandler(self.fmu))
+        self.solver = CVode(self.problem)
+        rtol = self.options['CVode_options']['rtol']
+        self.solver.rtol = rtol
+        nominal = self.fmu.nominal_continuous_states
+        if len(nominal) == len(self.solver.y):
+            self.solver.atol = 0.01 * rtol * nominal
+        self.solver.verbosity = 50
+
+    def advance(self, start_time, final_time, inputs_changed):
+        if inputs_changed:
+            self.solver.re_init(start_time, self.solver.y)
+        self.solver.simulate(final_time)
+        # Leave the FMU at the end of the step, the solver may have last evaluated it elsewhere
+        self.fmu.time = final_time
+        if len(self.solver.y) == self.fmu.get_ode_sizes()[0]:
+            self.fmu.continuous_states = self.solver.y
@@ -0,0 +1,320 @@
+"""
+Fork server which starts the worker's jobs from a warm interpreter.  The server is a template process
+which imports the slow to import libraries once, then forks a child for each job which runs the job's
+script with runpy, so that a job starts without paying for the imports.  Run by a ForkServerClient as
+
+    python fork_server.py socket_path module [module ...]
+
+with the interpreter the jobs need, so that Python 2 and Python 3 jobs each have their own server.
+This module only uses the standard library, it is run as a script by both interpreters.
+"""
+from __future__ import print_function
+
+import atexit
+import errno
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+# Modules imported by the template process before it forks the jobs, unless ALFALFA_FORK_SERVER_PRELOAD is set.
+# Only modules which start no threads and open no connections at import are safe to share with the jobs:
+# the clients are pure Python and only connect once a client object is created.  numpy, and pandas, scipy and
+# pyfmi which import it, are left out as the BLAS library may start its thread pool at import.  They can be
+# added with ALFALFA_FORK_SERVER_PRELOAD where BLAS is single threaded, e.g. with OPENBLAS_NUM_THREADS=1.
+DEFAULT_PRELOAD = ['boto3', 'botocore', 'pymongo', 'redis', 'influxdb']
+
+# Seconds to wait for the fork server to report that a job started, unless ALFALFA_FORK_SERVER_TIMEOUT is set
+DEFAULT_START_TIMEOUT = 10
+
+
+def send_message(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def exit_status(status):
+    """Return the return code of a waitpid status, negative for a signal as with subprocess"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def finish(code):
+    """Exit a job as the interpreter would, without unwinding the stack of the server"""
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join()
+    if hasattr(atexit, '_run_exitfuncs'):
+        atexit._run_exitfuncs()
+    elif hasattr(sys, 'exitfunc'):
+        sys.exitfunc()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(code)
+
+
+def run_job(conn, request):
+    """Run the script of a job in the forked child, never returns"""
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.chdir(request['cwd'])
+        argv = request['argv']
+        script = os.path.abspath(argv[0])
+        sys.argv = list(argv)
+        # As for a script run by the interpreter, the script's directory comes first on the path
+        sys.path[0] = os.path.dirname(script)
+        send_message(conn, {'pid': os.getpid(), 'started': time.time()})
+        conn.close()
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finish(code)
+
+
+class ForkServer(object):
+    """Template process which forks the jobs requested on a Unix socket"""
+
+    def __init__(self, socket_path, preload):
+        self.socket_path = socket_path
+        self.preload = preload
+        # Connection of each running job, the return code is sent on it once the job exits
+        self.connections = {}
+        self.parent = os.getppid()
+
+    def preload_modules(self):
+        for name in self.preload:
+            try:
+                __import__(name)
+            except ImportError as e:
+                print("Fork server unable to preload {}: {}".format(name, e), file=sys.stderr)
+
+    def serve_forever(self):
+        self.preload_modules()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(16)
+        try:
+            # Exit with the worker which started the server
+            while os.getppid() == self.parent:
+                try:
+                    readable, _, _ = select.select([listener], [], [], 0.5)
+                except (select.error, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if readable:
+                    conn, _ = listener.accept()
+                    self.spawn(conn, listener)
+                self.reap()
+        finally:
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def spawn(self, conn, listener):
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = conn.recv(4096)
+            if not chunk:
+                conn.close()
+                return
+            data += chunk
+        request = json.loads(data.decode('utf-8'))
+        pid = os.fork()
+        if pid == 0:
+            listener.close()
+            for other in self.connections.values():
+                other.close()
+            run_job(conn, request)
+        self.connections[pid] = conn
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if pid == 0:
+                return
+            conn = self.connections.pop(pid, None)
+            if conn is None:
+                continue
+            try:
+                send_message(conn, {'returncode': exit_status(status)})
+            except (IOError, OSError):
+                pass
+            conn.close()
+
+
+class ForkTimeout(OSError):
+    """Raised when the fork server does not report that a job started in time"""
+
+
+class ForkedProcess(object):
+    """subprocess.Popen like handle of a job started by a fork server"""
+
+    def __init__(self, sock, requested, timeout=DEFAULT_START_TIMEOUT):
+        """
+        :param sock: connection to the fork server on which the job was requested
+        :param requested: time the job was requested
+        :param timeout: seconds to wait for the server to report that the job started.  A job which
+                        reports after the connection was closed exits without running its script.
+        """
+        self.sock = sock
+        self.buffer = b''
+        self.returncode = None
+        message = self._read(timeout)
+        if message is None or 'pid' not in message:
+            raise ForkTimeout("Fork server did not start the job within {}s".format(timeout))
+        self.pid = message['pid']
+        # Seconds from the request until the job's script started running
+        self.start_latency = message['started'] - requested
+
+    def _read(self, timeout=None):
+        """Return the next message from the server, None if there is none within timeout seconds"""
+        while b'\n' not in self.buffer:
+            if timeout is not None:
+                readable, _, _ = select.select([self.sock], [], [], timeout)
+                if not readable:
+                    return None
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line.decode('utf-8'))
+
+    def _alive(self):
+        try:
+            os.kill(self.pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def poll(self, timeout=0):
+        if self.returncode is None:
+            message = self._read(timeout)
+            if message is None and not self._alive():
+                # The server sends the return code right after reaping the job
+                message = self._read(1)
+                if message is None:
+                    # The fork server exited before the job, its return code is lost
+                    message = {'returncode': -1}
+            if message is not None:
+                self.returncode = message['returncode']
+                self.sock.close()
+        return self.returncode
+
+    def wait(self):
+        while self.poll(timeout=1) is None:
+            pass
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, sig)
+            except OSError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class ForkServerClient(object):
+    """Start and use the fork server of an interpreter"""
+
+    def __init__(self, python, socket_path=None, preload=None, start_timeout=None):
+        """
+        :param python: interpreter of the jobs, e.g. 'python3'
+        :param socket_path: path of the server's Unix socket, defaults to a path in the temp directory
+        :param preload: modules to import in the template process, defaults to the comma separated
+                        ALFALFA_FORK_SERVER_PRELOAD environment variable or DEFAULT_PRELOAD
+        :param start_timeout: seconds to wait for a job to start, defaults to the ALFALFA_FORK_SERVER_TIMEOUT
+                              environment variable or DEFAULT_START_TIMEOUT
+        """
+        self.python = python
+        if socket_path is None:
+            socket_path = os.path.join(tempfile.gettempdir(), 'alfalfa-fork-{}-{}.sock'.format(
+                os.path.basename(python), os.getpid()))
+        self.socket_path = socket_path
+        if preload is None:
+            env_preload = os.environ.get('ALFALFA_FORK_SERVER_PRELOAD')
+            preload = [m.strip() for m in env_preload.split(',') if m.strip()] if env_preload else DEFAULT_PRELOAD
+        self.preload = preload
+        if start_timeout is None:
+            start_timeout = float(os.environ.get('ALFALFA_FORK_SERVER_TIMEOUT', DEFAULT_START_TIMEOUT))
+        self.start_timeout = start_timeout
+        self.process = None
+
+    def start(self):
+        """Start the server without waiting for it to preload its modules"""
+        self.process = subprocess.Popen([self.python, os.path.abspath(__file__), self.socket_path] + self.preload)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def ready(self):
+        """Return True once the server accepts jobs"""
+        return self.alive() and os.path.exists(self.socket_path)
+
+    def launch(self, call, cwd=None):
+        """
+        Fork a job from the server
+
+        :param call: program arguments of the job, the interpreter followed by the script and its arguments
+        :param cwd: working directory of the job, defaults to the current directory
+        :return: ForkedProcess
+        :raises OSError: if the server is not ready or does not start the job within start_timeout seconds,
+                         a server which timed out is stopped and started again by the next launch
+        """
+        if not self.alive():
+            self.start()
+        if not self.ready():
+            raise OSError("Fork server for {} is not ready".format(self.python))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            requested = time.time()
+            send_message(sock, {'argv': call[1:], 'cwd': cwd or os.getcwd()})
+            return ForkedProcess(sock, requested, self.start_timeout)
+        except ForkTimeout:
+            sock.close()
+            # The server is wedged, the next launch starts a new one
+            self.stop()
+            raise
+        except Exception:
+            sock.close()
+            raise
+
+    def stop(self):
+        if self.alive():
+            self.process.terminate()
+            self.process.wait()
+
+
+if __name__ == '__main__':
+    ForkServer(sys.argv[1], sys.argv[2:]).serve_forever()
@@ -0,0 +1,178 @@
+from __future__ import print_function
+
+import calendar
+import logging
+import numbers
+import threading
+import time
+from collections import deque
+
+from influxdb.exceptions import InfluxDBClientError
+
+
+def escape_key(value):
+    """Escape a measurement, tag key, tag value or field key for the InfluxDB line protocol"""
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def format_field(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, numbers.Number):
+        return repr(float(value))
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def to_line(measurement, timestamp, tags, fields):
+    """
+    Format a point in the InfluxDB line protocol
+
+    :param measurement: name of the measurement
+    :param timestamp: time of the point in seconds since the epoch
+    :param tags: dict of tags
+    :param fields: dict of fields
+    :return: str
+    """
+    tag_str = ''.join(',{}={}'.format(escape_key(k), escape_key(v)) for k, v in sorted(tags.items()))
+    field_str = ','.join('{}={}'.format(escape_key(k), format_field(v)) for k, v in sorted(fields.items()))
+    return '{}{} {} {}'.format(escape_key(measurement), tag_str, field_str, int(timestamp))
+
+
+class HistorianWriter(object):
+    """
+    Write historian points to InfluxDB from a background thread, so that the simulation never waits
+    for InfluxDB.  Points are queued in a bounded buffer and written in batches with the line protocol
+    once batch_size points are waiting or the oldest has waited flush_interval seconds.  Batches which
+    fail because InfluxDB is unavailable are retried with exponential backoff, points which do not fit
+    in the buffer are dropped and counted.
+    """
+
+    def __init__(self, influx_client, database, max_points=100000, batch_size=5000, flush_interval=1.0,
+                 max_retries=5, backoff=0.5, logger=None):
+        """
+        :param influx_client: InfluxDBClient
+        :param database: name of the database to write to
+        :param max_points: maximum number of points waiting to be written
+        :param batch_size: number of points written per request
+        :param flush_interval: maximum seconds a point waits before it is written
+        :param max_retries: number of times a batch is retried before it is dropped
+        :param backoff: seconds to wait before the first retry, doubled for each retry
+        :param logger: logger to report failures to, defaults to the 'simulation' logger
+        """
+        self.influx_client = influx_client
+        self.database = database
+        self.max_points = max_points
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.logger = logger if logger is not None else logging.getLogger('simulation')
+
+        # Queued (time queued, measurement, timestamp, common tags, points)
+        self.records = deque()
+        self.queued_points = 0
+        self.condition = threading.Condition()
+        self.closing = False
+        self.thread = None
+
+        # Counters of points
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='historian-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, measurement, when, points, tags=None):
+        """
+        Queue points to be written, without waiting for them to be written
+
+        :param measurement: name of the measurement
+        :param when: naive UTC datetime, or seconds since the epoch, of the points
+        :param points: list of (tags, fields) of each point
+        :param tags: tags common to all of the points
+        :return: False if the points were dropped because the buffer is full
+        """
+        if hasattr(when, 'timetuple'):
+            when = calendar.timegm(when.timetuple())
+        with self.condition:
+            if self.queued_points + len(points) > self.max_points:
+                self.dropped += len(points)
+                return False
+            self.records.append((time.time(), measurement, when, tags or {}, points))
+            self.queued_points += len(points)
+            if self.queued_points >= self.batch_size:
+                self.condition.notify()
+        return True
+
+    def queue_depth(self):
+        """Return the number of points waiting to be written"""
+        return self.queued_points
+
+    def stats(self):
+        return {'queue_depth': self.queued_points, 'written': self.written, 'dropped': self.dropped,
+                'failed': self.failed}
+
+    def _take_batch(self):
+        """Remove up to batch_size points from the buffer and return them as lines"""
+        lines = []
+        while self.records and len(lines) < self.batch_size:
+            _, measurement, when, common_tags, points = self.records.popleft()
+            self.queued_points -= len(points)
+            for point_tags, fields in points:
+                tags = dict(common_tags)
+                tags.update(point_tags)
+                lines.append(to_line(measurement, when, tags, fields))
+        return lines
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closing:
+                    if self.queued_points >= self.batch_size:
+                        break
+                    if self.records and time.time() - self.records[0][0] >= self.flush_interval:
+                        break
+                    self.condition.wait(self.flush_interval)
+                if self.closing and not self.records:
+                    return
+                lines = self._take_batch()
+            if lines:
+                self._send(lines)
+
+    def _send(self, lines):
+        """Write a batch, retrying with backoff while InfluxDB is unavailable"""
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.influx_client.write_points(lines, time_precision='s', database=self.database, protocol='line')
+                self.written += len(lines)
+                return True
+            except InfluxDBClientError as e:
+                # The request itself is bad, retrying will not help
+                self.logger.error("Influx rejected {} points: {}".format(len(lines), e))
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.logger.error("Unable to write {} points to influx: {}".format(len(lines), e))
+                    break
+                self.logger.warning("Influx write failed, retrying in {}s: {}".format(delay, e))
+                time.sleep(delay)
+                delay *= 2
+        self.failed += len(lines)
+        return False
+
+    def close(self, timeout=30):
+        """
+        Write the queued points and stop the writer thread
+
+        :param timeout: seconds to wait for the queued points to be written
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.logger.info("Historian writer closed: {}".format(self.stats()))
@@ -0,0 +1,150 @@
+from __future__ import print_function
+
+import os
+import subprocess
+import time
+
+from .fork_server import ForkServerClient
+
+
+class Job(object):
+    """A single job subprocess launched by the JobPool"""
+
+    def __init__(self, key, process, message_type, name):
+        """
+        :param key: unique key of the job, typically the site_id or upload_id
+        :param process: the subprocess.Popen running the job
+        :param str message_type: One of 'add_site', 'step_sim', 'run_sim'
+        :param name: name to use when logging about the job (file name or site_id)
+        """
+        self.key = key
+        self.process = process
+        self.message_type = message_type
+        self.name = name
+        self.start_time = time.time()
+        self.returncode = None
+        # Seconds from the launch until the job's script started, only known for jobs forked by a fork server
+        self.start_latency = getattr(process, 'start_latency', None)
+
+    def poll(self):
+        """
+        Check if the job has finished without blocking.
+
+        :return: return code of the job, or None if it is still running
+        """
+        self.returncode = self.process.poll()
+        return self.returncode
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+
+class JobPool(object):
+    """
+    Supervise the job subprocesses run by the Worker.  The pool has a fixed number of slots, each
+    slot runs one non-blocking subprocess.  Jobs are tracked by key (site_id for step_sim, upload_id
+    for add_site and run_sim) so that the same site can not be started twice on one worker.
+    """
+
+    def __init__(self, slots=None, fork_servers=None):
+        """
+        :param slots: number of concurrent jobs.  Defaults to the WORKER_JOB_SLOTS environment
+                      variable, or 1 if not set.
+        :param fork_servers: dict of interpreter to the ForkServerClient which starts its jobs.  Defaults to
+                             a fork server for each interpreter of the comma separated ALFALFA_FORK_SERVERS
+                             environment variable, e.g. 'python3,python'.  Jobs of other interpreters are
+                             started as new processes.
+        """
+        if slots is None:
+            slots = int(os.environ.get('WORKER_JOB_SLOTS', 1))
+        self.slots = max(1, int(slots))
+        self.jobs = {}
+        if fork_servers is None:
+            pythons = [p.strip() for p in os.environ.get('ALFALFA_FORK_SERVERS', '').split(',') if p.strip()]
+            fork_servers = dict((python, ForkServerClient(python)) for python in pythons)
+            # Start the servers now so that they have preloaded their modules by the first job
+            for server in fork_servers.values():
+                server.start()
+        self.fork_servers = fork_servers
+
+    def free_slots(self):
+        """Return the number of slots available for new jobs"""
+        return max(0, self.slots - len(self.jobs))
+
+    def is_running(self, key):
+        return key in self.jobs
+
+    def launch(self, key, call, message_type, name=None):
+        """
+        Start a job subprocess without waiting for it to complete.
+
+        :param key: unique key of the job
+        :param call: list of program arguments, as passed to subprocess.Popen
+        :param str message_type: One of 'add_site', 'step_sim', 'run_sim'
+        :param name: name to use when logging about the job, defaults to key
+        :return: Job
+        """
+        if self.is_running(key):
+            raise ValueError("Job already running for: {}".format(key))
+        if self.free_slots() == 0:
+            raise RuntimeError("No free job slots to launch: {}".format(key))
+
+        process = self.start_process(call)
+        job = Job(key, process, message_type, name if name is not None else key)
+        self.jobs[key] = job
+        return job
+
+    def start_process(self, call):
+        """
+        Fork the job from the fork server of its interpreter if there is one, otherwise start a new process.
+        Jobs are also started as new processes while the fork server is starting or if it fails.
+        """
+        server = self.fork_servers.get(call[0])
+        if server is not None and len(call) > 1 and not call[1].startswith('-'):
+            try:
+                return server.launch(call)
+            except (IOError, OSError, ValueError):
+                pass
+        return subprocess.Popen(call)
+
+    def reap(self):
+        """
+        Remove all of the jobs which have finished from the pool.
+
+        :return: list of finished Job, with returncode set
+        """
+        finished = [job for job in self.jobs.values() if job.poll() is not None]
+        for job in finished:
+            del self.jobs[job.key]
+        return finished
+
+    def terminate_all(self, timeout=10):
+        """
+        Terminate all running jobs, waiting up to timeout seconds before killing them.
+
+        :return: list of terminated Job
+        """
+        jobs = list(self.jobs.values())
+        for job in jobs:
+            if job.poll() is None:
+                job.process.terminate()
+        deadline = time.time() + timeout
+        for job in jobs:
+            while job.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if job.poll() is None:
+                job.process.kill()
+                job.returncode = job.process.wait()
+        self.jobs = {}
+        return jobs
+
+    def shutdown(self, timeout=10):
+        """
+        Terminate all running jobs and stop the fork servers, when the worker exits
+
+        :return: list of terminated Job
+        """
+        jobs = self.terminate_all(timeout)
+        for server in self.fork_servers.values():
+            server.stop()
+        return jobs
@@ -0,0 +1,143 @@
+from __future__ import print_function
+
+import numpy as np
+
+
+class KPI(object):
+    """
+    Base class of a KPI which is the time integral of a function of its signals.  The integral is
+    accumulated with the trapezoid rule as results are added, so reading the KPI is O(1).
+    Subclasses set name and implement integrand.
+    """
+
+    # Key of the KPI in the dict returned by KPICalculator.get_kpis
+    name = None
+
+    def __init__(self, signals):
+        """
+        :param signals: names of the result variables the KPI is computed from
+        """
+        self.signals = list(signals)
+        self.integral = 0.0
+
+    def integrand(self, values):
+        """
+        Return the value to integrate at each time
+
+        :param values: 2-D array of the values of the signals, one row per time
+        :return: 1-D array
+        """
+        raise NotImplementedError
+
+    def accumulate(self, time, values):
+        """
+        Add the integral over the given points to the KPI
+
+        :param time: 1-D array of times in seconds
+        :param values: 2-D array of the values of the signals, one row per time
+        """
+        if len(time) > 1:
+            y = self.integrand(values)
+            self.integral += np.sum(np.diff(time) * (y[1:] + y[:-1])) / 2
+
+    def value(self):
+        return self.integral
+
+
+class EnergyKPI(KPI):
+    """Total energy in kWh of the Power signals, which are measured in W"""
+
+    name = 'energy'
+
+    def integrand(self, values):
+        return values.sum(axis=1)
+
+    def value(self):
+        # Convert J to kWh
+        return self.integral * 2.77778e-7
+
+
+class DiscomfortKPI(KPI):
+    """Total discomfort in K-h of the zone temperatures, measured in K, below the heating setpoint"""
+
+    name = 'comfort'
+
+    heat_setpoint = 273.15 + 20
+
+    def integrand(self, values):
+        return np.clip(self.heat_setpoint - values, 0, None).sum(axis=1)
+
+    def value(self):
+        return self.integral / 3600
+
+
+# KPI class of each kpis.json category, a category is matched if it contains the key
+KPI_TYPES = {
+    'Power': EnergyKPI,
+    'AirZoneTemperature': DiscomfortKPI,
+}
+
+
+def register_kpi(category, kpi_class):
+    """
+    Compute the KPI of a kpis.json category with kpi_class
+
+    :param category: kpis.json category, or part of the category name
+    :param kpi_class: subclass of KPI
+    """
+    KPI_TYPES[category] = kpi_class
+
+
+def kpi_class_for(category):
+    if category in KPI_TYPES:
+        return KPI_TYPES[category]
+    for key, kpi_class in KPI_TYPES.items():
+        if key in category:
+            return kpi_class
+    return None
+
+
+class KPICalculator(object):
+    """Incrementally compute the KPIs of a test case from its kpis.json as results are stored"""
+
+    def __init__(self, kpi_json):
+        """
+        :param kpi_json: dict of {category: [signal names]} from the kpis.json of the FMU
+        """
+        self.kpis = []
+        self.unsupported = []
+        for category in sorted(kpi_json.keys()):
+            kpi_class = kpi_class_for(category)
+            if kpi_class is None:
+                self.unsupported.append(category)
+            else:
+                self.kpis.append(kpi_class(kpi_json[category]))
+        if self.unsupported:
+            print('No calculation for KPIs named: {0}'.format(', '.join(self.unsupported)))
+
+    def update(self, store, start):
+        """
+        Add the rows of the store from start onwards to the KPIs.  The previous row is included
+        so that the interval between the steps is integrated too.
+
+        :param store: ResultStore, or mapping of variable name to array of values
+        :param start: index of the first new row
+        """
+        first = max(start - 1, 0)
+        time = np.asarray(store['time'][first:], dtype=np.float64)
+        for kpi in self.kpis:
+            if not kpi.signals:
+                continue
+            values = np.column_stack([np.asarray(store[signal][first:], dtype=np.float64) for signal in kpi.signals])
+            kpi.accumulate(time, values)
+
+    def get_kpis(self):
+        """
+        Return the current value of the KPIs
+
+        :return: dict of {kpi name: value}, KPIs of the same name are summed
+        """
+        kpis = dict()
+        for kpi in self.kpis:
+            kpis[kpi.name] = kpis.get(kpi.name, 0) + kpi.value()
+        return kpis
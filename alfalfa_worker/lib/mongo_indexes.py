@@ -0,0 +1,109 @@
+"""
+Indexes of the Mongo collections used by the worker and the web server, and a diagnostic which explains
+the hot queries to check that none of them scans a whole collection.  Run the diagnostic against a Mongo
+with some sites in it as
+
+    python -m alfalfa_worker.lib.mongo_indexes [--ensure]
+
+with MONGO_URL and MONGO_DB_NAME set.  It exits with 1 if a query scans a collection.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+from pymongo import ASCENDING, IndexModel
+
+# {collection: [(name, keys)]}, _id is always indexed
+INDEXES = {
+    'recs': [
+        # dbops.getPoint, removeSite and the cleanup of a site's points, which filter by site_ref first
+        ('site_ref_dis', [('site_ref', ASCENDING), ('rec.dis', ASCENDING)]),
+        ('site_ref_cur', [('site_ref', ASCENDING), ('rec.cur', ASCENDING)]),
+        ('site_ref_writable', [('site_ref', ASCENDING), ('rec.writable', ASCENDING)]),
+    ],
+    'writearrays': [
+        # WriteArrayCache.load and removeSite
+        ('site_ref', [('siteRef', ASCENDING)]),
+    ],
+    'sims': [
+        ('site_ref', [('siteRef', ASCENDING)]),
+    ],
+}
+
+# (collection, description, filter) of the queries made on every step or on every request.  Updates and
+# deletes are explained as the find of their filter, which is planned the same way.
+HOT_QUERIES = [
+    ('recs', 'update_one of a site or point', {'_id': 'site'}),
+    ('recs', 'update_many of the current values in cleanup', {'site_ref': 'site', 'rec.cur': 'm:'}),
+    ('recs', 'update_many of the write levels in cleanup', {'site_ref': 'site', 'rec.writable': 'm:'}),
+    ('recs', 'findOne of a point by name in dbops.getPoint', {'site_ref': 'site', 'rec.dis': 's:point'}),
+    ('recs', 'find of the points of a site', {'site_ref': 'site', 'rec.point': 'm:'}),
+    ('recs', 'deleteMany of a site in removeSite', {'site_ref': 'site'}),
+    ('writearrays', 'find of the write arrays of a site', {'siteRef': 'site'}),
+    ('writearrays', 'find of written points', {'_id': {'$in': ['point']}}),
+    ('writearrays', 'deleteMany of a site in removeSite', {'siteRef': 'site'}),
+    ('sims', 'find of the simulations of a site', {'siteRef': 'site'}),
+]
+
+
+def ensure_indexes(mongo_db):
+    """
+    Create the indexes which do not exist yet.  Creating an index which exists is a no-op.
+
+    :param mongo_db: pymongo Database
+    :return: list of the names of the indexes
+    """
+    names = []
+    for collection, indexes in INDEXES.items():
+        models = [IndexModel(keys, name=name) for name, keys in indexes]
+        names.extend(mongo_db[collection].create_indexes(models))
+    return names
+
+
+def plan_stages(plan):
+    """Return the stages of a query plan, from the root to the leaves"""
+    stages = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages.extend(plan_stages(plan[key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def audit_queries(mongo_db):
+    """
+    Explain each of the HOT_QUERIES
+
+    :param mongo_db: pymongo Database
+    :return: list of dicts of collection, description, stages and collscan, True if the query scans the collection
+    """
+    report = []
+    for collection, description, query in HOT_QUERIES:
+        explain = mongo_db[collection].find(query).explain()
+        stages = plan_stages(explain['queryPlanner']['winningPlan'])
+        report.append({'collection': collection, 'description': description, 'stages': stages,
+                       'collscan': 'COLLSCAN' in stages})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Explain the hot Mongo queries and report collection scans")
+    parser.add_argument('--ensure', action='store_true', help="Create the indexes before explaining the queries")
+    args = parser.parse_args(argv)
+
+    from pymongo import MongoClient
+    mongo_db = MongoClient(os.environ['MONGO_URL'])[os.environ['MONGO_DB_NAME']]
+    if args.ensure:
+        print("Ensured indexes: {}".format(', '.join(ensure_indexes(mongo_db))))
+    report = audit_queries(mongo_db)
+    for query in report:
+        print("{:<4} {} {}: {}".format('SCAN' if query['collscan'] else 'ok', query['collection'],
+                                       query['description'], ' <- '.join(query['stages'])))
+    return 1 if any(query['collscan'] for query in report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+from __future__ import print_function
+
+import logging
+import time
+
+from pymongo import UpdateOne
+
+
+class OutputPublisher(object):
+    """
+    Publish the current values of simulation outputs to the Mongo recs collection.
+    All of the updates for a step are sent in a single unordered bulk_write, and points
+    whose value has not changed since the last publish are skipped.
+    """
+
+    def __init__(self, mongo_db_recs, logger=None):
+        """
+        :param mongo_db_recs: the Mongo recs collection
+        :param logger: logger to report write latency to, defaults to the 'simulation' logger
+        """
+        self.mongo_db_recs = mongo_db_recs
+        self.logger = logger if logger is not None else logging.getLogger('simulation')
+
+        # Last value published for each point, used to skip unchanged points
+        self.last_values = {}
+
+        # Statistics of the last call to publish
+        self.last_write_count = 0
+        self.last_write_seconds = 0.0
+
+    def publish(self, outputs):
+        """
+        Write the current values of outputs to Mongo
+
+        :param outputs: dict of {haystack_point_id: value}
+        :return: number of points written
+        """
+        ops = []
+        changed = {}
+        for output_id, value in outputs.items():
+            if output_id in self.last_values and self.last_values[output_id] == value:
+                continue
+            changed[output_id] = value
+            ops.append(UpdateOne({"_id": output_id}, {
+                "$set": {"rec.curVal": "n:%s" % value, "rec.curStatus": "s:ok", "rec.cur": "m:"}}))
+
+        start = time.time()
+        if ops:
+            self.mongo_db_recs.bulk_write(ops, ordered=False)
+        self.last_write_seconds = time.time() - start
+        self.last_write_count = len(ops)
+        self.last_values.update(changed)
+
+        self.logger.debug("Published {} of {} outputs in {:.1f} ms".format(
+            self.last_write_count, len(outputs), self.last_write_seconds * 1000))
+        return self.last_write_count
+
+    def reset(self):
+        """Forget the previously published values, the next publish writes all points"""
+        self.last_values = {}
@@ -0,0 +1,196 @@
+from __future__ import print_function
+
+import os
+import tempfile
+
+import numpy as np
+
+
+def select_result_variables(names, result_variables, kpi_json):
+    """
+    Return the variables of names to record in the results: the requested result_variables and the
+    signals needed to compute the KPIs.
+
+    :param names: names of the model variables, in order
+    :param result_variables: names of the variables to record, None to record all of the variables
+    :param kpi_json: dict of {kpi signal type: [variable names]}
+    :return: list of the names to record, in the order of names
+    """
+    if result_variables is None:
+        return list(names)
+    stored = set(result_variables)
+    for signals in kpi_json.values():
+        stored.update(signals)
+    return [name for name in names if name in stored]
+
+
+class ResultStore(object):
+    """
+    Columnar store of simulation result trajectories.  Every variable is a float64 column of a
+    single column-major (Fortran ordered) array, so each column is contiguous and all of the
+    variables share one time column.  The array is preallocated and its capacity is doubled when
+    it is full, which makes appending amortized O(1).
+
+    When spill_bytes is set and the array would grow beyond that size, the array is moved to a
+    memory mapped temporary file in spill_dir instead of being kept in memory.
+    """
+
+    def __init__(self, names, capacity=1024, spill_bytes=None, spill_dir=None):
+        """
+        :param names: names of the variables to store, 'time' is always included
+        :param capacity: initial number of rows
+        :param spill_bytes: size in bytes above which the array is spilled to disk.  Defaults to the
+                            ALFALFA_RESULT_SPILL_BYTES environment variable, or never if not set.
+        :param spill_dir: directory of the spill file, defaults to the system temporary directory
+        """
+        self.names = ['time']
+        for name in names:
+            if name not in self.names:
+                self.names.append(name)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+
+        if spill_bytes is None and os.environ.get('ALFALFA_RESULT_SPILL_BYTES'):
+            spill_bytes = int(os.environ['ALFALFA_RESULT_SPILL_BYTES'])
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+        self.spill_path = None
+
+        self.length = 0
+        self.data = self._allocate(max(1, int(capacity)))
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    @property
+    def spilled(self):
+        return self.spill_path is not None
+
+    def _allocate(self, capacity):
+        shape = (capacity, len(self.names))
+        nbytes = shape[0] * shape[1] * np.dtype(np.float64).itemsize
+        if self.spill_bytes is None or nbytes <= self.spill_bytes:
+            return np.empty(shape, dtype=np.float64, order='F')
+
+        fd, path = tempfile.mkstemp(prefix='results-', suffix='.dat', dir=self.spill_dir)
+        os.close(fd)
+        data = np.memmap(path, dtype=np.float64, mode='w+', shape=shape, order='F')
+        self.spill_path = path
+        return data
+
+    def _remove_spill_file(self):
+        if self.spill_path is not None:
+            try:
+                os.remove(self.spill_path)
+            except OSError:
+                pass
+            self.spill_path = None
+
+    def _reserve(self, rows):
+        """Grow the array, if needed, to fit rows more rows"""
+        required = self.length + rows
+        if required <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < required:
+            capacity *= 2
+        old = self.data
+        old_spill_path = self.spill_path
+        # Keep the old spill file until its data has been copied
+        self.spill_path = None
+        self.data = self._allocate(capacity)
+        self.data[:self.length, :] = old[:self.length, :]
+        del old
+        if old_spill_path is not None and old_spill_path != self.spill_path:
+            try:
+                os.remove(old_spill_path)
+            except OSError:
+                pass
+
+    def append(self, columns, start=0):
+        """
+        Append rows to the store.
+
+        :param columns: mapping of variable name to an array of values, e.g. a pyfmi result object.
+                        All of the stored variables must be present and of the same length.
+        :param start: index of the first value of each array to append, used to skip the first
+                      point of a result which repeats the last point of the previous one
+        """
+        time = np.asarray(columns['time'], dtype=np.float64)[start:]
+        rows = time.shape[0]
+        if rows <= 0:
+            return
+        self._reserve(rows)
+        end = self.length + rows
+        for name, j in self.index.items():
+            self.data[self.length:end, j] = np.asarray(columns[name], dtype=np.float64)[start:]
+        self.length = end
+
+    def column(self, name):
+        """Return a view of the stored values of a variable"""
+        return self.data[:self.length, self.index[name]]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return self.length
+
+    def keys(self):
+        return list(self.names)
+
+    def view(self, names):
+        """
+        Return a ResultView of some of the variables and the shared time column
+
+        :param names: names of the variables of the view
+        """
+        return ResultView(self, ['time'] + [name for name in names if name != 'time'])
+
+    def to_dict(self, names=None):
+        """
+        Return the stored trajectories as lists
+
+        :param names: names of the variables to return, defaults to all
+        :return: dict of {name: list of values}
+        """
+        if names is None:
+            names = self.names
+        return dict((name, self.column(name).tolist()) for name in names)
+
+    def close(self):
+        """Release the array and remove the spill file, if any"""
+        self.data = np.empty((0, len(self.names)), dtype=np.float64, order='F')
+        self.length = 0
+        self._remove_spill_file()
+
+
+class ResultView(object):
+    """A dict like, read only view of some of the variables of a ResultStore"""
+
+    def __init__(self, store, names):
+        self.store = store
+        self.names = names
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        return self.store.column(name)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def to_dict(self):
+        return self.store.to_dict(self.names)
@@ -0,0 +1,171 @@
+from __future__ import print_function
+
+import os
+import tarfile
+import threading
+import zipfile
+
+try:
+    from Queue import Empty, Queue
+except ImportError:
+    from queue import Empty, Queue
+
+# Objects larger than this are fetched with concurrent ranged GETs
+PARALLEL_THRESHOLD = 32 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 4
+
+
+class ParallelRangeReader(object):
+    """
+    Read only, file like view of an S3 object which fetches consecutive byte ranges of the object with
+    concurrent GET requests and returns them in order.  At most 2 * max_concurrency chunks are held in
+    memory.
+    """
+
+    def __init__(self, s3_object, size, chunk_size=CHUNK_SIZE, max_concurrency=MAX_CONCURRENCY):
+        """
+        :param s3_object: boto3 Object to read
+        :param size: size of the object in bytes
+        :param chunk_size: size in bytes of each ranged GET
+        :param max_concurrency: number of threads fetching ranges
+        """
+        self.s3_object = s3_object
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_count = (size + chunk_size - 1) // chunk_size
+
+        self.chunks = {}
+        self.error = None
+        self.condition = threading.Condition()
+        self.slots = threading.Semaphore(2 * max_concurrency)
+        self.next_chunk = 0
+        # The chunk being read and the offset of the next byte to read in it
+        self.current = b''
+        self.offset = 0
+        self.position = 0
+        self.closed = False
+
+        self.pending = Queue()
+        for i in range(self.chunk_count):
+            self.pending.put(i)
+        self.threads = []
+        for _ in range(min(max_concurrency, self.chunk_count)):
+            thread = threading.Thread(target=self._fetch)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _fetch(self):
+        while True:
+            self.slots.acquire()
+            try:
+                if self.closed:
+                    raise Empty()
+                i = self.pending.get_nowait()
+            except Empty:
+                self.slots.release()
+                return
+            start = i * self.chunk_size
+            end = min(start + self.chunk_size, self.size) - 1
+            try:
+                data = self.s3_object.get(Range='bytes={}-{}'.format(start, end))['Body'].read()
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.chunks[i] = data
+                self.condition.notify_all()
+
+    def _next(self):
+        """Return the next chunk in order, waiting for it to be fetched"""
+        with self.condition:
+            while self.next_chunk not in self.chunks and self.error is None:
+                self.condition.wait(1)
+            if self.next_chunk not in self.chunks:
+                raise IOError("Failed to read {}: {}".format(self.s3_object.key, self.error))
+            data = self.chunks.pop(self.next_chunk)
+        self.next_chunk += 1
+        self.slots.release()
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        pieces = []
+        remaining = size
+        while remaining > 0:
+            if self.offset >= len(self.current):
+                if self.next_chunk >= self.chunk_count:
+                    break
+                self.current = self._next()
+                self.offset = 0
+            piece = self.current[self.offset:self.offset + remaining]
+            self.offset += len(piece)
+            remaining -= len(piece)
+            pieces.append(piece)
+        data = b''.join(pieces)
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.closed = True
+        # Unblock the threads waiting for a slot
+        for _ in self.threads:
+            self.slots.release()
+
+
+def open_stream(s3_object, parallel_threshold=PARALLEL_THRESHOLD, **kwargs):
+    """
+    Return a file like object which streams the body of an S3 object.  Large objects are read with
+    concurrent ranged GETs.
+
+    :param s3_object: boto3 Object
+    :param parallel_threshold: size in bytes above which concurrent ranged GETs are used
+    :param kwargs: passed to ParallelRangeReader
+    """
+    size = s3_object.content_length
+    if size > parallel_threshold:
+        return ParallelRangeReader(s3_object, size, **kwargs)
+    return s3_object.get()['Body']
+
+
+def extract_tar(s3_object, destination, **kwargs):
+    """
+    Decompress and extract a tar.gz in S3 into destination as it is downloaded, without writing
+    the tarball to disk.
+
+    :param s3_object: boto3 Object of the tar.gz
+    :param destination: directory to extract into
+    :param kwargs: passed to open_stream
+    """
+    stream = open_stream(s3_object, **kwargs)
+    try:
+        tar = tarfile.open(fileobj=stream, mode='r|gz')
+        tar.extractall(destination)
+        tar.close()
+    finally:
+        stream.close()
+
+
+def extract_zip(s3_bucket, key, destination, download_path, transfer_config=None):
+    """
+    Download and extract a zip in S3.  A zip can not be extracted as it is streamed because its
+    directory is at the end, so it is downloaded to download_path first, with concurrent ranged GETs
+    for large objects, and removed once extracted.
+
+    :param s3_bucket: boto3 Bucket
+    :param key: key of the zip in the bucket
+    :param destination: directory to extract into
+    :param download_path: path to download the zip to
+    :param transfer_config: boto3 TransferConfig of the download
+    """
+    s3_bucket.download_file(key, download_path, Config=transfer_config)
+    try:
+        zzip = zipfile.ZipFile(download_path)
+        zzip.extractall(destination)
+        zzip.close()
+    finally:
+        os.remove(download_path)
@@ -0,0 +1,170 @@
+from __future__ import print_function
+
+import json
+import os
+
+from .step_scheduler import monotonic
+
+# Messages published on a site's Redis channel to control its simulation.
+# 'advance' moves the simulation one step, 'advance:{n}' moves it n steps before replying
+# 'complete:{"time": ..., "step": ...}' with the simulation time and step count after the advance
+ADVANCE_MESSAGE = 'advance'
+STOP_MESSAGE = 'stop'
+COMPLETE_MESSAGE = 'complete'
+# 'stop' ends the simulation, 'pause' holds it at its current time until 'resume'
+PAUSE_MESSAGE = 'pause'
+RESUME_MESSAGE = 'resume'
+CONTROL_MESSAGES = (STOP_MESSAGE, PAUSE_MESSAGE, RESUME_MESSAGE)
+
+# simStatus values of a site which was asked to stop
+STOP_STATUSES = ('s:Stopping', 's:Stopped')
+
+# Sets the site idle, adds the steps taken to its step count and publishes the completion message,
+# in a single round trip.  KEYS[1] is the site id, ARGV the steps taken and the simulation time.
+COMPLETE_SCRIPT = """
+local step = redis.call('HINCRBY', KEYS[1], 'step', ARGV[1])
+redis.call('HSET', KEYS[1], 'control', 'idle', 'time', ARGV[2])
+redis.call('PUBLISH', KEYS[1], 'complete:' .. cjson.encode({time = ARGV[2], step = step}))
+return step
+"""
+
+# Longest time in seconds that a control loop blocks waiting for a message on its site channel.
+# Messages wake the loop as soon as they arrive, the timeout only bounds how long it sleeps.
+MESSAGE_TIMEOUT = 60
+
+
+def decode_message(data):
+    """
+    Return the data of a pubsub message as a str, or None if it is not a string message
+    (e.g. the integer data of a subscribe confirmation).
+
+    :param data: data of the pubsub message
+    :return: str or None
+    """
+    if isinstance(data, bytes) and not isinstance(data, str):
+        return data.decode('utf-8')
+    if isinstance(data, str):
+        return data
+    return None
+
+
+def parse_advance_steps(data):
+    """
+    Return the number of steps requested by an advance message.
+
+    :param data: data of the pubsub message
+    :return: number of steps, or None if the message is not a valid advance message
+    """
+    message = decode_message(data)
+    if message == ADVANCE_MESSAGE:
+        return 1
+    if message is not None and message.startswith(ADVANCE_MESSAGE + ':'):
+        try:
+            steps = int(message[len(ADVANCE_MESSAGE) + 1:])
+        except ValueError:
+            return None
+        if steps >= 1:
+            return steps
+    return None
+
+
+def parse_control_message(data):
+    """
+    Return the control message of a pubsub message.
+
+    :param data: data of the pubsub message
+    :return: one of CONTROL_MESSAGES, or None if the message is not a control message
+    """
+    message = decode_message(data)
+    if message in CONTROL_MESSAGES:
+        return message
+    return None
+
+
+def wait_for_message(pubsub, timeout=MESSAGE_TIMEOUT):
+    """
+    Block until a message arrives on the channels subscribed by pubsub, or timeout seconds pass,
+    instead of polling the connection.  A timeout of 0 or less returns immediately.
+
+    :param pubsub: redis PubSub subscribed to the site channel
+    :param timeout: seconds to wait for a message
+    :return: the message, or None if no message arrived
+    """
+    return pubsub.get_message(timeout=max(timeout, 0))
+
+
+def parse_complete_message(data):
+    """
+    Return the payload of a completion message.
+
+    :param data: data of the pubsub message
+    :return: dict of time and step, or None if the message is not a completion message
+    """
+    message = decode_message(data)
+    if message is None or not message.startswith(COMPLETE_MESSAGE + ':'):
+        return None
+    return json.loads(message[len(COMPLETE_MESSAGE) + 1:])
+
+
+class StepCompletion(object):
+    """
+    Signal to the web server that a site finished advancing.  The site's control state, step count
+    and simulation time are set and the completion message is published atomically by COMPLETE_SCRIPT,
+    so that a client never sees the message before the site is idle again.
+    """
+
+    def __init__(self, redis, site_id):
+        self.redis = redis
+        self.site_id = site_id
+        self.script = redis.register_script(COMPLETE_SCRIPT)
+
+    def reset(self):
+        """Set the site idle with a step count of 0, before it starts"""
+        self.redis.execute_command('HSET', self.site_id, 'control', 'idle', 'step', 0)
+
+    def complete(self, sim_time, steps=1):
+        """
+        Signal that the site advanced
+
+        :param sim_time: simulation time after the advance
+        :param steps: number of steps taken by the advance
+        :return: step count of the site
+        """
+        return self.script(keys=[self.site_id], args=[steps, str(sim_time)])
+
+
+class StopReconciler(object):
+    """
+    Check the simStatus of a site in Mongo at a low frequency, in case the stop message published by the
+    web server was missed, e.g. when it was published before the site subscribed to its channel.  Stops
+    are otherwise detected from the stop message as soon as it is published.
+    """
+
+    def __init__(self, mongo_db_recs, site_id, interval=None, clock=monotonic):
+        """
+        :param mongo_db_recs: recs collection
+        :param site_id: site to check
+        :param interval: seconds between reads of the site, defaults to the ALFALFA_STOP_RECONCILE_INTERVAL
+                         environment variable or 30
+        :param clock: function returning the current time in seconds
+        """
+        if interval is None:
+            interval = float(os.environ.get('ALFALFA_STOP_RECONCILE_INTERVAL', 30))
+        self.mongo_db_recs = mongo_db_recs
+        self.site_id = site_id
+        self.interval = interval
+        self.clock = clock
+        self.next_time = self.clock() + self.interval
+
+    def time_until_due(self):
+        """Return the seconds until the next read of the site, 0 or less if it is due"""
+        return self.next_time - self.clock()
+
+    def stop_requested(self):
+        """Return True if the site was asked to stop, the site is only read once it is due"""
+        now = self.clock()
+        if now < self.next_time:
+            return False
+        self.next_time = now + self.interval
+        site = self.mongo_db_recs.find_one({"_id": self.site_id}, {"rec.simStatus": 1})
+        return bool(site) and site.get("rec", {}).get("simStatus") in STOP_STATUSES
@@ -0,0 +1,227 @@
+from __future__ import print_function
+
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+
+try:
+    from Queue import Empty, Queue
+except ImportError:
+    from queue import Empty, Queue
+
+from .site_control import decode_message
+
+# Redis list which the worker pushes the step_sim jobs of a model type to, e.g. site_host:osm
+SITE_HOST_QUEUE = 'site_host:{}'
+
+
+class ChannelDispatcher(object):
+    """
+    Single Redis subscription shared by all of the sites of a host.  One thread reads the messages of
+    all of the site channels and routes them to the queue of the SiteChannel subscribed to the channel.
+    redis-py PubSub objects are not thread safe, so subscriptions are also made by the dispatcher thread.
+    """
+
+    def __init__(self, pubsub, poll_interval=0.5):
+        """
+        :param pubsub: redis PubSub, only used by the dispatcher thread
+        :param poll_interval: longest time in seconds before a subscription request is applied
+        """
+        self.pubsub = pubsub
+        self.poll_interval = poll_interval
+        self.queues = {}
+        self.requests = Queue()
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='channel-dispatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def subscribe(self, channel, queue):
+        """Route the messages of channel to queue, blocking until the subscription is made"""
+        done = threading.Event()
+        self.requests.put((channel, queue, done))
+        done.wait()
+
+    def unsubscribe(self, channel):
+        self.requests.put((channel, None, None))
+
+    def apply_requests(self, timeout=0):
+        try:
+            channel, queue, done = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+        except Empty:
+            return
+        while True:
+            if queue is not None:
+                self.pubsub.subscribe(channel)
+                self.queues[channel] = queue
+                done.set()
+            elif self.queues.pop(channel, None) is not None:
+                self.pubsub.unsubscribe(channel)
+            try:
+                channel, queue, done = self.requests.get_nowait()
+            except Empty:
+                return
+
+    def run(self):
+        while not self.stopped:
+            if not self.queues:
+                # get_message fails without a subscription
+                self.apply_requests(self.poll_interval)
+                continue
+            self.apply_requests()
+            message = self.pubsub.get_message(timeout=self.poll_interval)
+            if message and message['type'] == 'message':
+                queue = self.queues.get(decode_message(message['channel']))
+                if queue is not None:
+                    queue.put(message)
+
+    def stop(self):
+        self.stopped = True
+
+
+class SiteChannel(object):
+    """
+    View of a ChannelDispatcher for one site, with the subscribe and get_message methods of a redis PubSub
+    so that it can be used in place of the PubSub of the site's connections.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.queue = Queue()
+        self.channels = []
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            self.dispatcher.subscribe(channel, self.queue)
+            self.channels.append(channel)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0):
+        try:
+            if timeout and timeout > 0:
+                return self.queue.get(timeout=timeout)
+            return self.queue.get_nowait()
+        except Empty:
+            return None
+
+    def close(self):
+        for channel in self.channels:
+            self.dispatcher.unsubscribe(channel)
+        self.channels = []
+
+
+class HostedConnections(object):
+    """
+    Connections of a hosted site.  The S3, Redis, Mongo and Influx clients and their connection pools are
+    those of the host, only the pubsub is specific to the site.
+    """
+
+    def __init__(self, connections, redis_pubsub):
+        self._connections = connections
+        self.redis_pubsub = redis_pubsub
+
+    def __getattr__(self, name):
+        return getattr(self._connections, name)
+
+
+class SiteHost(object):
+    """
+    Long lived process which runs the step_sim jobs of many sites concurrently, each site in its own thread.
+    The models, clients and libraries are loaded once for all of the sites instead of once per site.
+    Jobs are taken from a Redis list as the argument lists of step_sim_arg_parser.  A site which fails is
+    marked as stopped without affecting the other sites.  The host exits once it has been idle for
+    idle_timeout seconds.
+    """
+
+    def __init__(self, connections, model_type, factory, capacity=None, idle_timeout=None, logger=None):
+        """
+        :param connections: AlfalfaConnections shared by the sites
+        :param model_type: 'osm' or 'fmu', the type of the models hosted
+        :param factory: function of (argv, connections) returning the object which runs the site
+        :param capacity: maximum number of sites run concurrently, defaults to the
+                         ALFALFA_SITE_HOST_CAPACITY environment variable or 50
+        :param idle_timeout: seconds without sites before the host exits, defaults to the
+                             ALFALFA_SITE_HOST_IDLE_TIMEOUT environment variable or 300
+        :param logger: logger to report to
+        """
+        self.connections = connections
+        self.queue_key = SITE_HOST_QUEUE.format(model_type)
+        self.factory = factory
+        if capacity is None:
+            capacity = int(os.environ.get('ALFALFA_SITE_HOST_CAPACITY', 50))
+        self.capacity = max(1, capacity)
+        if idle_timeout is None:
+            idle_timeout = float(os.environ.get('ALFALFA_SITE_HOST_IDLE_TIMEOUT', 300))
+        self.idle_timeout = idle_timeout
+        self.logger = logger if logger is not None else logging.getLogger('simulation')
+
+        self.dispatcher = ChannelDispatcher(connections.redis.pubsub())
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        self.dispatcher.start()
+        idle_since = time.time()
+        try:
+            while True:
+                with self.lock:
+                    running = len(self.sites)
+                if running:
+                    idle_since = time.time()
+                elif time.time() - idle_since >= self.idle_timeout:
+                    self.logger.info("Site host idle for {}s, exiting".format(self.idle_timeout))
+                    return
+                if running >= self.capacity:
+                    time.sleep(1)
+                    continue
+                job = self.connections.redis.blpop(self.queue_key, timeout=5)
+                if job:
+                    self.launch(json.loads(decode_message(job[1])))
+        finally:
+            self.dispatcher.stop()
+
+    def launch(self, argv):
+        """
+        Start a site in a new thread
+
+        :param argv: arguments of step_sim_arg_parser, the site_id is the first
+        :return: the thread running the site, or None if the site is already running
+        """
+        site_id = argv[0]
+        with self.lock:
+            if site_id in self.sites:
+                self.logger.info("Site {} is already running on this host".format(site_id))
+                return None
+            thread = threading.Thread(target=self.run_site, args=(site_id, argv), name='site-{}'.format(site_id))
+            thread.daemon = True
+            self.sites[site_id] = thread
+        self.logger.info("Starting site {} with {} sites running".format(site_id, len(self.sites)))
+        thread.start()
+        return thread
+
+    def run_site(self, site_id, argv):
+        channel = SiteChannel(self.dispatcher)
+        try:
+            site = self.factory(argv, HostedConnections(self.connections, channel))
+            site.run()
+            self.logger.info("Site {} completed".format(site_id))
+        except (Exception, SystemExit) as e:
+            self.logger.error("Site {} failed: {} with {}".format(site_id, e, traceback.format_exc()))
+            self.site_failed(site_id)
+        finally:
+            channel.close()
+            with self.lock:
+                del self.sites[site_id]
+
+    def site_failed(self, site_id):
+        """Mark a site which failed as stopped so that clients do not wait for it"""
+        try:
+            self.connections.redis.hset(site_id, 'control', 'idle')
+            self.connections.mongo_db_recs.update_one({"_id": site_id}, {"$set": {"rec.simStatus": "s:Stopped"}})
+        except Exception as e:
+            self.logger.error("Unable to mark site {} as stopped: {}".format(site_id, e))
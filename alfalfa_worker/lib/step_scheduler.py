@@ -0,0 +1,121 @@
+from __future__ import print_function
+
+import os
+import time
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    # Python 2 has no monotonic clock in the standard library
+    monotonic = time.time
+
+# What to do when the simulation falls behind the wall clock:
+# take the missed steps back to back until it has caught up,
+CATCH_UP = 'catch_up'
+# drop the missed steps and take the next step on the original schedule,
+SKIP = 'skip'
+# or restart the schedule from the late step, so that the simulation runs slower than requested.
+SLOW_DOWN = 'slow_down'
+POLICIES = (CATCH_UP, SKIP, SLOW_DOWN)
+
+
+class StepScheduler(object):
+    """
+    Schedule the steps of a simulation run at time_scale times real time.  Step times are computed from
+    the start of the schedule with a monotonic clock, so that the time taken by each step and the wake
+    up latency do not accumulate into drift.
+    """
+
+    def __init__(self, step_seconds, time_scale, policy=None, max_burst=None, clock=monotonic):
+        """
+        :param step_seconds: simulated seconds per step
+        :param time_scale: simulated seconds per wall clock second
+        :param policy: one of POLICIES, defaults to the ALFALFA_TIMESCALE_POLICY environment variable or catch_up
+        :param max_burst: maximum number of steps taken back to back to catch up, defaults to the
+                          ALFALFA_TIMESCALE_MAX_BURST environment variable or 10
+        :param clock: function returning the current time in seconds
+        """
+        if time_scale <= 0:
+            raise ValueError("time_scale must be positive, not {}".format(time_scale))
+        if policy is None:
+            policy = os.environ.get('ALFALFA_TIMESCALE_POLICY', CATCH_UP)
+        if policy not in POLICIES:
+            raise ValueError("Unknown timescale policy: {}, expected one of {}".format(policy, POLICIES))
+        if max_burst is None:
+            max_burst = int(os.environ.get('ALFALFA_TIMESCALE_MAX_BURST', 10))
+
+        self.step_seconds = float(step_seconds)
+        self.time_scale = float(time_scale)
+        self.interval = self.step_seconds / self.time_scale
+        self.policy = policy
+        self.max_burst = max(1, max_burst)
+        self.clock = clock
+
+        self.origin = None
+        self.next_time = None
+        self.paused_at = None
+        self.steps = 0
+        self.skipped = 0
+
+    def start(self):
+        """Start the schedule, the first step is due one interval from now"""
+        self.origin = self.clock()
+        self.next_time = self.origin + self.interval
+
+    def time_until_due(self):
+        """Return the wall clock seconds until the next step is due, 0 or less if it is due"""
+        return self.next_time - self.clock()
+
+    def due_steps(self):
+        """
+        Return the number of steps to take now, 0 if the next step is not due yet.  More than one step
+        is only returned by the catch_up policy.
+        """
+        if self.paused_at is not None:
+            return 0
+        late = self.clock() - self.next_time
+        if late < 0:
+            return 0
+        if self.policy == CATCH_UP:
+            return min(int(late // self.interval) + 1, self.max_burst)
+        return 1
+
+    def steps_taken(self, steps=1):
+        """
+        Move the schedule forward after steps were taken
+
+        :param steps: number of steps taken
+        """
+        self.steps += steps
+        self.next_time += steps * self.interval
+        now = self.clock()
+        if self.next_time > now:
+            return
+        if self.policy == SKIP:
+            missed = int((now - self.next_time) // self.interval) + 1
+            self.skipped += missed
+            self.next_time += missed * self.interval
+        elif self.policy == SLOW_DOWN:
+            self.next_time = now + self.interval
+
+    def pause(self):
+        """Hold the schedule, no step is due until it is resumed"""
+        if self.paused_at is None:
+            self.paused_at = self.clock()
+
+    def resume(self):
+        """Resume a paused schedule, the time spent paused is neither caught up nor counted as lag"""
+        if self.paused_at is not None:
+            paused = self.clock() - self.paused_at
+            self.origin += paused
+            self.next_time += paused
+            self.paused_at = None
+
+    def lag(self):
+        """
+        Return how far, in simulated seconds, the simulation is behind the time it would have reached
+        running at exactly time_scale since the schedule started.  Steps dropped by the skip policy and
+        time lost by the slow_down policy count as lag.
+        """
+        expected = (self.clock() - self.origin) * self.time_scale
+        return max(0.0, expected - self.steps * self.step_seconds)
@@ -24,12 +24,12 @@ information, and calculating and reporting results.
 
 """
 
-import copy
-
-import numpy as np
 from data.data_manager import Data_Manager
 from pyfmi import load_fmu
-from scipy.integrate import trapz
+
+from .fmu_stepper import create_stepper
+from .kpi_calculator import KPICalculator
+from .result_store import ResultStore, select_result_variables
 
 
 class TestCase(object):
@@ -52,7 +52,10 @@ class TestCase(object):
 
         # default the remaining kwarg arguments
         init_options = {
-            'start_time': 0
+            'start_time': 0,
+            'stepping': 'simulate',
+            'result_handling': 'memory',
+            'result_variables': None
         }
         init_options.update(kwargs)
 
@@ -65,33 +68,47 @@ class TestCase(object):
         if self.fmu_version != '2.0':
             raise ValueError('FMU must be version 2.0.')
         # Load data and the kpis_json for the test case
-        data_manager = Data_Manager(testcase=self)
-        data_manager.load_data_and_kpisjson()
+        # Keep the data manager so that its interpolation kernels and cached forecast windows are reused
+        self.data_manager = Data_Manager(testcase=self)
+        self.data_manager.load_data_and_kpisjson()
         # Get available control inputs and outputs
         input_names = self.fmu.get_model_variables(causality=2).keys()
         output_names = self.fmu.get_model_variables(causality=3).keys()
         # Get input and output meta-data
         self.inputs_metadata = self._get_var_metadata(self.fmu, input_names, inputs=True)
         self.outputs_metadata = self._get_var_metadata(self.fmu, output_names)
+        # Only store the requested variables, and the signals needed by the KPIs
+        input_names = select_result_variables(input_names, init_options['result_variables'], self.kpi_json)
+        output_names = select_result_variables(output_names, init_options['result_variables'], self.kpi_json)
         # Define outputs data
         self.y = {'time': []}
         for key in output_names:
             self.y[key] = []
-        self.y_store = copy.deepcopy(self.y)
         # Define inputs data
         self.u = {'time': []}
         for key in input_names:
             self.u[key] = []
-        self.u_store = copy.deepcopy(self.u)
+        # Store the trajectories of the outputs and inputs in columns which share the time column
+        self.results = ResultStore(list(output_names) + list(input_names))
+        self.y_store = self.results.view(output_names)
+        self.u_store = self.results.view(input_names)
+        self.kpi_calculator = KPICalculator(self.kpi_json)
         # Set default options
         self.options = self.fmu.simulate_options()
         self.options['CVode_options']['rtol'] = 1e-6
+        # Keep the results of each simulate call in memory rather than writing a result file,
+        # and only record the stored variables
+        self.options['result_handling'] = init_options['result_handling']
+        if init_options['result_variables'] is not None:
+            self.options['filter'] = self.results.names[1:]
         # Set default communication step
         self.set_step(init_options['step'])
         # Set initial simulation start
         self.start_time = init_options['start_time']
         self.initialize = True
         self.options['initialize'] = self.initialize
+        # Engine which advances the FMU, either persistent or with fmu.simulate per step
+        self.stepper = create_stepper(self.fmu, self.options, self.results.names[1:], init_options['stepping'])
 
     def advance(self, u):
         '''Advances the test case model simulation forward one step.
@@ -113,49 +130,25 @@ class TestCase(object):
         # Set final time
         self.final_time = self.start_time + self.step
         # Set control inputs if they exist and are written
-        # Check if possible to overwrite
-        if u.keys():
-            # If there are overwriting keys available
-            # Check that any are overwritten
-            written = False
-            for key in u.keys():
-                if u[key]:
-                    written = True
-                    break
-            # If there are, create input object
-            if written:
-                u_list = []
-                u_trajectory = self.start_time
-                for key in u.keys():
-                    if key != 'time' and u[key]:
-                        value = float(u[key])
-                        # Check min/max if not activation input
-                        if '_activate' not in key:
-                            checked_value = self._check_value_min_max(key, value)
-                        else:
-                            checked_value = value
-                        u_list.append(key)
-                        u_trajectory = np.vstack((u_trajectory, checked_value))
-                input_object = (u_list, np.transpose(u_trajectory))
-            # Otherwise, input object is None
-            else:
-                input_object = None
-        # Otherwise, input object is None
-        else:
-            input_object = None
+        inputs = []
+        for key in u.keys():
+            if key != 'time' and u[key]:
+                value = float(u[key])
+                # Check min/max if not activation input
+                if '_activate' not in key:
+                    checked_value = self._check_value_min_max(key, value)
+                else:
+                    checked_value = value
+                inputs.append((key, checked_value))
         # Simulate
-        self.options['initialize'] = self.initialize
-        res = self.fmu.simulate(start_time=self.start_time,
-                                final_time=self.final_time,
-                                options=self.options,
-                                input=input_object)
+        res = self.stepper.step(self.start_time, self.final_time, inputs, self.initialize)
         # Get result and store measurement
         for key in self.y.keys():
             self.y[key] = res[key][-1]
-            self.y_store[key] = self.y_store[key] + res[key].tolist()[1:]
-        # Store control inputs
-        for key in self.u.keys():
-            self.u_store[key] = self.u_store[key] + res[key].tolist()[1:]
+        # Store measurements and control inputs
+        first_row = len(self.results)
+        self.results.append(res, start=1)
+        self.kpi_calculator.update(self.results, first_row)
         # Advance start time
         self.start_time = self.final_time
         # Prevent inialize
@@ -247,7 +240,7 @@ class TestCase(object):
 
         '''
 
-        Y = {'y': self.y_store, 'u': self.u_store}
+        Y = {'y': self.y_store.to_dict(), 'u': self.u_store.to_dict()}
 
         return Y
 
@@ -267,35 +260,18 @@ class TestCase(object):
 
         '''
 
-        kpis = dict()
-        # Calculate each KPI using json for signalsand save in dictionary
-        for kpi in self.kpi_json.keys():
-            print(kpi, type(kpi))
-            if 'Power' in kpi:
-                # Calculate total energy [KWh - assumes measured in J]
-                E = 0
-                for signal in self.kpi_json[kpi]:
-                    time = self.y_store['time']
-                    power = self.y_store[signal]
-                    E = E + np.trapz(power, time)
-                # Store result in dictionary
-                kpis['energy'] = E * 2.77778e-7  # Convert to kWh
-            elif kpi == 'AirZoneTemperature':
-                # Calculate total discomfort [K-h = assumes measured in K]
-                tot_dis = 0
-                heat_setpoint = 273.15 + 20
-                for signal in self.kpi_json[kpi]:
-                    data = np.array(self.y_store[signal])
-                    dT_heating = heat_setpoint - data
-                    dT_heating[dT_heating < 0] = 0
-                    tot_dis = tot_dis + trapz(dT_heating, self.y_store['time']) / 3600
-                # Store result in dictionary
-                kpis['comfort'] = tot_dis
-            else:
-                print('No calculation for KPI named "{0}".'.format(kpi))
+        # The KPIs are accumulated as each step is stored
+        kpis = self.kpi_calculator.get_kpis()
 
         return kpis
 
+    def close(self):
+        '''Release the stored results, removing their spill file if they were spilled to disk.
+
+        '''
+
+        self.results.close()
+
     def get_name(self):
         '''Returns the name of the test case fmu.
 
@@ -0,0 +1,111 @@
+from __future__ import print_function
+
+import time
+
+from .site_control import decode_message
+
+# Prefix of the message published on the site's Redis channel by the web server when a point is written,
+# the message is of the form 'write:{point_id}'
+WRITE_MESSAGE_PREFIX = 'write:'
+
+
+def current_winning_value(array):
+    """
+    Return the value of the highest priority level that is set in a Haystack write array,
+    or None if no level is set.
+
+    :param array: write array document from the Mongo writearrays collection
+    :return: winning value or None
+    """
+    for val in array.get('val') or []:
+        if val is not None:
+            return val
+    return None
+
+
+class WriteArrayCache(object):
+    """
+    In-memory cache of the current winning value of each write array of a site.
+    The cache is loaded once from Mongo, then only the points named in write notifications
+    are re-read from Mongo.  The whole cache is reloaded every reconcile_interval seconds in
+    case a notification was missed.
+    """
+
+    def __init__(self, mongo_db_write_arrays, site_id, reconcile_interval=60):
+        """
+        :param mongo_db_write_arrays: the Mongo writearrays collection
+        :param site_id: site to cache the write arrays of
+        :param reconcile_interval: seconds between full reloads of the cache, None to disable
+        """
+        self.mongo_db_write_arrays = mongo_db_write_arrays
+        self.site_id = site_id
+        self.reconcile_interval = reconcile_interval
+
+        # {point_id: winning value}, only points with a winning value are included
+        self.values = {}
+        # point ids that have been written since they were last read
+        self.dirty = set()
+        self.loaded_time = None
+
+    def load(self):
+        """Read all of the write arrays of the site from Mongo"""
+        self.values = {}
+        for array in self.mongo_db_write_arrays.find({"siteRef": self.site_id}):
+            self.set_value(array.get('_id'), current_winning_value(array))
+        self.dirty = set()
+        self.loaded_time = time.time()
+
+    def set_value(self, point_id, value):
+        if value is None:
+            self.values.pop(point_id, None)
+        else:
+            self.values[point_id] = value
+
+    def invalidate(self, point_id):
+        """Mark a point as written, it is re-read from Mongo before the values are next used"""
+        self.dirty.add(point_id)
+
+    def handle_message(self, data):
+        """
+        Invalidate the point named by a write notification from the site's Redis channel.
+
+        :param data: data of the pubsub message
+        :return: True if the message was a write notification, else False
+        """
+        message = decode_message(data)
+        if message is not None and message.startswith(WRITE_MESSAGE_PREFIX):
+            self.invalidate(message[len(WRITE_MESSAGE_PREFIX):])
+            return True
+        return False
+
+    def refresh(self):
+        """Re-read the invalidated points from Mongo"""
+        if not self.dirty:
+            return
+        point_ids = list(self.dirty)
+        self.dirty = set()
+        found = set()
+        for array in self.mongo_db_write_arrays.find({"_id": {"$in": point_ids}}):
+            found.add(array.get('_id'))
+            self.set_value(array.get('_id'), current_winning_value(array))
+        # Write arrays which no longer exist have no winning value
+        for point_id in point_ids:
+            if point_id not in found:
+                self.values.pop(point_id, None)
+
+    def current_values(self):
+        """
+        Return the current winning value of each written point of the site
+
+        :return: dict of {point_id: value}
+        """
+        if self.loaded_time is None:
+            stale = True
+        else:
+            stale = self.reconcile_interval is not None and \
+                time.time() - self.loaded_time >= self.reconcile_interval
+        if stale:
+            self.load()
+        else:
+            self.refresh()
+        return self.values
@@ -25,20 +25,15 @@
 
 from __future__ import print_function
 import os
-import boto3
-from pymongo import MongoClient
 import sys
 from datetime import datetime
 import pytz
 import lib.testcase
+from lib.alfalfa_connections import AlfalfaConnections
 
 try:
-    s3 = boto3.resource('s3', region_name=os.environ['REGION'], endpoint_url=os.environ['S3_URL'])
-
-    # Mongo Database
-    mongo_client = MongoClient(os.environ['MONGO_URL'])
-    mongodb = mongo_client[os.environ['MONGO_DB_NAME']]
-    sims = mongodb.sims
+    ac = AlfalfaConnections('run_sim')
+    sims = ac.mongo_db_sims
 
     upload_file_name = sys.argv[1]
     upload_id = sys.argv[2]
@@ -51,8 +46,8 @@ try:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    bucket = s3.Bucket(os.environ['S3_BUCKET'])
-    bucket.download_file(key, downloadpath)
+    bucket = ac.s3_bucket
+    bucket.download_file(key, downloadpath, Config=ac.s3_transfer_config)
 
     sims.update_one({"_id": upload_id}, {"$set": {"simStatus": "Running"}}, False)
 
@@ -26,25 +26,19 @@
 from __future__ import print_function
 import os
 import glob
-import boto3
 import tarfile
 import shutil
-from pymongo import MongoClient
 import sys
 import subprocess
 from datetime import datetime
 import pytz
 
-try:
-    sqs = boto3.resource('sqs', region_name=os.environ['REGION'], endpoint_url=os.environ['JOB_QUEUE_URL'])
-    queue = sqs.Queue(url=os.environ['JOB_QUEUE_URL'])
-
-    s3 = boto3.resource('s3', region_name=os.environ['REGION'], endpoint_url=os.environ['S3_URL'])
+from alfalfa_worker.lib.alfalfa_connections import AlfalfaConnections
+from alfalfa_worker.lib.archiver import archive_results
 
-    # Mongo Database
-    mongo_client = MongoClient(os.environ['MONGO_URL'])
-    mongodb = mongo_client[os.environ['MONGO_DB_NAME']]
-    sims = mongodb.sims
+try:
+    ac = AlfalfaConnections('run_sim')
+    sims = ac.mongo_db_sims
 
     upload_file_name = sys.argv[1]
     upload_id = sys.argv[2]
@@ -57,8 +51,8 @@ try:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    bucket = s3.Bucket(os.environ['S3_BUCKET'])
-    bucket.download_file(key, tarpath)
+    bucket = ac.s3_bucket
+    bucket.download_file(key, tarpath, Config=ac.s3_transfer_config)
 
     tar = tarfile.open(tarpath)
     tar.extractall(directory)
@@ -72,23 +66,14 @@ try:
 
     os.remove(tarpath)
 
-    def reset(tarinfo):
-        tarinfo.uid = tarinfo.gid = 0
-        tarinfo.uname = tarinfo.gname = "root"
-        return tarinfo
-
     tarname = "%s.tar.gz" % upload_id
-    tar = tarfile.open(tarname, "w:gz")
-    tar.add(directory, filter=reset, arcname=upload_id)
-    tar.close()
-
     uploadkey = "simulated/%s" % tarname
-    bucket.upload_file(tarname, uploadkey)
-    os.remove(tarname)
+    archive = archive_results(directory, upload_id, bucket, uploadkey)
     shutil.rmtree(directory)
 
     time = str(datetime.now(tz=pytz.UTC))
-    sims.update_one({"_id": upload_id}, {"$set": {"simStatus": "Complete", "timeCompleted": time, "s3Key": uploadkey}}, False)
+    sims.update_one({"_id": upload_id}, {"$set": {"simStatus": "Complete", "timeCompleted": time, "s3Key": uploadkey,
+                                                  "archive": archive}}, False)
 
 except Exception as e:
     print('runSimulation: %s' % e, file=sys.stderr)
@@ -5,5 +5,5 @@ from alfalfa_worker.step_sim.model_advancer import ModelAdvancer
 
 
 class FMUModelAdvancer(ModelAdvancer):
-    def __init__(self):
-        super(FMUModelAdvancer, self).__init__()
+    def __init__(self, args=None, connections=None):
+        super(FMUModelAdvancer, self).__init__(args, connections)
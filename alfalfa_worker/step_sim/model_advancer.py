@@ -4,18 +4,36 @@ import datetime
 
 # sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from alfalfa_worker.lib.alfalfa_connections import AlfalfaConnections
+from alfalfa_worker.lib.artifact_cache import ArtifactCache
+from alfalfa_worker.lib.historian_writer import HistorianWriter
+from alfalfa_worker.lib.site_control import (
+    PAUSE_MESSAGE,
+    RESUME_MESSAGE,
+    STOP_MESSAGE,
+    StepCompletion,
+    StopReconciler,
+    parse_control_message
+)
+from alfalfa_worker.lib.write_array_cache import WriteArrayCache
 from alfalfa_worker.step_sim.model_logger import ModelLogger
 
 
 class ModelAdvancer(object):
     """Base class for advancing models"""
 
-    def __init__(self):
+    def __init__(self, args=None, connections=None):
+        """
+        :param args: parsed step_sim arguments, parsed from the command line when not given
+        :param connections: AlfalfaConnections to use, new connections are made when not given.
+                            Sites run by a site host share the connections of the host.
+        """
         # Parse args and extract to class variables
 
         # Having an arg parser here is a bit strange. Maybe just a partial to the argparser?
-        from alfalfa_worker.step_sim.step_sim_utils import step_sim_arg_parser
-        self.args = step_sim_arg_parser()
+        if args is None:
+            from alfalfa_worker.step_sim.step_sim_utils import step_sim_arg_parser
+            args = step_sim_arg_parser()
+        self.args = args
         self.site_id = self.args.site_id
         self.step_sim_type = self.args.step_sim_type
         if self.step_sim_type == 'timescale':
@@ -35,8 +53,15 @@ class ModelAdvancer(object):
         self.model_logger = ModelLogger()
 
         # Setup connections
-        self.ac = AlfalfaConnections()
+        self.ac = connections if connections is not None else AlfalfaConnections()
         self.site = self.ac.mongo_db_recs.find_one({"_id": self.site_id})
+        # Signals the end of each advance to the web server
+        self.completion = StepCompletion(self.ac.redis, self.site_id)
+        # Stops are requested on the site channel, Mongo is only checked in case the message was missed
+        self.stop_reconciler = StopReconciler(self.ac.mongo_db_recs, self.site_id)
+
+        # Current values of the write arrays, kept up to date by the write notifications on the site channel
+        self.write_array_cache = WriteArrayCache(self.ac.mongo_db_write_arrays, self.site_id)
 
         # Setup tar file for downloading from s3
         self.parsed_path = '/parsed'
@@ -46,13 +71,23 @@ class ModelAdvancer(object):
             os.makedirs(self.sim_path_site)
         self.tar_name = "{}.tar.gz".format(self.site_id)
         self.tar_path = os.path.join(self.sim_path_site, self.tar_name)
+        # Node local cache of the parsed site tarballs
+        self.artifact_cache = ArtifactCache(self.ac.s3_bucket, logger=self.model_logger.logger)
 
         # Set state of simulation variables
         self.stop = False  # Stop == True used to end the simulation and initiate cleanup
+        self.paused = False  # Paused == True holds the simulation at its current time until resumed
         self.advance = False  # Advance == True condition specifically indicates a step shall be taken
+        self.advance_steps = 1  # Number of steps to take when advancing with an external_clock
 
         # Global flag for using the historian
         self.historian_enabled = os.environ.get('HISTORIAN_ENABLE', False) == 'true'
+        # Writes the historian points in the background so that InfluxDB never slows the simulation
+        self.historian_writer = None
+        if self.historian_enabled:
+            self.historian_writer = HistorianWriter(self.ac.influx_client, self.ac.influx_db_name,
+                                                    logger=self.model_logger.logger)
+            self.historian_writer.start()
 
     def set_db_status_running(self):
         """
@@ -64,14 +99,32 @@ class ModelAdvancer(object):
         self.ac.mongo_db_recs.update_one({"_id": self.site_id},
                                          {"$set": {"rec.datetime": output_time_string, "rec.simStatus": "s:Running"}})
 
-    def check_sim_status_stop(self):
+    def handle_control_message(self, data):
         """
-        Check if the simulation status is either stopped or stopping
+        Apply a stop, pause or resume message from the site channel
 
-        :return:
+        :param data: data of the pubsub message
+        :return: True if the message was a control message
         """
-        status = self.site.get("rec", {}).get("simStatus")
-        if status == "s:Stopped" or status == "s:Stopping":
+        command = parse_control_message(data)
+        if command == STOP_MESSAGE:
+            self.stop = True
+        elif command == PAUSE_MESSAGE:
+            self.set_paused(True)
+        elif command == RESUME_MESSAGE:
+            self.set_paused(False)
+        return command is not None
+
+    def set_paused(self, paused):
+        """Pause or resume the simulation and expose its state as the simStatus of the site"""
+        if paused != self.paused:
+            self.paused = paused
+            self.ac.mongo_db_recs.update_one({"_id": self.site_id},
+                                             {"$set": {"rec.simStatus": "s:Paused" if paused else "s:Running"}})
+
+    def reconcile_stop(self):
+        """Stop if the site was asked to stop in Mongo, at most once per reconcile interval"""
+        if self.stop_reconciler.stop_requested():
             self.stop = True
 
     def run(self):
@@ -82,6 +135,9 @@ class ModelAdvancer(object):
         self.init_sim()
         self.set_db_status_running()
         self.ac.redis_pubsub.subscribe(self.site_id)
+        # Load after subscribing so that no write notification is missed
+        self.write_array_cache.load()
+        self.model_logger.logger.info(self.ac.startup_report())
         if self.step_sim_type == 'timescale' or self.step_sim_type == 'realtime':
             self.model_logger.logger.info("Running timescale / realtime")
             self.run_timescale()
@@ -90,7 +146,16 @@ class ModelAdvancer(object):
             self.run_external_clock()
 
     def set_idle_state(self):
-        self.ac.redis.hset(self.site_id, 'control', 'idle')
+        """Set an idle state in Redis and reset the step count"""
+        self.completion.reset()
+
+    def publish_lag(self, lag):
+        """
+        Publish how far, in simulated seconds, a timescale or realtime simulation is behind schedule
+
+        :param lag: seconds of simulated time behind schedule
+        """
+        self.ac.redis.hset(self.site_id, 'lag', round(lag, 3))
 
     def check_stop_conditions(self):
         """Placeholder to check for all stopping conditions"""
@@ -103,7 +168,7 @@ class ModelAdvancer(object):
 
         Step should consist of the following:
             - Reading write arrays from mongo
-            - check_sim_status_stop
+            - check_stop_conditions
             - if not self.stop
                 - Update model inputs
                 - Advancing the simulation
@@ -9,6 +9,11 @@ class ModelLogger:
         logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
         self.logger = logging.getLogger('simulation')
         self.formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.fh = logging.FileHandler('model_logger.log')
-        self.fh.setFormatter(self.formatter)
-        self.logger.addHandler(self.fh)
+        # Sites run by a site host share the logger, only add the file handler once
+        handlers = [h for h in self.logger.handlers if isinstance(h, logging.FileHandler)]
+        if handlers:
+            self.fh = handlers[0]
+        else:
+            self.fh = logging.FileHandler('model_logger.log')
+            self.fh.setFormatter(self.formatter)
+            self.logger.addHandler(self.fh)
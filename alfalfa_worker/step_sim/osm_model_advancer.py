@@ -2,28 +2,31 @@
 import os
 import shutil
 import sys
-import tarfile
+import time
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Third party library imports
 import mlep
 import pytz
 
 # Local imports
+from alfalfa_worker.lib.archiver import archive_results
+from alfalfa_worker.lib.current_values import CurrentValueStore, current_values_enabled
+from alfalfa_worker.lib.output_publisher import OutputPublisher
+from alfalfa_worker.lib.site_control import MESSAGE_TIMEOUT, parse_advance_steps, wait_for_message
+from alfalfa_worker.lib.step_scheduler import StepScheduler
 from alfalfa_worker.step_sim.model_advancer import ModelAdvancer
 from alfalfa_worker.step_sim.step_osm.parse_variables import ParseVariables
 
 
 class OSMModelAdvancer(ModelAdvancer):
-    def __init__(self):
-        super(OSMModelAdvancer, self).__init__()
-        # Download file from bucket and extract
+    def __init__(self, args=None, connections=None):
+        super(OSMModelAdvancer, self).__init__(args, connections)
+        # Extract the parsed site from the node's artifact cache, or download it from the bucket.
+        # E+ modifies its files in place so they are copied rather than linked from the cache.
         self.bucket_key = os.path.join(self.parsed_path, self.tar_name)
-        self.ac.s3_bucket.download_file(self.bucket_key, self.tar_path)
-        tar = tarfile.open(self.tar_path)
-        tar.extractall(self.sim_path)
-        tar.close()
+        self.artifact_cache.fetch(self.bucket_key, self.sim_path)
 
         self.time_steps_per_hour = 60  # Default to 1-min E+ step intervals (i.e. 60/hr)
 
@@ -54,9 +57,28 @@ class OSMModelAdvancer(ModelAdvancer):
         self.variables_file = os.path.realpath(os.path.join(self.sim_path_site, 'simulation/variables.cfg'))
         self.haystack_json_file = os.path.realpath(os.path.join(self.sim_path_site, 'simulation/haystack_report_haystack.json'))
         self.variables = ParseVariables(self.variables_file, self.ep.mapping, self.haystack_json_file)
+        for output_id in self.variables.invalid_output_ids:
+            self.model_logger.logger.error('bad output index for: %s' % output_id)
+
+        # Indexes of the EMS outputs which expose the current E+ time
+        self.month_index = self.variables.output_index_from_type_and_name("current_month", "EMS")
+        self.day_index = self.variables.output_index_from_type_and_name("current_day", "EMS")
+        self.hour_index = self.variables.output_index_from_type_and_name("current_hour", "EMS")
+        self.minute_index = self.variables.output_index_from_type_and_name("current_minute", "EMS")
 
         # Define MLEP inputs
         self.ep.inputs = [0] * ((len(self.variables.get_input_ids())) + 1)
+        # Inputs sent while bypassing to the start time, MasterEnable and all other inputs are 0
+        self.bypass_inputs = tuple(self.ep.inputs)
+
+        # Batches the curVal updates of each step into a single bulk write
+        self.output_publisher = OutputPublisher(self.ac.mongo_db_recs, self.model_logger.logger)
+        # With ALFALFA_CURRENT_VALUES=redis the current values are kept in Redis and written behind to Mongo
+        self.current_values = None
+        if current_values_enabled():
+            self.current_values = CurrentValueStore(self.ac.redis, self.site_id, self.output_publisher,
+                                                    logger=self.model_logger.logger)
+            self.current_values.start()
 
         # The idf RunPeriod is manipulated in order to get close to the desired start time,
         # but we can only get within 24 hours. We use "bypass" steps to quickly get to the
@@ -69,7 +91,7 @@ class OSMModelAdvancer(ModelAdvancer):
 
     def check_stop_conditions(self):
         """Placeholder to check for all stopping conditions"""
-        self.check_sim_status_stop()
+        self.reconcile_stop()
         if self.ep.status != 0:
             self.stop = True
         if not self.ep.is_running:
@@ -96,24 +118,56 @@ class OSMModelAdvancer(ModelAdvancer):
         The purpose of this function is to move the simulation to the requested
         start minute.
         This is accomplished by advancing the simulation as quickly as possible. Data is not
-        published to database during this process
+        published to database during this process.
+        Because the RunPeriod begins on the day of the start time, the number of bypass steps
+        is known after the first exchange, and they are fast forwarded without reading the
+        write arrays or logging each step.
         """
+        start = time.time()
         self.exchange_data()
 
         current_ep_time = self.get_energyplus_datetime()
+        bypass_steps = self.count_bypass_steps(current_ep_time)
         self.model_logger.logger.info(
-            'current_ep_time: {}, start_datetime: {}'.format(current_ep_time, self.start_datetime))
-        while True:
+            'current_ep_time: {}, start_datetime: {}, bypass steps: {}'.format(
+                current_ep_time, self.start_datetime, bypass_steps))
+        self.fast_forward(bypass_steps)
+
+        # Step the remainder individually in case E+ did not land on the expected time
+        current_ep_time = self.get_energyplus_datetime()
+        while current_ep_time < self.start_datetime:
+            self.fast_forward(1)
+            bypass_steps += 1
             current_ep_time = self.get_energyplus_datetime()
-            if current_ep_time < self.start_datetime:
-                self.model_logger.logger.info(
-                    'current_ep_time: {}, start_datetime: {}'.format(current_ep_time, self.start_datetime))
-                self.step()
-            else:
-                self.model_logger.logger.info(f"current_ep_time: {current_ep_time} reached desired start_datetime: {self.start_datetime}")
-                break
+
         self.master_enable_bypass = False
         self.update_db()
+        self.model_logger.logger.info(
+            f"current_ep_time: {current_ep_time} reached desired start_datetime: {self.start_datetime} "
+            f"after {bypass_steps} bypass steps, time to first usable step: {time.time() - start:.2f} s")
+
+    def count_bypass_steps(self, current_ep_time):
+        """
+        Return the number of timesteps between the current E+ time and the requested start time
+
+        :param current_ep_time: datetime of E+ after the first exchange
+        :return: int
+        """
+        seconds = (self.start_datetime - current_ep_time).total_seconds()
+        return max(0, int(seconds // self.seconds_per_time_step()))
+
+    def fast_forward(self, steps):
+        """
+        Advance steps timesteps with the constant bypass inputs.  Unlike step, the write arrays are not
+        read and nothing is logged or published.
+
+        :param steps: number of timesteps to advance
+        """
+        for _ in range(steps):
+            self.ep.kStep += 1
+            self.ep.write(mlep.mlep_encode_real_data(2, 0, (self.ep.kStep - 1) * self.ep.deltaT, self.bypass_inputs))
+            flag, _, outputs = mlep.mlep_decode_packet(self.ep.read())
+            self.ep.outputs = outputs
 
     def exchange_data(self):
         """
@@ -163,86 +217,106 @@ class OSMModelAdvancer(ModelAdvancer):
         sim_id = str(uuid.uuid4())
         tar_name = "%s.tar.gz" % sim_id
 
-        tar_file = tarfile.open(tar_name, "w:gz")
-        tar_file.add(self.sim_path_site, filter=self.reset, arcname=self.site_id)
-        tar_file.close()
-
         s3_key = "simulated/%s/%s" % (self.site_id, tar_name)
-        self.ac.s3_bucket.upload_file(tar_name, s3_key)
+        archive = archive_results(self.sim_path_site, self.site_id, self.ac.s3_bucket, s3_key)
 
-        os.remove(tar_name)
         shutil.rmtree(self.sim_path_site)
 
         name = self.site.get("rec", {}).get("dis", "Unknown") if self.site else "Unknown"
         name = name.replace("s:", "")
         t = str(datetime.now(tz=pytz.UTC))
         self.ac.mongo_db_sims.insert_one(
-            {"_id": sim_id, "siteRef": self.site_id, "s3Key": s3_key, "name": name, "timeCompleted": t})
+            {"_id": sim_id, "siteRef": self.site_id, "s3Key": s3_key, "name": name, "timeCompleted": t,
+             "archive": archive})
         self.ac.mongo_db_recs.update_one({"_id": self.site_id},
                                          {"$set": {"rec.simStatus": "s:Stopped"},
                                           "$unset": {"rec.datetime": "", "rec.step": ""}}, False)
-        self.ac.mongo_db_recs.update_many({"_id": self.site_id, "rec.cur": "m:"},
+        if self.current_values is not None:
+            self.current_values.close()
+        self.ac.mongo_db_recs.update_many({"site_ref": self.site_id, "rec.cur": "m:"},
                                           {"$unset": {"rec.curVal": "", "rec.curErr": ""},
                                            "$set": {"rec.curStatus": "s:disabled"}},
                                           False)
         self.ep.stop(True)
         self.ep.is_running = 0
+        if self.historian_writer is not None:
+            self.historian_writer.close()
 
     def run_external_clock(self):
         self.advance_to_start_time()
         while True:
-            self.process_pubsub_message()
+            # Sleep until an advance or control message arrives
+            self.process_pubsub_message(min(MESSAGE_TIMEOUT, self.stop_reconciler.time_until_due()))
+            self.check_stop_conditions()
 
             if self.stop:
                 self.cleanup()
                 break
 
             if self.advance:
-                self.step()
-                self.update_db()
-                self.set_redis_states_after_advance()
+                # A paused simulation replies to an advance without stepping
+                taken = 0 if self.paused else self.step_and_update_db(self.advance_steps)
+                self.set_redis_states_after_advance(taken)
                 self.advance = False
+                self.advance_steps = 1
 
-    def step_delta_time(self):
+    def step_and_update_db(self, steps=1):
         """
-        Return a timedelta object to represent the real time between steps
-        This is used by the internal clock. Does not apply to the external clock
+        Run steps co-simulation exchanges back to back, then update the database once with the outputs
+        of the last step.  When the historian is enabled the outputs of the intermediate steps are also
+        written to it, so that it keeps the full history.
+
+        :param steps: number of simulation timesteps to advance
+        :return: number of timesteps advanced
         """
-        return timedelta(seconds=(self.seconds_per_time_step() / self.step_sim_value))
+        taken = 0
+        while taken < steps:
+            self.step()
+            taken += 1
+            if self.ep.status != 0 or not self.ep.is_running:
+                break
+            if self.historian_enabled and taken < steps:
+                self.write_outputs_to_influx()
+        self.update_db()
+        return taken
 
     def run_timescale(self):
         self.advance_to_start_time()
 
-        next_step_time = datetime.now() + self.step_delta_time()
+        scheduler = StepScheduler(self.seconds_per_time_step(), self.step_sim_value)
+        scheduler.start()
         while True:
-            current_time = datetime.now()
-
-            if current_time >= next_step_time:
-                self.advance = True
-
-            self.process_pubsub_message()
+            # Sleep until a message arrives or the next step is due
+            timeout = MESSAGE_TIMEOUT if self.paused else scheduler.time_until_due()
+            self.process_pubsub_message(min(timeout, self.stop_reconciler.time_until_due()))
+            self.check_stop_conditions()
 
             if self.stop:
                 self.cleanup()
                 break
 
-            if self.advance:
-                self.step()
-                self.update_db()
-                self.set_redis_states_after_advance()
-                next_step_time = next_step_time + self.step_delta_time()
+            if self.paused:
+                scheduler.pause()
+                if self.advance:
+                    self.set_redis_states_after_advance(0)
+                    self.advance = False
+                continue
+            scheduler.resume()
+
+            steps = scheduler.due_steps()
+            if steps:
+                # Only the steps actually taken move the schedule, E+ may stop before all of them
+                taken = self.step_and_update_db(steps)
+                scheduler.steps_taken(taken)
+                self.publish_lag(scheduler.lag())
+            elif self.advance:
+                # An advance requested between two scheduled steps is taken outside of the schedule,
+                # the scheduled steps keep their times
+                taken = self.step_and_update_db(self.advance_steps)
+            if steps or self.advance:
+                self.set_redis_states_after_advance(taken)
                 self.advance = False
-
-    def reset(self, tarinfo):
-        """
-        TODO: Don't know what this function does...
-
-        :param tarinfo:
-        :return:
-        """
-        tarinfo.uid = tarinfo.gid = 0
-        tarinfo.uname = tarinfo.gname = "root"
-        return tarinfo
+                self.advance_steps = 1
 
     def get_energyplus_datetime(self):
         """
@@ -251,16 +325,11 @@ class OSMModelAdvancer(ModelAdvancer):
         :return:
         :rtype datetime()
         """
-        month_index = self.variables.output_index_from_type_and_name("current_month", "EMS")
-        day_index = self.variables.output_index_from_type_and_name("current_day", "EMS")
-        hour_index = self.variables.output_index_from_type_and_name("current_hour", "EMS")
-        minute_index = self.variables.output_index_from_type_and_name("current_minute", "EMS")
-
         # TODO where doe ep.outputs actually get written to...? can't find in mlep lib
-        day = int(round(self.ep.outputs[day_index]))
-        hour = int(round(self.ep.outputs[hour_index]))
-        minute = int(round(self.ep.outputs[minute_index]))
-        month = int(round(self.ep.outputs[month_index]))
+        day = int(round(self.ep.outputs[self.day_index]))
+        hour = int(round(self.ep.outputs[self.hour_index]))
+        minute = int(round(self.ep.outputs[self.minute_index]))
+        month = int(round(self.ep.outputs[self.month_index]))
         year = self.start_datetime.year
 
         if minute == 60 and hour == 23:
@@ -359,60 +428,53 @@ class OSMModelAdvancer(ModelAdvancer):
         """
         self.replace_timestep_and_run_period_idf_settings()
 
-    def process_pubsub_message(self):
+    def process_pubsub_message(self, timeout=0):
         """
         Process message from pubsub and set relevant flags
 
+        :param timeout: seconds to wait for a message, 0 to only process a message which already arrived
         :return:
         """
-        message = self.ac.redis_pubsub.get_message()
+        message = wait_for_message(self.ac.redis_pubsub, timeout)
         if message:
             data = message['data']
-            if data == b'advance':
+            advance_steps = parse_advance_steps(data)
+            if advance_steps:
                 self.advance = True
-            elif data == b'stop':
-                self.stop = True
+                self.advance_steps = advance_steps
+            elif not self.handle_control_message(data):
+                self.write_array_cache.handle_message(data)
 
-    def set_redis_states_after_advance(self):
-        """Set an idle state in Redis"""
-        self.ac.redis.publish(self.site_id, 'complete')
-        self.ac.redis.hset(self.site_id, 'control', 'idle')
+    def set_redis_states_after_advance(self, steps=1):
+        """Set an idle state in Redis and publish the completion of the steps, in one round trip"""
+        self.completion.complete(self.get_energyplus_datetime(), steps)
 
     def read_write_arrays_and_prep_inputs(self):
-        master_index = self.variables.input_index_from_variable_name("MasterEnable")
         if self.master_enable_bypass:
-            self.ep.inputs[master_index] = 0
+            return self.bypass_inputs
         else:
+            master_index = self.variables.input_index_from_variable_name("MasterEnable")
             self.ep.inputs = [0] * ((len(self.variables.get_input_ids())) + 1)
             self.ep.inputs[master_index] = 1
-            for array in self.ac.mongo_db_write_arrays.find({"siteRef": self.site_id}):
-                for val in array.get('val'):
-                    if val is not None:
-                        index = self.variables.get_input_index(array.get('_id'))
-                        if index == -1:
-                            self.model_logger.logger.error('bad input index for: %s' % array.get('_id'))
-                        else:
-                            self.ep.inputs[index] = val
-                            self.ep.inputs[index + 1] = 1
-                            break
+            for point_id, val in self.write_array_cache.current_values().items():
+                index = self.variables.get_input_index(point_id)
+                if index == -1:
+                    self.model_logger.logger.error('bad input index for: %s' % point_id)
+                else:
+                    self.ep.inputs[index] = val
+                    self.ep.inputs[index + 1] = 1
         # Convert to tuple
         inputs = tuple(self.ep.inputs)
         return inputs
 
     def write_outputs_to_mongo(self):
-        """Placeholder for updating the current values exposed through Mongo AFTER a simulation timestep"""
-        for output_id in self.variables.get_output_ids():
-            output_index = self.variables.get_output_index(output_id)
-            if output_index == -1:
-                self.model_logger.logger.error('bad output index for: %s' % output_id)
-            else:
-                output_value = self.ep.outputs[output_index]
-
-                # TODO: Make this better with a bulk update
-                # Also at some point consider removing curVal and related fields after sim ends
-                self.ac.mongo_db_recs.update_one({"_id": output_id}, {
-                    "$set": {"rec.curVal": "n:%s" % output_value, "rec.curStatus": "s:ok",
-                             "rec.cur": "m:"}}, False)
+        """Update the current values exposed through Mongo AFTER a simulation timestep"""
+        # TODO: At some point consider removing curVal and related fields after sim ends
+        outputs = self.variables.gather_outputs(self.ep.outputs)
+        if self.current_values is not None:
+            self.current_values.publish(outputs, self.get_energyplus_datetime(), self.ep.kStep)
+        else:
+            self.output_publisher.publish(outputs)
 
     def update_sim_time_in_mongo(self):
         """Placeholder for updating the datetime in Mongo to current simulation time"""
@@ -423,43 +485,13 @@ class OSMModelAdvancer(ModelAdvancer):
 
     def write_outputs_to_influx(self):
         """
-        Write output data to influx
+        Queue the output data to be written to influx by the historian writer
         :return:
         """
-        json_body = []
-        base = {
-            "measurement": self.site_id,
-            "time": f"{self.get_energyplus_datetime()}",
-        }
-        response = False
-        for output_id in self.variables.get_output_ids():
-            output_index = self.variables.get_output_index(output_id)
-            if output_index == -1:
-                self.model_logger.logger.error('bad output index for: %s' % output_id)
-            else:
-                output_value = self.ep.outputs[output_index]
-                dis = self.variables.get_haystack_dis_given_id(output_id)
-                base["fields"] = {
-                    "value": output_value
-                }
-                base["tags"] = {
-                    "id": output_id,
-                    "dis": dis,
-                    "siteRef": self.site_id,
-                    "point": True,
-                    "source": 'alfalfa'
-                }
-                json_body.append(base.copy())
-        try:
-            response = self.ac.influx_client.write_points(points=json_body,
-                                                          time_precision='s',
-                                                          database=self.ac.influx_db_name)
-
-        except ConnectionError as e:
-            self.model_logger.logger.error(f"Influx ConnectionError on curVal write: {e}")
-        if not response:
-            self.model_logger.logger.warning(f"Unsuccessful write to influx.  Response: {response}")
-            self.model_logger.logger.info(f"Attempted to write: {json_body}")
-        else:
-            self.model_logger.logger.info(
-                f"Successful write to influx.  Length of JSON: {len(json_body)}")
+        outputs = self.variables.gather_outputs(self.ep.outputs)
+        points = [({"id": output_id, "dis": dis}, {"value": outputs[output_id]})
+                  for output_id, _, dis in self.variables.output_table]
+        tags = {"siteRef": self.site_id, "point": True, "source": 'alfalfa'}
+        if not self.historian_writer.write(self.site_id, self.get_energyplus_datetime(), points, tags):
+            self.model_logger.logger.warning(
+                f"Historian queue full, dropped {len(points)} points ({self.historian_writer.dropped} in total)")
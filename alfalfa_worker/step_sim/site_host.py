@@ -0,0 +1,47 @@
+"""
+Run the step_sim jobs of many sites in a single process.  Started by the worker as
+
+    python3 step_sim/site_host.py osm
+    python step_sim/site_host.py fmu
+
+FMU sites need Python 2 and import the worker's modules as step_fmu does, OSM sites import them from
+the alfalfa_worker package.
+"""
+from __future__ import print_function
+
+import sys
+
+
+def osm_host():
+    from alfalfa_worker.lib.alfalfa_connections import AlfalfaConnections
+    from alfalfa_worker.lib.site_host import SiteHost
+    from alfalfa_worker.step_sim.model_logger import ModelLogger
+    from alfalfa_worker.step_sim.osm_model_advancer import OSMModelAdvancer
+    from alfalfa_worker.step_sim.step_sim_utils import step_sim_arg_parser
+
+    def factory(argv, connections):
+        return OSMModelAdvancer(step_sim_arg_parser(argv), connections)
+
+    return SiteHost(AlfalfaConnections('site_host'), 'osm', factory, logger=ModelLogger().logger)
+
+
+def fmu_host():
+    import logging
+    from lib.alfalfa_connections import AlfalfaConnections
+    from lib.site_host import SiteHost
+    from step_fmu import create_site
+    from step_sim_utils import step_sim_arg_parser
+
+    def factory(argv, connections):
+        return create_site(step_sim_arg_parser(argv), connections)
+
+    logging.basicConfig(level=logging.INFO)
+    return SiteHost(AlfalfaConnections('site_host'), 'fmu', factory)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in ('osm', 'fmu'):
+        print("usage: site_host.py osm|fmu")
+        sys.exit(2)
+    host = osm_host() if sys.argv[1] == 'osm' else fmu_host()
+    host.run()
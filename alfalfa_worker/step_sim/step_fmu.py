@@ -24,9 +24,9 @@
 ########################################################################################################################
 
 import json
+import math
 import os
 import shutil
-import tarfile
 import time
 import uuid
 import zipfile
@@ -37,14 +37,32 @@ import lib.testcase
 import pytz
 
 from lib.alfalfa_connections import AlfalfaConnections
+from lib.archiver import archive_results
+from lib.artifact_cache import ArtifactCache
+from lib.current_values import CurrentValueStore, current_values_enabled
+from lib.historian_writer import HistorianWriter
+from lib.output_publisher import OutputPublisher
+from lib.site_control import (
+    MESSAGE_TIMEOUT,
+    PAUSE_MESSAGE,
+    RESUME_MESSAGE,
+    STOP_MESSAGE,
+    StepCompletion,
+    StopReconciler,
+    parse_advance_steps,
+    parse_control_message,
+    wait_for_message
+)
+from lib.step_scheduler import StepScheduler
+from lib.write_array_cache import WriteArrayCache
 from step_sim_utils import step_sim_arg_parser
 
 
 class RunFMUSite:
 
     def __init__(self, **kwargs):
-        # Setup connections
-        self.ac = AlfalfaConnections()
+        # Setup connections, sites run by a site host share the connections of the host
+        self.ac = kwargs.get('connections') or AlfalfaConnections()
 
         # get arguments from calling program
         # which is the processMessage program
@@ -59,26 +77,37 @@ class RunFMUSite:
         self.current_datetime = datetime(1970, 1, 1, 0, 0, 0)
 
         self.site = self.ac.mongo_db_recs.find_one({"_id": self.site_id})
+        # Signals the end of each advance to the web server
+        self.completion = StepCompletion(self.ac.redis, self.site_id)
+        # Stops are requested on the site channel, Mongo is only checked in case the message was missed
+        self.stop_reconciler = StopReconciler(self.ac.mongo_db_recs, self.site_id)
+
+        # Batches the curVal updates of each step into a single bulk write
+        self.output_publisher = OutputPublisher(self.ac.mongo_db_recs)
+        # With ALFALFA_CURRENT_VALUES=redis the current values are kept in Redis and written behind to Mongo
+        self.current_values = None
+        if current_values_enabled():
+            self.current_values = CurrentValueStore(self.ac.redis, self.site_id, self.output_publisher)
+            self.current_values.start()
+
+        # Current values of the write arrays, kept up to date by the write notifications on the site channel
+        self.write_array_cache = WriteArrayCache(self.ac.mongo_db_write_arrays, self.site_id)
 
         # build the path for zipped-file, fmu, json
         sim_path = '/simulate'
         self.directory = os.path.join(sim_path, self.site_id)
         tar_name = "%s.tar.gz" % self.site_id
         key = "parsed/%s" % tar_name
-        tarpath = os.path.join(self.directory, tar_name)
         fmupath = os.path.join(self.directory, 'model.fmu')
         tagpath = os.path.join(self.directory, 'tags.json')
 
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
 
-        # download the tar file and tag file
-        # self.s3_bucket = self.s3.Bucket('alfalfa')
-        self.ac.s3_bucket.download_file(key, tarpath)
-
-        tar = tarfile.open(tarpath)
-        tar.extractall(sim_path)
-        tar.close()
+        # Extract the tar file, which includes the tag file, from the node's artifact cache
+        # or download it.  The FMU is not modified in place so the files are linked from the cache.
+        self.artifact_cache = ArtifactCache(self.ac.s3_bucket)
+        self.artifact_cache.fetch(key, sim_path, link=True)
 
         zzip = zipfile.ZipFile(fmupath)
         zzip.extract('resources/kpis.json', self.directory)
@@ -87,29 +116,37 @@ class RunFMUSite:
         # step_size in seconds
         self.step_size = 300
 
+        (self.tagid_and_outputs, self.id_and_dis, self.default_input) = self.create_tag_dictionaries(tagpath)
+
         # Load fmu
         config = {
             'fmupath': fmupath,
             'start_time': self.startTime,
             'step': self.step_size,
-            'kpipath': self.directory + '/resources/kpis.json'
+            'kpipath': self.directory + '/resources/kpis.json',
+            # Only the tagged points need to be recorded in the results
+            'result_variables': list(self.id_and_dis.values()) + list(self.default_input.keys())
         }
 
-        (self.tagid_and_outputs, self.id_and_dis, self.default_input) = self.create_tag_dictionaries(tagpath)
-
         # initiate the testcase -- NL make sure to flatten the config options to pass to kwargs correctly
         self.tc = lib.testcase.TestCase(**config)
 
         # run the FMU simulation
         self.kstep = 0
         self.stop = False
+        self.paused = False
         self.simtime = 0
 
-        if self.externalClock:
-            self.ac.redis_pubsub.subscribe(self.site_id)
+        # Subscribe before loading the write arrays so that no write notification is missed
+        self.ac.redis_pubsub.subscribe(self.site_id)
+        self.write_array_cache.load()
 
+        # Writes the historian points in the background so that InfluxDB never slows the simulation
+        self.historian_writer = None
         if self.ac.historian_enabled:
             print("Historian enabled")
+            self.historian_writer = HistorianWriter(self.ac.influx_client, self.ac.influx_db_name)
+            self.historian_writer.start()
 
     def create_tag_dictionaries(self, tag_filepath):
         '''
@@ -147,43 +184,94 @@ class RunFMUSite:
 
     def run(self):
         self.init_sim_status()
+        print(self.ac.startup_report())
 
         if self.externalClock:
             while True:
-                message = self.ac.redis_pubsub.get_message()
+                # Sleep until a message arrives on the site channel
+                message = wait_for_message(self.ac.redis_pubsub,
+                                           min(MESSAGE_TIMEOUT, self.stop_reconciler.time_until_due()))
+                self.reconcile_stop()
                 if message:
                     data = message['data']
-                    if data == 'advance':
-                        self.step()
-                        self.ac.redis.publish(self.site_id, 'complete')
-                        self.set_idle_state()
-                    elif data == 'stop':
-                        self.set_idle_state()
-                        break
+                    advance_steps = parse_advance_steps(data)
+                    if advance_steps:
+                        # A paused simulation replies to an advance without stepping
+                        if self.paused:
+                            advance_steps = 0
+                        else:
+                            self.advance(advance_steps)
+                        self.completion.complete(self.simtime, advance_steps)
+                    elif not self.handle_control_message(data):
+                        self.write_array_cache.handle_message(data)
+                if self.stop:
+                    self.set_idle_state()
+                    break
         else:
+            scheduler = StepScheduler(self.step_size, self.time_scale)
+            scheduler.start()
             while self.simtime < self.endTime:
-                if self.db_stop_set():
+                # Apply the site messages as they arrive until the next step is due
+                timeout = MESSAGE_TIMEOUT if self.paused else scheduler.time_until_due()
+                self.process_site_messages(min(timeout, self.stop_reconciler.time_until_due()))
+                self.reconcile_stop()
+                if self.stop:
                     break
-                self.step()
-                # TODO: Make this respect time scale provided by user
-                time.sleep(5)
+                if self.paused:
+                    scheduler.pause()
+                    continue
+                scheduler.resume()
+                # Do not step past the end time when catching up
+                steps = min(scheduler.due_steps(), int(math.ceil((self.endTime - self.simtime) / self.step_size)))
+                if steps:
+                    scheduler.steps_taken(self.advance(steps))
+                    self.ac.redis.hset(self.site_id, 'lag', round(scheduler.lag(), 3))
 
         self.cleanup()
 
-    # Check the database for a stop signal
-    # and return true if stop is requested
-    def db_stop_set(self):
-        # A client may have requested that the simulation stop early,
-        # look for a signal to stop from the database
-        self.site = self.ac.mongo_db_recs.find_one({"_id": self.site_id})
-        if self.site and (self.site.get("rec", {}).get("simStatus") == "s:Stopping"):
-            self.stop = True
-        return self.stop
+    def process_site_messages(self, timeout=0):
+        """
+        Apply the messages from the site channel, blocking until timeout seconds have passed or a control
+        message arrives.  With no timeout only the pending messages are applied.
+        """
+        deadline = time.time() + timeout
+        while True:
+            message = wait_for_message(self.ac.redis_pubsub, deadline - time.time())
+            if message:
+                if self.handle_control_message(message['data']):
+                    break
+                self.write_array_cache.handle_message(message['data'])
+            elif time.time() >= deadline:
+                break
 
-    def reset(self, tarinfo):
-        tarinfo.uid = tarinfo.gid = 0
-        tarinfo.uname = tarinfo.gname = "root"
-        return tarinfo
+    def handle_control_message(self, data):
+        """
+        Apply a stop, pause or resume message from the site channel
+
+        :param data: data of the pubsub message
+        :return: True if the message was a control message
+        """
+        command = parse_control_message(data)
+        if command == STOP_MESSAGE:
+            self.stop = True
+        elif command == PAUSE_MESSAGE:
+            self.set_paused(True)
+        elif command == RESUME_MESSAGE:
+            self.set_paused(False)
+        return command is not None
+
+    def set_paused(self, paused):
+        # Expose the paused state as the simStatus of the site
+        if paused != self.paused:
+            self.paused = paused
+            self.ac.mongo_db_recs.update_one({"_id": self.site_id},
+                                             {"$set": {"rec.simStatus": "s:Paused" if paused else "s:Running"}})
+
+    # A stop is requested by the stop message on the site channel, the database
+    # is only read at a low frequency in case the message was missed
+    def reconcile_stop(self):
+        if self.stop_reconciler.stop_requested():
+            self.stop = True
 
     # cleanup after the simulation is stopped
     def cleanup(self):
@@ -191,6 +279,8 @@ class RunFMUSite:
         self.ac.mongo_db_recs.update_one({"_id": self.site_id},
                                          {"$set": {"rec.simStatus": "s:Stopped"}, "$unset": {"rec.datetime": ""}},
                                          False)
+        if self.current_values is not None:
+            self.current_values.close()
         self.ac.mongo_db_recs.update_many({"site_ref": self.site_id, "rec.cur": "m:"},
                                           {"$unset": {"rec.curVal": "", "rec.curErr": ""},
                                            "$set": {"rec.curStatus": "s:disabled"}}, False)
@@ -200,28 +290,28 @@ class RunFMUSite:
 
         self.sim_id = str(uuid.uuid4())
         tarname = "%s.tar.gz" % self.sim_id
-        tar = tarfile.open(tarname, "w:gz")
-        tar.add(self.directory, filter=self.reset, arcname=self.sim_id)
-        tar.close()
-
         uploadkey = "simulated/%s" % tarname
-        self.ac.s3_bucket.upload_file(tarname, uploadkey)
-        os.remove(tarname)
+        archive = archive_results(self.directory, self.sim_id, self.ac.s3_bucket, uploadkey)
 
         time = str(datetime.now(tz=pytz.UTC))
         name = self.site.get("rec", {}).get("dis", "Test Case").replace('s:', '')
         kpis = json.dumps(self.tc.get_kpis())
         self.ac.mongo_db_sims.insert_one(
             {"_id": self.sim_id, "name": name, "siteRef": self.site_id, "simStatus": "Complete", "timeCompleted": time,
-             "s3Key": uploadkey, "results": str(kpis)})
+             "s3Key": uploadkey, "results": str(kpis), "archive": archive})
+        # The results may have been spilled to a file which would otherwise stay on the worker
+        self.tc.close()
 
         shutil.rmtree(self.directory)
 
+        if self.historian_writer is not None:
+            self.historian_writer.close()
+
     def set_idle_state(self):
         self.ac.redis.hset(self.site_id, 'control', 'idle')
 
     def init_sim_status(self):
-        self.set_idle_state()
+        self.completion.reset()
         output_time_string = 's:%s' % (self.simtime)
         self.ac.mongo_db_recs.update_one({"_id": self.site_id},
                                          {"$set": {"rec.datetime": output_time_string, "rec.simStatus": "s:Running"}})
@@ -232,36 +322,48 @@ class RunFMUSite:
         self.ac.mongo_db_recs.update_one({"_id": self.site_id},
                                          {"$set": {"rec.datetime": output_time_string, "rec.simStatus": "s:Running"}})
 
-    def step(self):
+    def advance(self, steps):
+        """
+        Advance the simulation steps timesteps back to back, the database is only
+        updated with the outputs of the last step.
+
+        :param steps: number of timesteps to advance
+        :return: number of timesteps advanced
+        """
+        for i in range(steps):
+            self.step(publish=(i == steps - 1))
+        return steps
+
+    def step(self, publish=True):
         # u represents simulation input values
         u = self.default_input.copy()
-        # look in the database for current write arrays
         # for each write array there is an array of controller
         # input values, the first element in the array with a value
         # is what should be applied to the simulation according to Project Haystack
-        # convention
-        for array in self.ac.mongo_db_write_arrays.find({"siteRef": self.site_id}):
-            _id = array.get('_id')
-            for val in array.get('val'):
-                if val is not None:
-                    dis = self.id_and_dis.get(_id)
-                    if dis:
-                        u[dis] = val
-                        u[dis.replace('_u', '_activate')] = 1
-                        break
+        # convention. The cache holds that winning value for each written point.
+        for _id, val in self.write_array_cache.current_values().items():
+            dis = self.id_and_dis.get(_id)
+            if dis:
+                u[dis] = val
+                u[dis.replace('_u', '_activate')] = 1
 
         y_output = self.tc.advance(u)
-        self.update_sim_status()
+        self.simtime = self.tc.final_time
         self.increment_datetime()
 
         # get each of the simulation output values and feed to the database
-        for key in y_output.keys():
-            if key != 'time':
-                output_id = self.tagid_and_outputs[key]
-                value_y = y_output[key]
-                self.ac.mongo_db_recs.update_one({"_id": output_id}, {
-                    "$set": {"rec.curVal": "n:%s" % value_y, "rec.curStatus": "s:ok", "rec.cur": "m:"}})
-
+        if publish:
+            self.update_sim_status()
+            outputs = {}
+            for key in y_output.keys():
+                if key != 'time':
+                    outputs[self.tagid_and_outputs[key]] = y_output[key]
+            if self.current_values is not None:
+                self.current_values.publish(outputs, self.simtime)
+            else:
+                self.output_publisher.publish(outputs)
+
+        # The historian keeps every step, including the intermediate steps of a multi-step advance
         if self.ac.historian_enabled:
             self.write_outputs_to_influx(y_output)
 
@@ -274,59 +376,44 @@ class RunFMUSite:
 
     def write_outputs_to_influx(self, outputs):
         """
-        Write output data to influx
+        Queue the output data to be written to influx by the historian writer
         :return:
         """
-        json_body = []
-        base = {
-            "measurement": self.site_id,
-            "time": "%s" % self.current_datetime,
-        }
-        response = False
-        # get each of the simulation output values and feed to the database
-        for key in outputs.keys():
+        points = []
+        for key, value in outputs.items():
             if key != 'time':
                 output_id = self.tagid_and_outputs[key]
-                value = outputs[key]
-                dis = self.id_and_dis[output_id]
-                base["fields"] = {
-                    "value": value
-                }
-                base["tags"] = {
-                    "id": output_id,
-                    "dis": dis,
-                    "siteRef": self.site_id,
-                    "point": True,
-                    "source": 'alfalfa'
-                }
-                json_body.append(base.copy())
-        try:
-            print("Trying to write to influx")
-            response = self.ac.influx_client.write_points(points=json_body,
-                                                          time_precision='s',
-                                                          database=self.ac.influx_db_name)
-            if response:
-                print("Influx response received %s" % response)
-        except ConnectionError as e:
-            print("Unable to write to influx: %s" % e)
+                points.append(({"id": output_id, "dis": self.id_and_dis[output_id]}, {"value": value}))
+        tags = {"siteRef": self.site_id, "point": True, "source": 'alfalfa'}
+        self.historian_writer.write(self.site_id, self.current_datetime, points, tags)
+
+
+def create_site(args, connections=None):
+    """
+    Create the RunFMUSite of parsed step_sim arguments
+
+    :param args: arguments parsed by step_sim_arg_parser
+    :param connections: AlfalfaConnections to use, new connections are made when not given
+    :return: RunFMUSite
+    """
+    externalClock = (args.step_sim_type == 'external_clock')
+    real_time_flag = False
+    if args.step_sim_type == 'timescale':
+        time_scale = args.step_sim_value
+    elif args.step_sim_type == 'realtime':
+        real_time_flag = True
+        time_scale = 1
+    else:
+        time_scale = 5
+    startTime = float(args.start_datetime)
+    endTime = float(args.end_datetime)
+
+    return RunFMUSite(site_id=args.site_id, real_time_flag=real_time_flag, time_scale=time_scale, startTime=startTime,
+                      endTime=endTime, externalClock=externalClock, connections=connections)
 
 
 # Main Program Entry
 
-args = step_sim_arg_parser()
-site_id = args.site_id
-externalClock = (args.step_sim_type == 'external_clock')
-real_time_flag = False
-if args.step_sim_type == 'timescale':
-    time_scale = args.step_sim_value
-elif args.step_sim_type == 'realtime':
-    real_time_flag = True
-    time_scale = 1
-else:
-    time_scale = 5
-startTime = float(args.start_datetime)
-endTime = float(args.end_datetime)
-
-runFMUSite = RunFMUSite(site_id=site_id, real_time_flag=real_time_flag, time_scale=time_scale, startTime=startTime,
-                        endTime=endTime, externalClock=externalClock)
-runFMUSite.run()
+if __name__ == '__main__':
+    runFMUSite = create_site(step_sim_arg_parser())
+    runFMUSite.run()
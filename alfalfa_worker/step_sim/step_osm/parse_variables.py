@@ -26,6 +26,8 @@
 import xml.etree.ElementTree as ET
 import json
 
+import numpy as np
+
 
 # <variable source='EnergyPlus'>
 #   <EnergyPlus name='CAV_bas' type='Air System Outdoor Air Flow Fraction'/>
@@ -133,6 +135,53 @@ class ParseVariables:
             if 'id' in entity and 'dis' in entity:
                 self.haystack_id_dis_map[entity['id'].replace('r:', '')] = entity['dis'].replace('s:', '')
 
+        self.build_indexes()
+
+    def build_indexes(self):
+        """
+        Build the lookup tables used while stepping the simulation, so that no list has to be scanned per step.
+
+        Sets:
+            - output_index_map: {(E+ variable name, E+ key value): index in XML}
+            - input_index_map: {E+ !- Name: index in XML}
+            - output_table: ordered list of (haystack_id, output_index, dis) for all outputs with a valid index
+            - output_table_ids: the haystack ids of output_table, in order
+            - output_index_array: numpy array of the output indexes of output_table, in order
+            - invalid_output_ids: haystack ids of outputs which do not have an index in the XML
+
+        :return:
+        """
+        # The first match wins, as it did with a linear scan
+        self.output_index_map = dict()
+        for output_item in self.outputs_list:
+            self.output_index_map.setdefault((output_item['type'], output_item['name']), output_item['index'])
+
+        self.input_index_map = dict()
+        for input_item in self.inputs_list:
+            self.input_index_map.setdefault(input_item['variable'], input_item['index'])
+
+        self.output_table = list()
+        self.invalid_output_ids = list()
+        for output_id in self.json_outputs:
+            output_index = self.get_output_index(output_id)
+            if output_index == -1:
+                self.invalid_output_ids.append(output_id)
+            else:
+                self.output_table.append((output_id, output_index, self.get_haystack_dis_given_id(output_id)))
+
+        self.output_table_ids = [output_id for output_id, _, _ in self.output_table]
+        self.output_index_array = np.array([output_index for _, output_index, _ in self.output_table], dtype=int)
+
+    def gather_outputs(self, outputs):
+        """
+        Gather the values of all haystack outputs from the E+ outputs in a single vectorized take.
+
+        :param outputs: sequence of output values, as decoded from E+, ordered by XML index
+        :return: dict of {haystack_id: value}
+        """
+        values = np.take(np.asarray(outputs, dtype=float), self.output_index_array)
+        return dict(zip(self.output_table_ids, values.tolist()))
+
     def get_haystack_dis_given_id(self, entity_id: str):
         return self.haystack_id_dis_map.get(entity_id.replace('r:', ''))
 
@@ -189,15 +238,7 @@ class ParseVariables:
         :param name:
         :return:
         """
-        for output_item in self.outputs_list:
-            if (output_item['name'] == name) and (output_item['type'] == variable_type):
-                return output_item['index']
-
-        return -1
+        return self.output_index_map.get((variable_type, name), -1)
 
     def input_index_from_variable_name(self, variable):
-        for input_item in self.inputs_list:
-            if input_item['variable'] == variable:
-                return input_item['index']
-
-        return -1
+        return self.input_index_map.get(variable, -1)
@@ -11,8 +11,12 @@ def valid_date(s):
         raise argparse.ArgumentTypeError(msg)
 
 
-def step_sim_arg_parser():
-    """Argument parser for both OSM and FMU step simulations"""
+def step_sim_arg_parser(argv=None):
+    """
+    Argument parser for both OSM and FMU step simulations
+
+    :param argv: list of arguments to parse, defaults to the command line arguments
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument('site_id', help="The _id attribute of the record stored in MongoDB")
     parser.add_argument('step_sim_type', help="The type of step simulation to perform.",
@@ -25,7 +29,7 @@ def step_sim_arg_parser():
                    'model advances 1 minute for every 1 minute in realtime, '
                    'while 5 means the model advances once every 12 seconds in realtime')
     parser.add_argument('--step_sim_value', type=int, choices=range(0, 20), help=help_string)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     if args.step_sim_type == 'timescale' and not args.step_sim_value:
         parser.error('--step_sim_value must be specified if step_sim_type is timescale')
     else:
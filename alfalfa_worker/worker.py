@@ -29,20 +29,34 @@ from __future__ import print_function
 import traceback
 import json
 import os
-import subprocess
+import signal
 import sys
+import time
 from datetime import datetime
 
 from alfalfa_worker.lib.alfalfa_connections import AlfalfaConnections
+from alfalfa_worker.lib.job_pool import JobPool
+from alfalfa_worker.lib.mongo_indexes import ensure_indexes
+from alfalfa_worker.lib.site_host import SITE_HOST_QUEUE
 from alfalfa_worker.worker_logger import WorkerLogger
 
 
+class WorkerShutdown(BaseException):
+    """Raised in Worker.run when the worker is asked to exit with SIGTERM"""
+
+
 class Worker:
     """The Alfalfa alfalfa_worker class.  Used for processing messages from the boto3 SQS Queue resource"""
 
     def __init__(self):
-        self.ac = AlfalfaConnections()
+        self.ac = AlfalfaConnections('worker')
         self.worker_logger = WorkerLogger()
+        self.job_pool = JobPool()
+        # Seconds to wait before checking jobs again when all job slots are in use
+        self.job_poll_interval = 1
+        # Model types whose sites are run by a site host process instead of a process per site,
+        # comma separated from 'osm' and 'fmu'
+        self.hosted_model_types = [t.strip() for t in os.environ.get('ALFALFA_SITE_HOST', '').split(',') if t.strip()]
         os.chdir('alfalfa_worker')
         self.alfalfa_worker_dir = os.getcwd()
 
@@ -182,7 +196,7 @@ class Worker:
         """
         Simple wrapper to check and log subprocess calls
 
-        :param rc: return code as returned by subprocess.call() method
+        :param rc: return code of the finished subprocess
         :param file_name:
         :return:
         """
@@ -192,6 +206,64 @@ class Worker:
             self.worker_logger.logger.info("{} unsuccessful for: {}".format(message_type, file_name))
             self.worker_logger.logger.info("{} return code: {}".format(message_type, rc))
 
+    def launch_job(self, key, call, message_type, name):
+        """
+        Start a job subprocess in the job pool without waiting for it to complete.
+        Finished jobs are checked with check_subprocess_call when they are reaped in run.
+
+        :param key: unique key of the job, site_id for step_sim or upload_id for add_site and run_sim
+        :param call: list of program arguments for the subprocess
+        :param str message_type: One of 'add_site', 'step_sim', 'run_sim'
+        :param name: name to use when logging about the job
+        :return: Job or None if the job could not be launched
+        """
+        if self.job_pool.is_running(key):
+            self.worker_logger.logger.info("{} already running for: {}".format(message_type, key))
+            return None
+        job = self.job_pool.launch(key, call, message_type, name)
+        if job.start_latency is None:
+            self.worker_logger.logger.info(
+                "{} started for: {} with pid: {}".format(message_type, name, job.process.pid))
+        else:
+            self.worker_logger.logger.info("{} forked for: {} with pid: {}, started in {:.3f}s".format(
+                message_type, name, job.process.pid, job.start_latency))
+        return job
+
+    def reap_jobs(self):
+        """
+        Check and log all of the jobs that have finished since the last call
+
+        :return: list of finished Job
+        """
+        finished = self.job_pool.reap()
+        for job in finished:
+            self.check_subprocess_call(job.returncode, job.name, job.message_type)
+        return finished
+
+    def ensure_site_host(self, model_type):
+        """
+        Launch the site host of a model type if it is not running.  A site host runs the sites queued for it
+        in a single process and exits once it is idle.
+
+        :param str model_type: 'osm' or 'fmu'
+        :return: Job or None if the site host is already running or there is no free job slot
+        """
+        key = 'site_host:{}'.format(model_type)
+        if self.job_pool.is_running(key):
+            return None
+        if self.job_pool.free_slots() == 0:
+            self.worker_logger.logger.info("No free job slot for the {} site host".format(model_type))
+            return None
+        # fmu needs to run with Python 2
+        python = 'python' if model_type == 'fmu' else 'python3'
+        return self.launch_job(key, [python, 'step_sim/site_host.py', model_type], 'site_host', key)
+
+    def ensure_site_hosts(self):
+        """Launch the site hosts which have queued sites but are not running, e.g. after they exited when idle"""
+        for model_type in self.hosted_model_types:
+            if self.ac.redis.llen(SITE_HOST_QUEUE.format(model_type)):
+                self.ensure_site_host(model_type)
+
     def add_site_type(self, p, file_name, upload_id):
         """
         Simple wrapper for the add_site subprocess call given the path for python file to call
@@ -204,12 +276,12 @@ class Worker:
         if not os.path.isfile(p):
             self.worker_logger.logger.info("No file: {}".format(p))
         else:
-            return_code = subprocess.call(['python3', p, file_name, upload_id])
-            self.check_subprocess_call(return_code, file_name, 'add_site')
+            self.launch_job(upload_id, ['python3', p, file_name, upload_id], 'add_site', file_name)
 
     def step_sim_type(self, site_id, step_sim_type, step_sim_value, start_datetime, end_datetime, model_type):
         """
-        Simple wrapper for the step_sim subprocess call given required params
+        Simple wrapper for the step_sim subprocess call given required params.
+        The subprocess runs in the job pool, this method does not wait for the simulation to complete.
 
         :param p:
         :param site_id:
@@ -218,7 +290,7 @@ class Worker:
         :param start_datetime:
         :param end_datetime:
         :param model_type: string, type of model. Choices are 'osm' or 'fmu'
-        :return:
+        :return: Job or None if the job could not be launched
         """
         self.worker_logger.logger.info("Calling model '{}' step_sim_type '{}'".format(model_type, step_sim_type))
         arg_step_sim_value = None
@@ -256,15 +328,17 @@ class Worker:
             if arg_step_sim_value:
                 call.append('--step_sim_value={}'.format(step_sim_value))
 
+            if model_type in self.hosted_model_types:
+                self.worker_logger.logger.info("Queueing step_sim_type on the {} site host: {}".format(model_type, call))
+                self.ac.redis.rpush(SITE_HOST_QUEUE.format(model_type), json.dumps(call[2:]))
+                return self.ensure_site_host(model_type)
             self.worker_logger.logger.info("Calling step_sim_type subprocess: {}".format(call))
-            return_code = subprocess.call(call)
-
-            self.check_subprocess_call(return_code, site_id, 'step_sim')
+            job = self.launch_job(site_id, call, 'step_sim', site_id)
         else:
             self.worker_logger.logger.info("No file: {}".format(p))
             sys.exit(1)
 
-        return return_code
+        return job
 
     def run_sim_type(self, p, file_name, upload_id):
         """
@@ -278,8 +352,7 @@ class Worker:
         if not os.path.isfile(p):
             self.worker_logger.logger.info("No file: {}".format(p))
         else:
-            return_code = subprocess.call(['python3', p, file_name, upload_id])
-            self.check_subprocess_call(return_code, file_name, 'run_sim')
+            self.launch_job(upload_id, ['python3', p, file_name, upload_id], 'run_sim', file_name)
 
     def add_site(self, message_body):
         """
@@ -376,6 +449,27 @@ class Worker:
             else:
                 self.worker_logger.logger.info('Unsupported file type was uploaded')
 
+    def site_still_running(self, message_body):
+        """
+        Return True if the message starts a site whose previous job is still running on this worker
+
+        :param message_body: Body of a single message from a boto3 Queue resource
+        :type message_body: dict
+        """
+        if message_body.get('op') != 'InvokeAction' or message_body.get('action') != 'runSite':
+            return False
+        return self.job_pool.is_running(message_body.get('id'))
+
+    def handle_sigterm(self, signum, frame):
+        raise WorkerShutdown()
+
+    def shutdown(self):
+        """Terminate the running jobs, so that none are left running without the worker"""
+        jobs = self.job_pool.shutdown()
+        for job in jobs:
+            self.worker_logger.logger.info(
+                "{} terminated for: {} with return code: {}".format(job.message_type, job.name, job.returncode))
+
     def process_message(self, message):
         """
         Process a single message from Queue.  Depending on operation requested, will call one of:
@@ -388,8 +482,14 @@ class Worker:
         """
         try:
             message_body = json.loads(message.body)
-            message.delete()
             op = message_body.get('op')
+            if self.site_still_running(message_body):
+                # Leave the message on the queue, it is received again once its visibility timeout
+                # expires, by when the previous run of the site has exited
+                self.worker_logger.logger.info(
+                    "step_sim already running for: {}, leaving the message on the queue".format(message_body.get('id')))
+                return
+            message.delete()
             if op == 'InvokeAction':
                 action = message_body.get('action')
                 # TODO change to step_sim
@@ -410,21 +510,49 @@ class Worker:
 
     def run(self):
         """
-        Listen to queue and process messages upon arrival
+        Listen to queue and process messages upon arrival.  Jobs run concurrently in the job pool,
+        only as many messages as there are free job slots are received from the queue.
+        The running jobs are terminated when the worker exits, on SIGTERM or an interrupt.
 
         :return:
         """
-        self.worker_logger.logger.info("Enter alfalfa_worker run")
+        self.worker_logger.logger.info(
+            "Enter alfalfa_worker run with {} job slots".format(self.job_pool.slots))
+        # Create the queue before the first job so that the time taken to connect is logged
+        self.ac.sqs_queue
+        self.worker_logger.logger.info(self.ac.startup_report())
+        try:
+            indexes = ensure_indexes(self.ac.mongo_db)
+            self.worker_logger.logger.info("Ensured Mongo indexes: {}".format(', '.join(indexes)))
+        except Exception as e:
+            self.worker_logger.logger.error("Unable to ensure the Mongo indexes: {}".format(e))
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        try:
+            self.process_queue()
+        finally:
+            self.shutdown()
+
+    def process_queue(self):
+        """Receive and process the messages of the queue until the worker is asked to exit"""
         while True:
-            # WaitTimeSeconds triggers long polling that will wait for events to enter queue
-            # Receive Message
             try:
-                messages = self.ac.sqs_queue.receive_messages(MaxNumberOfMessages=1, WaitTimeSeconds=20)
-                if len(messages) > 0:
-                    message = messages[0]
+                self.reap_jobs()
+                self.ensure_site_hosts()
+                free_slots = self.job_pool.free_slots()
+                if free_slots == 0:
+                    time.sleep(self.job_poll_interval)
+                    continue
+
+                # WaitTimeSeconds triggers long polling that will wait for events to enter queue
+                # SQS allows at most 10 messages per receive
+                messages = self.ac.sqs_queue.receive_messages(MaxNumberOfMessages=min(free_slots, 10),
+                                                              WaitTimeSeconds=20)
+                for message in messages:
                     self.worker_logger.logger.info('Message Received with payload: %s' % message.body)
                     # Process Message
                     self.process_message(message)
+            except (WorkerShutdown, KeyboardInterrupt):
+                raise
             except BaseException as e:
                 tb = traceback.format_exc()
                 self.worker_logger.logger.info("Exception caught in alfalfa_worker.run: {} with {}".format(e, tb))
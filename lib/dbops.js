@@ -44,7 +44,15 @@ function getPoint(siteRef, name, db) {
   return mrecs.findOne({site_ref: siteRef, "rec.dis": `s:${name}`});
 }
 
-function writePoint(id, siteRef, level, val, who, dur, db) {
+// Notify the simulation of the site that a point has been written,
+// so that it only needs to re-read the write array of that point
+function notifyPointWrite(id, siteRef, pub) {
+  if (pub) {
+    pub.publish(siteRef, `write:${id}`);
+  }
+}
+
+function writePoint(id, siteRef, level, val, who, dur, db, pub) {
   return new Promise( (resolve,reject) => {
     let writearrays = db.collection('writearrays');
     let mrecs = db.collection('recs');
@@ -72,6 +80,7 @@ function writePoint(id, siteRef, level, val, who, dur, db) {
             )
           }
         }).then( () => {
+          notifyPointWrite(array._id, array.siteRef, pub);
           resolve(array);
         }).catch( (err) => {
           reject(err)
@@ -97,6 +106,7 @@ function writePoint(id, siteRef, level, val, who, dur, db) {
             )
           }
         }).then(() => {
+          notifyPointWrite(array._id, array.siteRef, pub);
           resolve(array);
         }).catch((err) => {
           reject(err);
@@ -0,0 +1,56 @@
+"""
+Compare the per step latency of the persistent and the fmu.simulate based stepping of TestCase
+on the test FMUs.  This needs pyfmi, so run it in the worker container, e.g.
+
+    python tests/integration/fmu_stepping_benchmark.py --steps 288
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'alfalfa_worker'))
+
+import lib.testcase  # noqa: E402
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+
+def benchmark(fmupath, stepping, steps, step_size):
+    tc = lib.testcase.TestCase(fmupath=fmupath, step=step_size, stepping=stepping)
+    latencies = []
+    for _ in range(steps):
+        start = time.time()
+        y = tc.advance({})
+        latencies.append(time.time() - start)
+    return np.array(latencies), y
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=288, help='number of steps to run each FMU')
+    parser.add_argument('--step-size', type=float, default=300, help='step size in seconds')
+    args = parser.parse_args()
+
+    fmus = sorted(f for f in os.listdir(MODELS_DIR) if f.endswith('.fmu'))
+    print('{:<30} {:<12} {:>10} {:>10} {:>10}'.format('fmu', 'stepping', 'mean ms', 'p95 ms', 'total s'))
+    for fmu in fmus:
+        results = {}
+        for stepping in ('simulate', 'persistent'):
+            latencies, y = benchmark(os.path.join(MODELS_DIR, fmu), stepping, args.steps, args.step_size)
+            results[stepping] = y
+            print('{:<30} {:<12} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                fmu, stepping, latencies.mean() * 1000, np.percentile(latencies, 95) * 1000, latencies.sum()))
+        # The final outputs of both engines should agree to within the solver tolerance
+        for key, value in results['simulate'].items():
+            other = results['persistent'][key]
+            if not np.isclose(value, other, rtol=1e-3, atol=1e-6):
+                print('  {} differs: simulate {} persistent {}'.format(key, value, other))
+
+
+if __name__ == '__main__':
+    main()
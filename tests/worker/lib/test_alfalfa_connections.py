@@ -0,0 +1,48 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from alfalfa_worker.lib.alfalfa_connections import AlfalfaConnections
+
+ENV = {
+    'REGION': 'us-east-1',
+    'JOB_QUEUE_URL': 'http://localhost:4100/queue/local-queue1',
+    'S3_URL': 'http://localhost:9000',
+    'S3_BUCKET': 'alfalfa',
+    'REDIS_HOST': 'localhost',
+    'MONGO_URL': 'mongodb://localhost:27017',
+    'MONGO_DB_NAME': 'alfalfa',
+    'AWS_ACCESS_KEY_ID': 'user',
+    'AWS_SECRET_ACCESS_KEY': 'password',
+}
+
+
+@patch.dict(os.environ, ENV)
+class TestAlfalfaConnections(TestCase):
+    def test_clients_created_on_first_use(self):
+        ac = AlfalfaConnections('add_site')
+        self.assertEqual(ac.startup_times, {})
+        recs = ac.mongo_db_recs
+        self.assertIs(ac.mongo_db_recs, recs)
+        self.assertEqual(sorted(ac.startup_times), ['mongo_client', 'mongo_db', 'mongo_db_recs'])
+        self.assertNotIn('s3', ac.startup_times)
+        self.assertNotIn('sqs', ac.startup_times)
+        self.assertIn('mongo_client', ac.startup_report())
+
+    def test_pool_sizes_by_role(self):
+        ac = AlfalfaConnections('site_host')
+        self.assertEqual(ac.mongo_client.options.pool_options.max_pool_size, 50)
+        self.assertEqual(ac.redis.connection_pool.max_connections, 100)
+        with patch.dict(os.environ, {'ALFALFA_REDIS_POOL_SIZE': '3'}):
+            self.assertEqual(AlfalfaConnections('worker').redis.connection_pool.max_connections, 3)
+
+    def test_historian_disabled(self):
+        ac = AlfalfaConnections()
+        self.assertFalse(ac.historian_enabled)
+        self.assertIsNone(ac.influx_client)
+        self.assertIsNone(ac.influx_db_name)
+
+    def test_s3_transfer_config(self):
+        ac = AlfalfaConnections()
+        self.assertEqual(ac.s3_transfer_config.multipart_chunksize, 16 * 1024 * 1024)
+        self.assertEqual(ac.s3_bucket.name, 'alfalfa')
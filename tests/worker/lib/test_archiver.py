@@ -0,0 +1,128 @@
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.archiver import (
+    MultipartUploadWriter,
+    ParallelGzipWriter,
+    archive_directory
+)
+
+
+class FakeBucket(object):
+    """Records the objects put and uploaded with multipart uploads in memory"""
+
+    def __init__(self):
+        self.objects = {}
+        self.files = {}
+        self.part_sizes = []
+
+    def Object(self, key):
+        s3_object = MagicMock()
+        s3_object.put.side_effect = lambda Body: self.objects.__setitem__(key, Body)
+        upload = s3_object.initiate_multipart_upload.return_value
+        parts = {}
+
+        def part(number):
+            def upload_part(Body):
+                parts[number] = Body
+                self.part_sizes.append(len(Body))
+                return {'ETag': 'etag-{}'.format(number)}
+            p = MagicMock()
+            p.upload.side_effect = upload_part
+            return p
+
+        def complete(MultipartUpload):
+            numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+            self.objects[key] = b''.join(parts[n] for n in numbers)
+
+        upload.Part.side_effect = part
+        upload.complete.side_effect = complete
+        return s3_object
+
+    def upload_file(self, path, key):
+        with open(path, 'rb') as f:
+            self.files[key] = f.read()
+
+
+class TestArchiver(TestCase):
+    def test_parallel_gzip(self):
+        data = b''.join(os.urandom(64) * 100 for _ in range(100))
+        out = io.BytesIO()
+        gz = ParallelGzipWriter(out, threads=4, block_size=10000)
+        self.assertTrue(gz.parallel)
+        for i in range(0, len(data), 777):
+            gz.write(data[i:i + 777])
+        gz.close()
+        self.assertEqual(gzip.decompress(out.getvalue()), data)
+        self.assertLess(len(out.getvalue()), len(data) / 10)
+
+    def test_serial_gzip(self):
+        out = io.BytesIO()
+        gz = ParallelGzipWriter(out, threads=1)
+        self.assertFalse(gz.parallel)
+        gz.write(b'results')
+        gz.close()
+        self.assertEqual(gzip.decompress(out.getvalue()), b'results')
+
+    def test_multipart_upload(self):
+        bucket = FakeBucket()
+        writer = MultipartUploadWriter(bucket, 'simulated/a.tar.gz', part_size=100)
+        data = os.urandom(1050)
+        for i in range(0, len(data), 70):
+            writer.write(data[i:i + 70])
+        writer.close()
+        self.assertEqual(bucket.objects['simulated/a.tar.gz'], data)
+        self.assertGreater(len(bucket.part_sizes), 1)
+
+    def test_failed_part_aborts_once(self):
+        bucket = FakeBucket()
+        writer = MultipartUploadWriter(bucket, 'simulated/a.tar.gz', part_size=100)
+        upload = writer.s3_object.initiate_multipart_upload.return_value
+        upload.Part.side_effect = None
+        upload.Part.return_value.upload.side_effect = Exception('connection reset')
+        # S3 answers a second abort of the same upload with NoSuchUpload
+        upload.abort.side_effect = [None, Exception('NoSuchUpload')]
+        with self.assertRaises(IOError) as raised:
+            for _ in range(10):
+                writer.write(os.urandom(100))
+            writer.close()
+        self.assertIn('connection reset', str(raised.exception))
+        self.assertIsNone(writer.thread)
+        writer.abort()
+        upload.abort.assert_called_once_with()
+        upload.complete.assert_not_called()
+
+    def test_small_upload_is_put(self):
+        bucket = FakeBucket()
+        writer = MultipartUploadWriter(bucket, 'simulated/a.tar.gz')
+        writer.write(b'small')
+        writer.close()
+        self.assertEqual(bucket.objects['simulated/a.tar.gz'], b'small')
+        self.assertEqual(bucket.part_sizes, [])
+
+    def test_archive_directory(self):
+        src = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, src)
+        os.makedirs(os.path.join(src, 'run'))
+        for name, content in (('in.idf', b'idf'), ('run/eplusout.sql', b'sql'), ('run/eplusout.eso', b'eso')):
+            with open(os.path.join(src, name), 'wb') as f:
+                f.write(content)
+
+        bucket = FakeBucket()
+        record = archive_directory(src, 'sim', bucket, 'simulated/sim.tar.gz',
+                                   exclude=['*.eso'], separate=['run/*.sql'], threads=2)
+        self.assertEqual(record['format'], 'tar.gz')
+        self.assertEqual(record['excluded'], ['run/eplusout.eso'])
+        self.assertEqual(record['separate'], {'run/eplusout.sql': 'simulated/sim.tar.gz.files/run/eplusout.sql'})
+        self.assertEqual(bucket.files['simulated/sim.tar.gz.files/run/eplusout.sql'], b'sql')
+
+        with tarfile.open(fileobj=io.BytesIO(bucket.objects['simulated/sim.tar.gz']), mode='r:gz') as tar:
+            self.assertEqual(sorted(tar.getnames()), ['sim', 'sim/in.idf', 'sim/run'])
+            self.assertEqual(tar.getmember('sim/in.idf').uname, 'root')
+            self.assertEqual(tar.extractfile('sim/in.idf').read(), b'idf')
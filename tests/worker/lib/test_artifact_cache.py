@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock, PropertyMock
+
+from alfalfa_worker.lib.artifact_cache import ArtifactCache
+
+
+class TestArtifactCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+        # A parsed site tarball, as uploaded by add_site
+        site_dir = os.path.join(self.tmp_dir, 'src', 'site')
+        os.makedirs(os.path.join(site_dir, 'simulation'))
+        with open(os.path.join(site_dir, 'simulation', 'sim.idf'), 'w') as f:
+            f.write('idf')
+        self.tar_path = os.path.join(self.tmp_dir, 'site.tar.gz')
+        with tarfile.open(self.tar_path, 'w:gz') as tar:
+            tar.add(site_dir, arcname='site')
+
+        with open(self.tar_path, 'rb') as f:
+            body = f.read()
+        self.bucket = MagicMock()
+        s3_object = self.bucket.Object.return_value
+        s3_object.e_tag = '"abc123"'
+        s3_object.content_length = len(body)
+        s3_object.get.side_effect = lambda **kwargs: {'Body': io.BytesIO(body)}
+
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.cache = ArtifactCache(self.bucket, cache_dir=self.cache_dir)
+
+    def destination(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def test_miss_then_hit(self):
+        self.assertFalse(self.cache.fetch('parsed/site.tar.gz', self.destination('run1')))
+        self.assertTrue(self.cache.fetch('parsed/site.tar.gz', self.destination('run2')))
+        self.assertEqual(self.bucket.Object.return_value.get.call_count, 1)
+        for run in ('run1', 'run2'):
+            with open(os.path.join(self.destination(run), 'site', 'simulation', 'sim.idf')) as f:
+                self.assertEqual(f.read(), 'idf')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_copy_is_independent_of_cache(self):
+        self.cache.fetch('parsed/site.tar.gz', self.destination('run'))
+        idf = os.path.join(self.destination('run'), 'site', 'simulation', 'sim.idf')
+        with open(idf, 'w') as f:
+            f.write('modified')
+        with open(os.path.join(self.cache_dir, 'abc123', 'site', 'simulation', 'sim.idf')) as f:
+            self.assertEqual(f.read(), 'idf')
+
+    def test_link(self):
+        self.cache.fetch('parsed/site.tar.gz', self.destination('run'), link=True)
+        idf = os.path.join(self.destination('run'), 'site', 'simulation', 'sim.idf')
+        self.assertEqual(os.stat(idf).st_nlink, 2)
+
+    def test_new_etag_is_fetched_again(self):
+        self.cache.fetch('parsed/site.tar.gz', self.destination('run1'))
+        self.bucket.Object.return_value.e_tag = '"def456"'
+        self.assertFalse(self.cache.fetch('parsed/site.tar.gz', self.destination('run2')))
+        self.assertEqual(self.bucket.Object.return_value.get.call_count, 2)
+
+    def test_evict_least_recently_used(self):
+        self.cache.max_bytes = 3
+        self.cache.fetch('parsed/site.tar.gz', self.destination('run1'))
+        os.utime(os.path.join(self.cache_dir, 'abc123'), (0, 0))
+        self.bucket.Object.return_value.e_tag = '"def456"'
+        self.cache.fetch('parsed/site.tar.gz', self.destination('run2'))
+        names = [name for _, name, _ in self.cache.entries()]
+        self.assertEqual(names, ['def456'])
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_no_etag(self):
+        type(self.bucket.Object.return_value).e_tag = PropertyMock(side_effect=Exception('Forbidden'))
+        self.assertFalse(self.cache.fetch('parsed/site.tar.gz', self.destination('run')))
+        self.assertTrue(os.path.exists(os.path.join(self.destination('run'), 'site', 'simulation', 'sim.idf')))
+        self.assertEqual(self.cache.entries(), [])
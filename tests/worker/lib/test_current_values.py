@@ -0,0 +1,53 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.current_values import CurrentValueStore
+
+
+class TestCurrentValueStore(TestCase):
+    def setUp(self):
+        self.redis = MagicMock()
+        self.publisher = MagicMock()
+        self.store = CurrentValueStore(self.redis, 'site', self.publisher, flush_interval=60)
+
+    def test_publish_single_hset(self):
+        self.store.publish({'a': 1.0, 'b': 2.0}, '2020-01-01 00:15:00', 3)
+        self.redis.execute_command.assert_called_once()
+        args = self.redis.execute_command.call_args[0]
+        self.assertEqual(args[:2], ('HSET', 'site:cur'))
+        fields = dict(zip(args[2::2], args[3::2]))
+        self.assertEqual(fields, {'a': 1.0, 'b': 2.0, '_time': '2020-01-01 00:15:00', '_step': 3})
+        self.publisher.publish.assert_not_called()
+
+    def test_flush_writes_latest_values(self):
+        self.store.publish({'a': 1.0, 'b': 2.0})
+        self.store.publish({'a': 3.0})
+        self.store.flush()
+        self.publisher.publish.assert_called_once_with({'a': 3.0, 'b': 2.0})
+        self.store.flush()
+        self.publisher.publish.assert_called_once()
+
+    def test_close_flushes_and_removes_hash(self):
+        self.store.start()
+        self.store.publish({'a': 1.0})
+        self.assertTrue(self.store.close())
+        self.publisher.publish.assert_called_once_with({'a': 1.0})
+        self.redis.delete.assert_called_once_with('site:cur')
+        self.assertFalse(self.store.thread.is_alive())
+
+    def test_failed_flush_keeps_values(self):
+        self.publisher.publish.side_effect = [Exception('mongo down'), 1]
+        self.store.publish({'a': 1.0, 'b': 2.0})
+        with self.assertRaises(Exception):
+            self.store.flush()
+        # b changes while Mongo is down, a is only written by the retry
+        self.store.publish({'b': 3.0})
+        self.store.flush()
+        self.assertEqual(self.publisher.publish.call_args[0][0], {'a': 1.0, 'b': 3.0})
+
+    def test_close_keeps_hash_when_flush_fails(self):
+        self.publisher.publish.side_effect = Exception('mongo down')
+        self.store.publish({'a': 1.0})
+        self.assertFalse(self.store.close())
+        self.redis.delete.assert_not_called()
+        self.assertEqual(self.store.pending, {'a': 1.0})
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import TestCase
+
+import numpy as np
+from scipy import interpolate
+
+from alfalfa_worker.lib.data.data_manager import Data_Manager
+
+
+class Case(object):
+    def __init__(self, fmupath):
+        self.fmupath = fmupath
+
+
+class TestDataManager(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        os.environ['ALFALFA_CACHE_DIR'] = os.path.join(self.tmp_dir, 'cache')
+        self.addCleanup(os.environ.pop, 'ALFALFA_CACHE_DIR')
+
+        self.weather_time = np.arange(0, 3.1536e7 + 1, 3600.)
+        self.occupancy_time = np.arange(0, 3.1536e7 + 1, 7200.)
+        self.fmupath = os.path.join(self.tmp_dir, 'model.fmu')
+        with zipfile.ZipFile(self.fmupath, 'w') as z:
+            z.writestr('resources/kpis.json', json.dumps({'ElectricPower': ['P']}))
+            rows = ['time,TDryBul,notACategory'] + \
+                ['{},{},1'.format(t, 273.15 + 10 * np.sin(t / 86400)) for t in self.weather_time]
+            z.writestr('resources/weather.csv', '\n'.join(rows))
+            rows = ['time,Occupancy'] + ['{},{}'.format(t, int(t / 7200) % 3) for t in self.occupancy_time]
+            z.writestr('resources/occupancy.csv', '\n'.join(rows))
+
+    def test_load_data(self):
+        case = Case(self.fmupath)
+        Data_Manager(testcase=case).load_data_and_kpisjson()
+        self.assertEqual(case.kpi_json, {'ElectricPower': ['P']})
+
+        index = case.data.index.values
+        self.assertEqual(index[1] - index[0], 3600)
+        self.assertEqual(len(index), 8760)
+
+        # Same values as interpolating each column with scipy
+        weather = interpolate.interp1d(self.weather_time, 273.15 + 10 * np.sin(self.weather_time / 86400), kind='linear')
+        occupancy = interpolate.interp1d(self.occupancy_time, (self.occupancy_time / 7200).astype(int) % 3, kind='zero')
+        np.testing.assert_allclose(case.data['TDryBul'].values, weather(index))
+        np.testing.assert_allclose(case.data['Occupancy'].values, occupancy(index))
+        self.assertTrue(case.data['HGloHor'].isnull().all())
+
+    def test_load_cached_data(self):
+        first = Case(self.fmupath)
+        Data_Manager(testcase=first).load_data_and_kpisjson()
+        cached = os.listdir(os.path.join(self.tmp_dir, 'cache', 'data'))
+        self.assertEqual(len(cached), 1)
+
+        second = Case(self.fmupath)
+        manager = Data_Manager(testcase=second)
+        manager._build_data_table = None
+        manager.load_data_and_kpisjson()
+        self.assertTrue(second.data.equals(first.data))
+
+    def test_get_data(self):
+        case = Case(self.fmupath)
+        case.start_time = 3600 * 5
+        case.step = 1800
+        manager = Data_Manager(testcase=case)
+        manager.load_data_and_kpisjson()
+
+        data = manager.get_data(horizon=7200, category='occupancy')
+        self.assertEqual(data['time'], [18000, 19800, 21600, 23400])
+        self.assertEqual(data['Occupancy'], [2.0, 2.0, 0.0, 0.0])
+        self.assertEqual(list(manager._windows.keys()), [(18000, 7200, 1800, 'occupancy')])
+
+        data = manager.get_data(index=np.array([0, 1800, 3600]), category='weather')
+        np.testing.assert_allclose(data['TDryBul'][:2], [273.15, 273.15 + 5 * np.sin(3600 / 86400)])
+        self.assertEqual(len(manager._windows), 1)
+
+        # Repeated windows are served from the cache
+        first = manager.get_data(horizon=7200, category='occupancy', as_arrays=True)
+        second = manager.get_data(horizon=7200, category='occupancy', as_arrays=True)
+        self.assertIs(first['Occupancy'], second['Occupancy'])
+        self.assertFalse(first['Occupancy'].flags.writeable)
+
+        manager.window_cache_size = 2
+        for start in range(3):
+            case.start_time = start * 3600
+            manager.get_data(horizon=3600)
+        self.assertEqual(len(manager._windows), 2)
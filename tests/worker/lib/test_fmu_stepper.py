@@ -0,0 +1,62 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from alfalfa_worker.lib.fmu_stepper import (
+    CoSimulationStepper,
+    SimulateStepper,
+    create_stepper
+)
+
+
+class TestFmuStepper(TestCase):
+    def test_create_stepper(self):
+        fmu = MagicMock()
+        self.assertIsInstance(create_stepper(fmu, {}, ['y']), SimulateStepper)
+        self.assertIsInstance(create_stepper(fmu, {}, ['y'], 'simulate'), SimulateStepper)
+        self.assertIsInstance(create_stepper(fmu, {}, ['y'], 'persistent'), CoSimulationStepper)
+        with self.assertRaises(ValueError):
+            create_stepper(fmu, {}, ['y'], 'unknown')
+
+    def test_simulate_stepper(self):
+        fmu = MagicMock()
+        options = {}
+        stepper = SimulateStepper(fmu, options, ['y'])
+        stepper.step(0, 300, [('u1', 1.0), ('u2', 2.0)], True)
+        kwargs = fmu.simulate.call_args[1]
+        self.assertTrue(options['initialize'])
+        self.assertEqual(kwargs['input'][0], ['u1', 'u2'])
+        self.assertEqual(kwargs['input'][1].tolist(), [[0, 1.0, 2.0]])
+
+        stepper.step(300, 600, [], False)
+        self.assertIsNone(fmu.simulate.call_args[1]['input'])
+        self.assertFalse(options['initialize'])
+
+    def test_co_simulation_stepper(self):
+        fmu = MagicMock()
+        fmu.get.side_effect = [np.array([1.0, 0.0]), np.array([2.0, 5.0]), np.array([3.0, 5.0])]
+        fmu.do_step.return_value = 0
+        stepper = CoSimulationStepper(fmu, {}, ['y', 'u'])
+
+        res = stepper.step(0, 300, [('u', 5.0)], True)
+        fmu.set.assert_called_once_with(['u'], [5.0])
+        fmu.setup_experiment.assert_called_once_with(start_time=0)
+        fmu.initialize.assert_called_once_with()
+        fmu.do_step.assert_called_once_with(0, 300, True)
+        self.assertEqual(res['time'].tolist(), [0, 300])
+        self.assertEqual(res['y'].tolist(), [1.0, 2.0])
+        self.assertEqual(res['u'].tolist(), [0.0, 5.0])
+
+        res = stepper.step(300, 600, [], False)
+        self.assertEqual(fmu.initialize.call_count, 1)
+        self.assertEqual(res['time'].tolist(), [300, 600])
+        self.assertEqual(res['y'].tolist(), [2.0, 3.0])
+
+    def test_co_simulation_stepper_failure(self):
+        fmu = MagicMock()
+        fmu.get.return_value = np.array([1.0])
+        fmu.do_step.return_value = 2
+        stepper = CoSimulationStepper(fmu, {}, ['y'])
+        with self.assertRaises(Exception):
+            stepper.step(0, 300, [], True)
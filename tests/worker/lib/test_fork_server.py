@@ -0,0 +1,100 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+from alfalfa_worker.lib.fork_server import DEFAULT_PRELOAD, ForkServerClient, ForkTimeout
+from alfalfa_worker.lib.job_pool import JobPool
+
+
+class TestForkServer(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = ForkServerClient(sys.executable, os.path.join(self.dir, 'fork.sock'), preload=['json'])
+        self.server.start()
+        deadline = time.time() + 10
+        while not self.server.ready() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(self.server.ready())
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.dir)
+
+    def write_script(self, name, source):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(source)
+        return path
+
+    def test_runs_script_with_arguments(self):
+        script = self.write_script('job.py', (
+            "import os, sys\n"
+            "with open('out.txt', 'w') as f:\n"
+            "    f.write(' '.join(sys.argv[1:]) + ' ' + str(__name__))\n"
+            "sys.exit(int(sys.argv[2]))\n"))
+        process = self.server.launch([sys.executable, script, 'site', '3'], cwd=self.dir)
+        self.assertEqual(process.wait(), 3)
+        self.assertGreaterEqual(process.start_latency, 0)
+        with open(os.path.join(self.dir, 'out.txt')) as f:
+            self.assertEqual(f.read(), 'site 3 __main__')
+
+    def test_terminate(self):
+        script = self.write_script('sleep.py', "import time\ntime.sleep(30)\n")
+        process = self.server.launch([sys.executable, script], cwd=self.dir)
+        self.assertIsNone(process.poll())
+        process.terminate()
+        self.assertEqual(process.wait(), -15)
+
+    def test_job_pool_forks_from_server(self):
+        script = self.write_script('ok.py', "print('ok')\n")
+        pool = JobPool(slots=1, fork_servers={sys.executable: self.server})
+        job = pool.launch('site', [sys.executable, script], 'step_sim')
+        self.assertIsNotNone(job.start_latency)
+        self.assertEqual(job.process.wait(), 0)
+        # Calls which do not run a script are started as new processes
+        pool = JobPool(slots=1, fork_servers={sys.executable: self.server})
+        job = pool.launch('site', [sys.executable, '-c', 'pass'], 'step_sim')
+        self.assertIsNone(job.start_latency)
+        job.process.wait()
+
+
+class TestWedgedForkServer(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        socket_path = os.path.join(self.dir, 'fork.sock')
+        # A server which accepts requests but never starts the jobs
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(socket_path)
+        self.listener.listen(4)
+        self.server = ForkServerClient(sys.executable, socket_path, preload=[], start_timeout=0.2)
+        self.server.process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+
+    def tearDown(self):
+        self.server.stop()
+        self.listener.close()
+        shutil.rmtree(self.dir)
+
+    def test_launch_times_out_and_stops_server(self):
+        start = time.time()
+        with self.assertRaises(ForkTimeout):
+            self.server.launch([sys.executable, 'job.py'], cwd=self.dir)
+        self.assertLess(time.time() - start, 5)
+        self.assertFalse(self.server.alive())
+
+    def test_job_pool_falls_back_to_popen(self):
+        path = os.path.join(self.dir, 'ok.py')
+        with open(path, 'w') as f:
+            f.write("print('ok')\n")
+        pool = JobPool(slots=1, fork_servers={sys.executable: self.server})
+        job = pool.launch('site', [sys.executable, path], 'step_sim')
+        self.assertIsNone(job.start_latency)
+        self.assertEqual(job.process.wait(), 0)
+
+    def test_default_preload_has_no_threaded_modules(self):
+        for module in ('numpy', 'pandas', 'scipy', 'pyfmi'):
+            self.assertNotIn(module, DEFAULT_PRELOAD)
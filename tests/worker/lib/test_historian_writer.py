@@ -0,0 +1,70 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from influxdb.exceptions import InfluxDBClientError
+
+from alfalfa_worker.lib.historian_writer import HistorianWriter, to_line
+
+
+class TestHistorianWriter(TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.writer = HistorianWriter(self.client, 'alfalfa', batch_size=4, flush_interval=0.05, backoff=0.01)
+
+    def tearDown(self):
+        self.writer.close(timeout=5)
+
+    def written_lines(self):
+        lines = []
+        for call in self.client.write_points.call_args_list:
+            lines.extend(call[0][0])
+        return lines
+
+    def test_to_line(self):
+        line = to_line('site 1', 60, {'id': 'a,b', 'point': True}, {'value': 1})
+        self.assertEqual(line, 'site\\ 1,id=a\\,b,point=True value=1.0 60')
+
+    def test_write_is_flushed_by_age(self):
+        self.writer.start()
+        self.writer.write('site', datetime(1970, 1, 1, 0, 1), [({'id': 'a'}, {'value': 2.5})], {'source': 'alfalfa'})
+        self.writer.close(timeout=5)
+        self.assertEqual(self.written_lines(), ['site,id=a,source=alfalfa value=2.5 60'])
+        kwargs = self.client.write_points.call_args[1]
+        self.assertEqual(kwargs['protocol'], 'line')
+        self.assertEqual(kwargs['database'], 'alfalfa')
+        self.assertEqual(self.writer.stats()['written'], 1)
+
+    def test_batches_by_size(self):
+        points = [({'id': str(i)}, {'value': i}) for i in range(2)]
+        for t in range(4):
+            self.writer.write('site', t, points)
+        self.writer.start()
+        self.writer.close(timeout=5)
+        self.assertEqual(len(self.written_lines()), 8)
+        for call in self.client.write_points.call_args_list:
+            self.assertLessEqual(len(call[0][0]), 4)
+
+    def test_drops_when_full(self):
+        writer = HistorianWriter(self.client, 'alfalfa', max_points=3)
+        self.assertTrue(writer.write('site', 0, [({}, {'value': 1})] * 2))
+        self.assertFalse(writer.write('site', 0, [({}, {'value': 1})] * 2))
+        self.assertEqual(writer.queue_depth(), 2)
+        self.assertEqual(writer.dropped, 2)
+
+    def test_retries_connection_errors(self):
+        self.client.write_points.side_effect = [ConnectionError('down'), ConnectionError('down'), True]
+        self.writer.write('site', 0, [({}, {'value': 1})])
+        self.writer.start()
+        self.writer.close(timeout=5)
+        self.assertEqual(self.client.write_points.call_count, 3)
+        self.assertEqual(self.writer.written, 1)
+        self.assertEqual(self.writer.failed, 0)
+
+    def test_client_errors_are_not_retried(self):
+        self.client.write_points.side_effect = InfluxDBClientError('bad point')
+        self.writer.write('site', 0, [({}, {'value': 1})])
+        self.writer.start()
+        self.writer.close(timeout=5)
+        self.assertEqual(self.client.write_points.call_count, 1)
+        self.assertEqual(self.writer.failed, 1)
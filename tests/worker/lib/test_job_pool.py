@@ -0,0 +1,47 @@
+import sys
+import time
+from unittest import TestCase
+
+from alfalfa_worker.lib.job_pool import JobPool
+
+
+class TestJobPool(TestCase):
+    def wait_for_jobs(self, pool, timeout=10):
+        finished = []
+        deadline = time.time() + timeout
+        while pool.jobs and time.time() < deadline:
+            finished.extend(pool.reap())
+            time.sleep(0.05)
+        return finished
+
+    def test_slots_from_env(self):
+        pool = JobPool()
+        self.assertEqual(pool.slots, 1)
+        self.assertEqual(pool.free_slots(), 1)
+        self.assertEqual(JobPool(slots=4).free_slots(), 4)
+
+    def test_launch_and_reap(self):
+        pool = JobPool(slots=2)
+        pool.launch('site-a', [sys.executable, '-c', 'import sys; sys.exit(0)'], 'step_sim')
+        pool.launch('site-b', [sys.executable, '-c', 'import sys; sys.exit(3)'], 'add_site', 'model.osm')
+        self.assertEqual(pool.free_slots(), 0)
+        self.assertTrue(pool.is_running('site-a'))
+
+        finished = {job.key: job for job in self.wait_for_jobs(pool)}
+        self.assertEqual(finished['site-a'].returncode, 0)
+        self.assertEqual(finished['site-b'].returncode, 3)
+        self.assertEqual(finished['site-b'].name, 'model.osm')
+        self.assertEqual(pool.free_slots(), 2)
+
+    def test_launch_rejects_duplicate_and_full(self):
+        pool = JobPool(slots=1)
+        pool.launch('site-a', [sys.executable, '-c', 'import time; time.sleep(5)'], 'step_sim')
+        try:
+            with self.assertRaises(ValueError):
+                pool.launch('site-a', [sys.executable, '-c', 'pass'], 'step_sim')
+            with self.assertRaises(RuntimeError):
+                pool.launch('site-b', [sys.executable, '-c', 'pass'], 'step_sim')
+        finally:
+            terminated = pool.terminate_all()
+        self.assertEqual(len(terminated), 1)
+        self.assertEqual(pool.free_slots(), 1)
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+import numpy as np
+
+from alfalfa_worker.lib.kpi_calculator import KPI_TYPES, KPI, KPICalculator, register_kpi
+
+
+def trapezoid(y, x):
+    return np.sum(np.diff(x) * (y[1:] + y[:-1])) / 2
+
+
+class PeakKPI(KPI):
+    name = 'peak'
+
+    def accumulate(self, time, values):
+        self.integral = max(self.integral, values.max())
+
+
+class TestKPICalculator(TestCase):
+    def setUp(self):
+        time = np.arange(0, 3600 * 3 + 1, 300, dtype=float)
+        self.results = {
+            'time': time,
+            'P1': 1000 + 100 * np.sin(time / 3600),
+            'P2': np.full(time.shape, 500.0),
+            'T': 291.15 + 3 * np.sin(time / 1800),
+        }
+        self.kpi_json = {'ElectricPower': ['P1', 'P2'], 'AirZoneTemperature': ['T'], 'Other': ['T']}
+
+    def test_incremental_matches_full_integral(self):
+        calculator = KPICalculator(self.kpi_json)
+        self.assertEqual(calculator.unsupported, ['Other'])
+        # Add the results a few rows at a time, as TestCase does each step
+        rows = len(self.results['time'])
+        for start in range(0, rows, 4):
+            stored = dict((key, values[:start + 4]) for key, values in self.results.items())
+            calculator.update(stored, start)
+        kpis = calculator.get_kpis()
+
+        time = self.results['time']
+        energy = (trapezoid(self.results['P1'], time) + trapezoid(self.results['P2'], time)) * 2.77778e-7
+        dT = np.clip(273.15 + 20 - self.results['T'], 0, None)
+        self.assertAlmostEqual(kpis['energy'], energy)
+        self.assertAlmostEqual(kpis['comfort'], trapezoid(dT, time) / 3600)
+
+    def test_register_kpi(self):
+        register_kpi('Peak', PeakKPI)
+        self.addCleanup(KPI_TYPES.pop, 'Peak')
+        calculator = KPICalculator({'Peak': ['P1']})
+        calculator.update(self.results, 0)
+        self.assertAlmostEqual(calculator.get_kpis()['peak'], self.results['P1'].max())
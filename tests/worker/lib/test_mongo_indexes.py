@@ -0,0 +1,37 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.mongo_indexes import HOT_QUERIES, INDEXES, audit_queries, ensure_indexes, plan_stages
+
+INDEX_PLAN = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'site_ref_cur'}}
+SCAN_PLAN = {'stage': 'COLLSCAN'}
+
+
+class TestMongoIndexes(TestCase):
+    def test_ensure_indexes(self):
+        db = MagicMock()
+        db.__getitem__.return_value.create_indexes.side_effect = lambda models: [m.document['name'] for m in models]
+        names = ensure_indexes(db)
+        self.assertEqual(len(names), sum(len(indexes) for indexes in INDEXES.values()))
+        self.assertIn('site_ref_dis', names)
+
+    def test_plan_stages(self):
+        self.assertEqual(plan_stages(INDEX_PLAN), ['FETCH', 'IXSCAN'])
+        plan = {'stage': 'OR', 'inputStages': [INDEX_PLAN, SCAN_PLAN]}
+        self.assertEqual(plan_stages(plan), ['OR', 'FETCH', 'IXSCAN', 'COLLSCAN'])
+
+    def test_audit_reports_collection_scans(self):
+        db = MagicMock()
+
+        def explain(collection):
+            plan = SCAN_PLAN if collection == 'sims' else INDEX_PLAN
+            cursor = MagicMock()
+            cursor.explain.return_value = {'queryPlanner': {'winningPlan': plan}}
+            coll = MagicMock()
+            coll.find.return_value = cursor
+            return coll
+
+        db.__getitem__.side_effect = explain
+        report = audit_queries(db)
+        self.assertEqual(len(report), len(HOT_QUERIES))
+        self.assertEqual([q['collection'] for q in report if q['collscan']], ['sims'])
@@ -0,0 +1,39 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.output_publisher import OutputPublisher
+
+
+class TestOutputPublisher(TestCase):
+    def setUp(self):
+        self.recs = MagicMock()
+        self.publisher = OutputPublisher(self.recs)
+
+    def written_ids(self):
+        ops = self.recs.bulk_write.call_args[0][0]
+        return sorted(op._filter["_id"] for op in ops)
+
+    def test_publish_single_bulk_write(self):
+        count = self.publisher.publish({'a': 1.0, 'b': 2.0})
+        self.assertEqual(count, 2)
+        self.recs.bulk_write.assert_called_once()
+        self.assertFalse(self.recs.bulk_write.call_args[1]['ordered'])
+        self.assertEqual(self.written_ids(), ['a', 'b'])
+        op = self.recs.bulk_write.call_args[0][0][0]
+        self.assertEqual(op._doc["$set"]["rec.curStatus"], "s:ok")
+        self.recs.update_one.assert_not_called()
+
+    def test_publish_skips_unchanged(self):
+        self.publisher.publish({'a': 1.0, 'b': 2.0})
+        count = self.publisher.publish({'a': 1.0, 'b': 3.0})
+        self.assertEqual(count, 1)
+        self.assertEqual(self.written_ids(), ['b'])
+
+        self.recs.bulk_write.reset_mock()
+        self.assertEqual(self.publisher.publish({'a': 1.0, 'b': 3.0}), 0)
+        self.recs.bulk_write.assert_not_called()
+
+    def test_reset(self):
+        self.publisher.publish({'a': 1.0})
+        self.publisher.reset()
+        self.assertEqual(self.publisher.publish({'a': 1.0}), 1)
@@ -0,0 +1,63 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from alfalfa_worker.lib.result_store import ResultStore, select_result_variables
+
+
+def result(start, stop, n):
+    time = np.linspace(start, stop, n)
+    return {'time': time, 'y1': time * 2, 'u1': time + 1}
+
+
+class TestResultStore(TestCase):
+    def test_append_skips_first_point(self):
+        store = ResultStore(['y1', 'u1'])
+        store.append(result(0, 60, 3), start=1)
+        store.append(result(60, 120, 3), start=1)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store['time'].tolist(), [30.0, 60.0, 90.0, 120.0])
+        self.assertEqual(store['y1'].tolist(), [60.0, 120.0, 180.0, 240.0])
+
+    def test_grows_capacity(self):
+        store = ResultStore(['y1', 'u1'], capacity=2)
+        for i in range(10):
+            store.append(result(i * 60, (i + 1) * 60, 2), start=1)
+        self.assertEqual(len(store), 10)
+        self.assertEqual(store.capacity, 16)
+        self.assertEqual(store['u1'].tolist(), [(i + 1) * 60 + 1.0 for i in range(10)])
+
+    def test_views_share_time(self):
+        store = ResultStore(['y1', 'u1'])
+        y_store = store.view(['y1'])
+        u_store = store.view(['u1'])
+        store.append(result(0, 60, 2))
+        self.assertEqual(y_store.keys(), ['time', 'y1'])
+        self.assertNotIn('u1', y_store)
+        self.assertEqual(u_store.to_dict(), {'time': [0.0, 60.0], 'u1': [1.0, 61.0]})
+        self.assertTrue(np.shares_memory(y_store['time'], u_store['time']))
+        with self.assertRaises(KeyError):
+            y_store['u1']
+
+    def test_spill_to_disk(self):
+        spill_dir = tempfile.mkdtemp()
+        store = ResultStore(['y1', 'u1'], capacity=2, spill_bytes=3 * 8 * 4, spill_dir=spill_dir)
+        self.assertFalse(store.spilled)
+        for i in range(6):
+            store.append(result(i * 60, (i + 1) * 60, 2), start=1)
+        self.assertTrue(store.spilled)
+        self.assertIsInstance(store.data, np.memmap)
+        self.assertEqual(os.listdir(spill_dir), [os.path.basename(store.spill_path)])
+        self.assertEqual(store['time'].tolist(), [(i + 1) * 60.0 for i in range(6)])
+        store.close()
+        self.assertEqual(os.listdir(spill_dir), [])
+        os.rmdir(spill_dir)
+
+    def test_select_result_variables(self):
+        names = ['TZone_y', 'PHea_y', 'unused_y']
+        kpi_json = {'ElectricPower': ['PHea_y']}
+        self.assertEqual(select_result_variables(names, ['TZone_y'], kpi_json), ['TZone_y', 'PHea_y'])
+        self.assertEqual(select_result_variables(names, [], kpi_json), ['PHea_y'])
+        self.assertEqual(select_result_variables(names, None, kpi_json), names)
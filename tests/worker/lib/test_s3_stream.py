@@ -0,0 +1,66 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest import TestCase
+
+from alfalfa_worker.lib.s3_stream import ParallelRangeReader, extract_tar
+
+
+class FakeObject(object):
+    """Minimal boto3 Object serving its body from memory"""
+
+    def __init__(self, body, fail_range=None):
+        self.key = 'parsed/site.tar.gz'
+        self.body = body
+        self.content_length = len(body)
+        self.fail_range = fail_range
+        self.ranges = []
+
+    def get(self, Range=None):
+        if Range is None:
+            return {'Body': io.BytesIO(self.body)}
+        self.ranges.append(Range)
+        if Range == self.fail_range:
+            raise Exception('Connection reset')
+        start, end = Range.replace('bytes=', '').split('-')
+        return {'Body': io.BytesIO(self.body[int(start):int(end) + 1])}
+
+
+class TestS3Stream(TestCase):
+    def test_parallel_range_reader(self):
+        body = os.urandom(1000)
+        s3_object = FakeObject(body)
+        reader = ParallelRangeReader(s3_object, len(body), chunk_size=64, max_concurrency=3)
+        data = reader.read(10) + reader.read(100) + reader.read()
+        reader.close()
+        self.assertEqual(data, body)
+        self.assertEqual(reader.read(10), b'')
+        self.assertEqual(len(s3_object.ranges), 16)
+        self.assertIn('bytes=960-999', s3_object.ranges)
+
+    def test_parallel_range_reader_error(self):
+        body = os.urandom(1000)
+        reader = ParallelRangeReader(FakeObject(body, fail_range='bytes=128-191'), len(body), chunk_size=64)
+        with self.assertRaises(IOError):
+            reader.read()
+        reader.close()
+
+    def test_extract_tar(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        data = os.urandom(5000)
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+            info = tarfile.TarInfo('site/model.fmu')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        for threshold in (0, 10 ** 6):
+            destination = os.path.join(tmp_dir, str(threshold))
+            s3_object = FakeObject(buffer.getvalue())
+            extract_tar(s3_object, destination, parallel_threshold=threshold, chunk_size=256)
+            with open(os.path.join(destination, 'site', 'model.fmu'), 'rb') as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(bool(s3_object.ranges), threshold == 0)
@@ -0,0 +1,81 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.site_control import (
+    COMPLETE_SCRIPT,
+    StepCompletion,
+    StopReconciler,
+    decode_message,
+    parse_advance_steps,
+    parse_complete_message,
+    parse_control_message,
+    wait_for_message
+)
+
+
+class TestSiteControl(TestCase):
+    def test_decode_message(self):
+        self.assertEqual(decode_message(b'advance'), 'advance')
+        self.assertEqual(decode_message('stop'), 'stop')
+        self.assertIsNone(decode_message(1))
+
+    def test_parse_advance_steps(self):
+        self.assertEqual(parse_advance_steps(b'advance'), 1)
+        self.assertEqual(parse_advance_steps('advance'), 1)
+        self.assertEqual(parse_advance_steps(b'advance:15'), 15)
+        self.assertIsNone(parse_advance_steps(b'advance:0'))
+        self.assertIsNone(parse_advance_steps(b'advance:many'))
+        self.assertIsNone(parse_advance_steps(b'stop'))
+        self.assertIsNone(parse_advance_steps(1))
+
+    def test_wait_for_message_blocks(self):
+        pubsub = MagicMock()
+        pubsub.get_message.return_value = None
+        self.assertIsNone(wait_for_message(pubsub, 2.5))
+        pubsub.get_message.assert_called_once_with(timeout=2.5)
+
+    def test_wait_for_message_past_deadline_does_not_block(self):
+        pubsub = MagicMock()
+        wait_for_message(pubsub, -1)
+        pubsub.get_message.assert_called_once_with(timeout=0)
+
+    def test_parse_complete_message(self):
+        self.assertEqual(parse_complete_message(b'complete:{"time": "2020-01-01 00:15:00", "step": 3}'),
+                         {'time': '2020-01-01 00:15:00', 'step': 3})
+        self.assertIsNone(parse_complete_message(b'complete'))
+        self.assertIsNone(parse_complete_message(b'advance'))
+
+    def test_step_completion_single_script_call(self):
+        redis = MagicMock()
+        completion = StepCompletion(redis, 'site')
+        redis.register_script.assert_called_once_with(COMPLETE_SCRIPT)
+        completion.complete('2020-01-01 00:15:00', 5)
+        redis.register_script.return_value.assert_called_once_with(keys=['site'], args=[5, '2020-01-01 00:15:00'])
+        redis.publish.assert_not_called()
+        redis.hset.assert_not_called()
+
+    def test_parse_control_message(self):
+        self.assertEqual(parse_control_message(b'stop'), 'stop')
+        self.assertEqual(parse_control_message('pause'), 'pause')
+        self.assertEqual(parse_control_message(b'resume'), 'resume')
+        self.assertIsNone(parse_control_message(b'advance'))
+        self.assertIsNone(parse_control_message(1))
+
+    def test_stop_reconciler_reads_once_per_interval(self):
+        now = [0.0]
+        recs = MagicMock()
+        recs.find_one.return_value = {'rec': {'simStatus': 's:Running'}}
+        reconciler = StopReconciler(recs, 'site', interval=30, clock=lambda: now[0])
+        self.assertEqual(reconciler.time_until_due(), 30)
+        self.assertFalse(reconciler.stop_requested())
+        recs.find_one.assert_not_called()
+
+        now[0] = 30
+        self.assertFalse(reconciler.stop_requested())
+        recs.find_one.assert_called_once_with({'_id': 'site'}, {'rec.simStatus': 1})
+        recs.find_one.return_value = {'rec': {'simStatus': 's:Stopping'}}
+        now[0] = 45
+        self.assertFalse(reconciler.stop_requested())
+        now[0] = 60
+        self.assertTrue(reconciler.stop_requested())
+        self.assertEqual(recs.find_one.call_count, 2)
@@ -0,0 +1,101 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.site_host import ChannelDispatcher, HostedConnections, SiteChannel, SiteHost
+
+
+class FakePubSub(object):
+    """Thread safe stand in for a redis PubSub which delivers the messages published to its channels"""
+
+    def __init__(self):
+        self.channels = set()
+        self.messages = []
+        self.condition = threading.Condition()
+
+    def subscribe(self, channel):
+        self.channels.add(channel)
+
+    def unsubscribe(self, channel):
+        self.channels.discard(channel)
+
+    def publish(self, channel, data):
+        with self.condition:
+            if channel in self.channels:
+                self.messages.append({'type': 'message', 'channel': channel.encode(), 'data': data})
+                self.condition.notify()
+
+    def get_message(self, timeout=0):
+        with self.condition:
+            if not self.messages:
+                self.condition.wait(timeout)
+            return self.messages.pop(0) if self.messages else None
+
+
+class TestSiteHost(TestCase):
+    def setUp(self):
+        self.pubsub = FakePubSub()
+        self.dispatcher = ChannelDispatcher(self.pubsub, poll_interval=0.05)
+        self.dispatcher.start()
+
+    def tearDown(self):
+        self.dispatcher.stop()
+
+    def test_messages_routed_by_channel(self):
+        a = SiteChannel(self.dispatcher)
+        b = SiteChannel(self.dispatcher)
+        a.subscribe('site_a')
+        b.subscribe('site_b')
+        self.pubsub.publish('site_b', b'advance')
+        self.assertEqual(b.get_message(timeout=2)['data'], b'advance')
+        self.assertIsNone(a.get_message())
+
+    def test_close_unsubscribes(self):
+        channel = SiteChannel(self.dispatcher)
+        channel.subscribe('site_a')
+        channel.close()
+        # The dispatcher thread unsubscribes
+        deadline = time.time() + 2
+        while 'site_a' in self.pubsub.channels and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn('site_a', self.pubsub.channels)
+        self.pubsub.publish('site_a', b'stop')
+        self.assertIsNone(channel.get_message(timeout=0.2))
+
+    def test_hosted_connections_share_clients(self):
+        connections = MagicMock()
+        channel = SiteChannel(self.dispatcher)
+        hosted = HostedConnections(connections, channel)
+        self.assertIs(hosted.redis_pubsub, channel)
+        self.assertIs(hosted.mongo_db_recs, connections.mongo_db_recs)
+
+    def test_failed_site_is_isolated(self):
+        connections = MagicMock()
+        started = []
+
+        def factory(argv, site_connections):
+            started.append(argv[0])
+            if argv[0] == 'bad':
+                raise RuntimeError('model failed to load')
+            return MagicMock()
+
+        host = SiteHost(connections, 'osm', factory, logger=MagicMock())
+        host.dispatcher = self.dispatcher
+        threads = [host.launch(['bad', 'external_clock']), host.launch(['good', 'external_clock'])]
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(sorted(started), ['bad', 'good'])
+        self.assertEqual(host.sites, {})
+        connections.redis.hset.assert_called_once_with('bad', 'control', 'idle')
+
+    def test_site_started_once(self):
+        event = threading.Event()
+        site = MagicMock()
+        site.run.side_effect = lambda: event.wait(5)
+        host = SiteHost(MagicMock(), 'osm', lambda argv, c: site, logger=MagicMock())
+        host.dispatcher = self.dispatcher
+        thread = host.launch(['site', 'external_clock'])
+        self.assertIsNone(host.launch(['site', 'external_clock']))
+        event.set()
+        thread.join(5)
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from alfalfa_worker.lib.step_scheduler import CATCH_UP, SKIP, SLOW_DOWN, StepScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStepScheduler(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def scheduler(self, policy, **kwargs):
+        # 60 simulated seconds per step at 10x real time, a step every 6 wall seconds
+        scheduler = StepScheduler(60, 10, policy=policy, clock=self.clock, **kwargs)
+        scheduler.start()
+        return scheduler
+
+    def test_on_schedule(self):
+        scheduler = self.scheduler(CATCH_UP)
+        self.assertEqual(scheduler.time_until_due(), 6)
+        self.assertEqual(scheduler.due_steps(), 0)
+        self.clock.now += 6.5
+        self.assertEqual(scheduler.due_steps(), 1)
+        scheduler.steps_taken(1)
+        # The next step stays on the original grid, the latency of this step is not carried over
+        self.assertEqual(scheduler.time_until_due(), 5.5)
+        self.assertEqual(scheduler.lag(), 5.0)
+
+    def test_catch_up(self):
+        scheduler = self.scheduler(CATCH_UP, max_burst=3)
+        self.clock.now += 6 * 5
+        self.assertEqual(scheduler.due_steps(), 3)
+        scheduler.steps_taken(3)
+        self.assertEqual(scheduler.due_steps(), 2)
+        scheduler.steps_taken(2)
+        self.assertEqual(scheduler.due_steps(), 0)
+        self.assertEqual(scheduler.lag(), 0)
+
+    def test_skip(self):
+        scheduler = self.scheduler(SKIP)
+        self.clock.now += 6 * 3 + 1
+        self.assertEqual(scheduler.due_steps(), 1)
+        scheduler.steps_taken(1)
+        self.assertEqual(scheduler.skipped, 2)
+        self.assertEqual(scheduler.time_until_due(), 5)
+        self.assertEqual(scheduler.lag(), 19 * 10 - 60)
+
+    def test_slow_down(self):
+        scheduler = self.scheduler(SLOW_DOWN)
+        self.clock.now += 20
+        self.assertEqual(scheduler.due_steps(), 1)
+        scheduler.steps_taken(1)
+        self.assertEqual(scheduler.time_until_due(), 6)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            StepScheduler(60, 1, policy='faster')
+
+    def test_pause_resume(self):
+        scheduler = self.scheduler(CATCH_UP)
+        self.clock.now += 3
+        scheduler.pause()
+        self.clock.now += 600
+        self.assertEqual(scheduler.due_steps(), 0)
+        scheduler.resume()
+        # The schedule continues where it was paused, without catching up or lagging
+        self.assertEqual(scheduler.time_until_due(), 3)
+        self.assertEqual(scheduler.lag(), 30)
+        self.clock.now += 3
+        self.assertEqual(scheduler.due_steps(), 1)
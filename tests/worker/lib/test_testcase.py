@@ -0,0 +1,100 @@
+import os
+import sys
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+import numpy as np
+
+try:
+    import pyfmi  # noqa: F401
+    # testcase imports the data manager relative to the lib directory, as step_fmu does
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', 'alfalfa_worker', 'lib'))
+    from alfalfa_worker.lib import testcase
+except ImportError:
+    testcase = None
+
+INPUTS = ['oveT_u', 'oveT_activate', 'unused_u']
+OUTPUTS = ['TZone_y', 'PHea_y', 'unused_y']
+KPI_JSON = {'ElectricPower': ['PHea_y']}
+
+
+class FakeFMU(object):
+    def __init__(self):
+        self.simulated = []
+
+    def get_version(self):
+        return '2.0'
+
+    def get_model_variables(self, causality):
+        return dict((name, None) for name in (INPUTS if causality == 2 else OUTPUTS))
+
+    def get_variable_unit(self, var):
+        return 'K'
+
+    def get_variable_description(self, var):
+        return var
+
+    def get_variable_min(self, var):
+        return 0.0
+
+    def get_variable_max(self, var):
+        return 1000.0
+
+    def simulate_options(self):
+        return {'CVode_options': {}}
+
+    def simulate(self, start_time, final_time, options, input):
+        # Only the filtered variables are recorded in the result
+        self.simulated.append(list(options['filter']))
+        time = np.array([start_time, final_time], dtype=float)
+        res = {'time': time}
+        for name in options['filter']:
+            res[name] = time + len(name)
+        return res
+
+
+class FakeDataManager(object):
+    def __init__(self, testcase):
+        self.testcase = testcase
+
+    def load_data_and_kpisjson(self):
+        self.testcase.kpi_json = KPI_JSON
+
+
+@skipUnless(testcase is not None, "pyfmi is not installed")
+class TestTestCaseResults(TestCase):
+    def test_get_results_only_recorded_variables(self):
+        fmu = FakeFMU()
+        with patch.object(testcase, 'load_fmu', return_value=fmu), \
+                patch.object(testcase, 'Data_Manager', FakeDataManager):
+            case = testcase.TestCase(fmupath='/tmp/model.fmu', step=300, stepping='simulate',
+                                     result_variables=['TZone_y', 'oveT_u', 'oveT_activate'])
+        case.advance({'oveT_u': 295.0, 'oveT_activate': 1})
+        case.advance({})
+
+        self.assertEqual(sorted(fmu.simulated[0]), ['PHea_y', 'TZone_y', 'oveT_activate', 'oveT_u'])
+        results = case.get_results()
+        self.assertEqual(sorted(results['y']), ['PHea_y', 'TZone_y', 'time'])
+        self.assertEqual(sorted(results['u']), ['oveT_activate', 'oveT_u', 'time'])
+        self.assertEqual(results['y']['time'], [300.0, 600.0])
+        self.assertEqual(results['y']['TZone_y'], [307.0, 607.0])
+        self.assertNotIn('unused_y', results['y'])
+        self.assertNotIn('unused_u', results['u'])
+        # The inputs and outputs which are not recorded are still exposed
+        self.assertIn('unused_y', case.get_measurements())
+        self.assertIn('unused_u', case.get_inputs())
+
+    def test_close_removes_spill_file(self):
+        fmu = FakeFMU()
+        with patch.object(testcase, 'load_fmu', return_value=fmu), \
+                patch.object(testcase, 'Data_Manager', FakeDataManager), \
+                patch.dict(os.environ, {'ALFALFA_RESULT_SPILL_BYTES': '1024'}):
+            case = testcase.TestCase(fmupath='/tmp/model.fmu', step=300, stepping='simulate',
+                                     result_variables=['TZone_y'])
+        for _ in range(30):
+            case.advance({})
+        spill_path = case.results.spill_path
+        self.assertTrue(case.results.spilled)
+        self.assertTrue(os.path.exists(spill_path))
+        case.close()
+        self.assertFalse(os.path.exists(spill_path))
@@ -0,0 +1,47 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.write_array_cache import WriteArrayCache, current_winning_value
+
+
+def write_array(point_id, val):
+    return {'_id': point_id, 'siteRef': 'site', 'val': val}
+
+
+class TestWriteArrayCache(TestCase):
+    def setUp(self):
+        self.collection = MagicMock()
+        self.collection.find.return_value = [
+            write_array('a', [None, 2.0, 3.0]),
+            write_array('b', [None, None]),
+        ]
+        self.cache = WriteArrayCache(self.collection, 'site')
+
+    def test_current_winning_value(self):
+        self.assertEqual(current_winning_value(write_array('a', [None, 0, 1])), 0)
+        self.assertIsNone(current_winning_value(write_array('a', [None, None])))
+
+    def test_load_once(self):
+        self.assertEqual(self.cache.current_values(), {'a': 2.0})
+        self.assertEqual(self.cache.current_values(), {'a': 2.0})
+        self.collection.find.assert_called_once_with({"siteRef": 'site'})
+
+    def test_write_notification_refreshes_point(self):
+        self.cache.load()
+        self.assertTrue(self.cache.handle_message(b'write:b'))
+        self.assertFalse(self.cache.handle_message(b'advance'))
+
+        self.collection.find.return_value = [write_array('b', [5.0, None])]
+        self.assertEqual(self.cache.current_values(), {'a': 2.0, 'b': 5.0})
+        self.collection.find.assert_called_with({"_id": {"$in": ['b']}})
+
+        # a removed write array no longer has a value
+        self.cache.handle_message('write:a')
+        self.collection.find.return_value = []
+        self.assertEqual(self.cache.current_values(), {'b': 5.0})
+
+    def test_reconcile(self):
+        self.cache.reconcile_interval = 0
+        self.cache.current_values()
+        self.cache.current_values()
+        self.assertEqual(self.collection.find.call_count, 2)
@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from alfalfa_worker.lib.step_scheduler import CATCH_UP, StepScheduler
+from alfalfa_worker.step_sim.osm_model_advancer import OSMModelAdvancer
+
+RUN_PERIOD_BEGIN = datetime(2020, 1, 1, 0, 0, 0)
+STEP = timedelta(minutes=15)
+
+
+class FakeEnergyPlus(object):
+    """Co-simulation stub, after the exchange of step k E+ reports the end of the k-th timestep"""
+
+    def __init__(self):
+        self.kStep = 1
+        self.deltaT = STEP.total_seconds()
+        self.outputs = []
+        self.writes = 0
+
+    def write(self, packet):
+        self.writes += 1
+
+    def read(self):
+        return b''
+
+    def time(self):
+        return RUN_PERIOD_BEGIN + self.kStep * STEP
+
+
+class TestAdvanceToStartTime(TestCase):
+    def advancer(self, start_datetime):
+        # Skip __init__, which downloads the model and starts EnergyPlus
+        advancer = OSMModelAdvancer.__new__(OSMModelAdvancer)
+        advancer.ep = FakeEnergyPlus()
+        advancer.start_datetime = start_datetime
+        advancer.time_steps_per_hour = 4
+        advancer.master_enable_bypass = True
+        advancer.bypass_inputs = (0, 0, 0)
+        advancer.model_logger = MagicMock()
+        advancer.update_db = MagicMock()
+        advancer.get_energyplus_datetime = advancer.ep.time
+        return advancer
+
+    def advance(self, start_datetime):
+        advancer = self.advancer(start_datetime)
+        with patch('mlep.mlep_decode_packet', return_value=(0, 0, [])):
+            advancer.advance_to_start_time()
+        self.assertFalse(advancer.master_enable_bypass)
+        advancer.update_db.assert_called_once()
+        # One exchange per step, no step is sent twice
+        self.assertEqual(advancer.ep.writes, advancer.ep.kStep)
+        return advancer
+
+    def test_count_bypass_steps(self):
+        advancer = self.advancer(datetime(2020, 1, 1, 1, 0, 0))
+        self.assertEqual(advancer.count_bypass_steps(RUN_PERIOD_BEGIN + STEP), 3)
+        self.assertEqual(advancer.count_bypass_steps(datetime(2020, 1, 1, 1, 0, 0)), 0)
+        self.assertEqual(advancer.count_bypass_steps(datetime(2020, 1, 1, 1, 15, 0)), 0)
+
+    def test_start_at_run_period_begin(self):
+        # The first exchange already reaches the start time, no step is bypassed
+        advancer = self.advance(RUN_PERIOD_BEGIN)
+        self.assertEqual(advancer.ep.kStep, 1)
+        self.assertEqual(advancer.ep.time(), RUN_PERIOD_BEGIN + STEP)
+
+    def test_start_on_step_boundary(self):
+        advancer = self.advance(datetime(2020, 1, 1, 1, 0, 0))
+        self.assertEqual(advancer.ep.time(), datetime(2020, 1, 1, 1, 0, 0))
+        self.assertEqual(advancer.ep.kStep, 4)
+
+    def test_start_between_steps(self):
+        # The simulation stops on the first step at or after the start time
+        advancer = self.advance(datetime(2020, 1, 1, 1, 7, 0))
+        self.assertEqual(advancer.ep.time(), datetime(2020, 1, 1, 1, 15, 0))
+        self.assertEqual(advancer.ep.kStep, 5)
+
+    def test_start_days_after_begin(self):
+        advancer = self.advance(datetime(2020, 1, 3, 6, 30, 0))
+        self.assertEqual(advancer.ep.time(), datetime(2020, 1, 3, 6, 30, 0))
+        self.assertEqual(advancer.ep.kStep, (2 * 24 + 6) * 4 + 2)
+
+
+class TestRunTimescale(TestCase):
+    """run_timescale with 60 s steps at 10x real time, a scheduled step every 6 wall clock seconds"""
+
+    def setUp(self):
+        self.now = 100.0
+        self.schedulers = []
+        self.steps = []
+        # Actions run each time the loop waits for a message, each returns the seconds that pass
+        self.events = []
+
+        advancer = OSMModelAdvancer.__new__(OSMModelAdvancer)
+        advancer.ep = MagicMock(status=0, is_running=1)
+        advancer.time_steps_per_hour = 60
+        advancer.step_sim_value = 10
+        advancer.stop = False
+        advancer.paused = False
+        advancer.advance = False
+        advancer.advance_steps = 1
+        advancer.stop_reconciler = MagicMock()
+        advancer.stop_reconciler.time_until_due.return_value = 30
+        advancer.stop_reconciler.stop_requested.return_value = False
+        advancer.advance_to_start_time = MagicMock()
+        advancer.cleanup = MagicMock()
+        advancer.publish_lag = MagicMock()
+        advancer.set_redis_states_after_advance = MagicMock()
+        advancer.process_pubsub_message = self.process_pubsub_message
+        advancer.step_and_update_db = self.step_and_update_db
+        self.advancer = advancer
+        self.timeouts = []
+
+    def scheduler(self, step_seconds, time_scale):
+        scheduler = StepScheduler(step_seconds, time_scale, policy=CATCH_UP, clock=lambda: self.now)
+        self.schedulers.append(scheduler)
+        return scheduler
+
+    def process_pubsub_message(self, timeout=0):
+        self.timeouts.append(timeout)
+        if not self.events:
+            self.advancer.stop = True
+            return
+        self.now += self.events.pop(0)(timeout)
+
+    def step_and_update_db(self, steps=1):
+        self.steps.append((self.now, steps))
+        return steps
+
+    def run_timescale(self):
+        with patch('alfalfa_worker.step_sim.osm_model_advancer.StepScheduler', self.scheduler):
+            self.advancer.run_timescale()
+        self.advancer.cleanup.assert_called_once()
+        return self.schedulers[0]
+
+    def wait(self, timeout):
+        return timeout
+
+    def advance_request(self, after):
+        def event(timeout):
+            self.advancer.advance = True
+            return after
+        return event
+
+    def test_manual_advance_does_not_move_schedule(self):
+        self.events = [self.advance_request(2), self.wait]
+        scheduler = self.run_timescale()
+        # The requested step is taken at once, the scheduled step still comes 6 s after the start
+        self.assertEqual(self.steps, [(102.0, 1), (106.0, 1)])
+        self.assertEqual(self.timeouts[:2], [6, 4])
+        self.assertEqual(scheduler.steps, 1)
+        self.assertEqual(self.advancer.set_redis_states_after_advance.call_count, 2)
+
+    def test_schedule_moves_by_steps_taken(self):
+        def stops_early(steps=1):
+            # E+ stops after the first of the steps
+            self.steps.append((self.now, steps))
+            self.advancer.ep.status = 1
+            return 1
+
+        self.advancer.step_and_update_db = stops_early
+        self.events = [lambda timeout: 18]
+        scheduler = self.run_timescale()
+        self.assertEqual(self.steps, [(118.0, 3)])
+        self.assertEqual(scheduler.steps, 1)
+        self.assertAlmostEqual(scheduler.lag(), 120)
+        self.advancer.set_redis_states_after_advance.assert_called_once_with(1)
@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from alfalfa_worker.step_sim.step_osm.parse_variables import ParseVariables
+
+VARIABLES_CFG = """<?xml version="1.0" encoding="ISO-8859-1"?>
+<BCVTB-variables>
+  <variable source="EnergyPlus">
+    <EnergyPlus name="EMS" type="current_month"/>
+  </variable>
+  <variable source="EnergyPlus">
+    <EnergyPlus name="Node 1" type="System Node Temperature"/>
+  </variable>
+  <variable source="Ptolemy">
+    <EnergyPlus variable="MasterEnable"/>
+  </variable>
+  <variable source="EnergyPlus">
+    <EnergyPlus name="Zone 1" type="Zone Mean Air Temperature"/>
+  </variable>
+  <variable source="Ptolemy">
+    <EnergyPlus variable="Zone_1_Setpoint"/>
+  </variable>
+</BCVTB-variables>
+"""
+
+MAPPING = [
+    {"id": "r:zone_temp", "source": "EnergyPlus", "name": "Zone 1", "type": "Zone Mean Air Temperature", "variable": ""},
+    {"id": "r:node_temp", "source": "EnergyPlus", "name": "Node 1", "type": "System Node Temperature", "variable": ""},
+    {"id": "r:missing", "source": "EnergyPlus", "name": "Node 2", "type": "System Node Temperature", "variable": ""},
+    {"id": "r:zone_sp", "source": "Ptolemy", "name": "", "type": "", "variable": "Zone_1_Setpoint"},
+]
+
+HAYSTACK = [
+    {"id": "r:zone_temp", "dis": "s:Zone 1 Temp"},
+    {"id": "r:node_temp", "dis": "s:Node 1 Temp"},
+]
+
+
+class TestParseVariables(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        paths = []
+        for name, content in [('variables.cfg', VARIABLES_CFG),
+                              ('mapping.json', json.dumps(MAPPING)),
+                              ('haystack.json', json.dumps(HAYSTACK))]:
+            path = os.path.join(self.tmp_dir.name, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            paths.append(path)
+        self.variables = ParseVariables(*paths)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_indexes(self):
+        self.assertEqual(self.variables.output_index_from_type_and_name('current_month', 'EMS'), 0)
+        self.assertEqual(self.variables.get_output_index('zone_temp'), 2)
+        self.assertEqual(self.variables.get_output_index('missing'), -1)
+        self.assertEqual(self.variables.input_index_from_variable_name('MasterEnable'), 0)
+        self.assertEqual(self.variables.get_input_index('zone_sp'), 1)
+        self.assertEqual(self.variables.get_input_index('unknown'), -1)
+
+    def test_output_table(self):
+        self.assertEqual(self.variables.output_table,
+                         [('zone_temp', 2, 'Zone 1 Temp'), ('node_temp', 1, 'Node 1 Temp')])
+        self.assertEqual(self.variables.invalid_output_ids, ['missing'])
+        self.assertEqual(self.variables.output_index_array.tolist(), [2, 1])
+
+    def test_gather_outputs(self):
+        outputs = self.variables.gather_outputs((1.0, 20.5, 21.5))
+        self.assertEqual(outputs, {'zone_temp': 21.5, 'node_temp': 20.5})
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from alfalfa_worker.step_sim.step_sim_utils import valid_date
+from alfalfa_worker.step_sim.step_sim_utils import step_sim_arg_parser, valid_date
 from datetime import datetime
 
 
@@ -17,3 +17,9 @@ class TestStepSimUtils(TestCase):
         with self.assertRaises(Exception) as exc:
             valid_date(date)
         self.assertEqual(f"Not a valid date: '{date}'", str(exc.exception))
+
+    def test_parse_argv(self):
+        args = step_sim_arg_parser(['site', 'timescale', '2019-01-01 00:00:00', '2019-01-02 00:00:00',
+                                    '--step_sim_value=5'])
+        self.assertEqual(args.site_id, 'site')
+        self.assertEqual(args.step_sim_value, 5)
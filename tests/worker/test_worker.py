@@ -0,0 +1,50 @@
+import json
+import signal
+import sys
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from alfalfa_worker.lib.job_pool import JobPool
+from alfalfa_worker.worker import Worker, WorkerShutdown
+
+
+class TestWorker(TestCase):
+    def setUp(self):
+        # Skip __init__, which connects and changes to the alfalfa_worker directory
+        self.worker = Worker.__new__(Worker)
+        self.worker.worker_logger = MagicMock()
+        self.worker.job_pool = JobPool(slots=2, fork_servers={})
+        self.worker.step_sim = MagicMock()
+
+    def tearDown(self):
+        self.worker.job_pool.terminate_all()
+
+    def message(self, site_id):
+        message = MagicMock()
+        message.body = json.dumps({'op': 'InvokeAction', 'action': 'runSite', 'id': site_id, 'externalClock': 'true'})
+        return message
+
+    def test_step_sim_of_running_site_left_on_queue(self):
+        self.worker.job_pool.launch('site', [sys.executable, '-c', 'import time; time.sleep(30)'], 'step_sim')
+        message = self.message('site')
+        self.worker.process_message(message)
+        message.delete.assert_not_called()
+        self.worker.step_sim.assert_not_called()
+
+        message = self.message('other')
+        self.worker.process_message(message)
+        message.delete.assert_called_once()
+        self.worker.step_sim.assert_called_once()
+
+    def test_shutdown_terminates_jobs(self):
+        job = self.worker.job_pool.launch('site', [sys.executable, '-c', 'import time; time.sleep(30)'], 'step_sim')
+        self.worker.process_queue = MagicMock(side_effect=WorkerShutdown())
+        self.worker.ac = MagicMock()
+        handler = signal.getsignal(signal.SIGTERM)
+        try:
+            with self.assertRaises(WorkerShutdown):
+                self.worker.run()
+        finally:
+            signal.signal(signal.SIGTERM, handler)
+        self.assertIsNotNone(job.returncode)
+        self.assertEqual(self.worker.job_pool.jobs, {})